@@ -0,0 +1,125 @@
+"""Throughput benchmark of sbom_export_cli against the local mock Mend API
+
+Every scenario runs the CLI in a subprocess against a fresh MockMendServer and reports wall time,
+projects/sec, peak RSS of the CLI process and the number of API requests per phase, e.g.:
+    python benchmarks/benchmark.py --sizes 10,100 --types spdx,cdx --lictext false,true --json results.json
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_server import MockMendServer, MockOrg, make_token  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASES = {
+    "discovery": ("login", "getOrganizationProjectVitals", "getProductProjectVitals", "getAllProjects",
+                  "getProjectVitals"),
+    "licenses": ("getProjectAttributionReport",),
+    "reports": ("getProjectSpdxReport", "generateProjectReportAsync", "getAsyncProcessStatus", "downloadAsyncReport"),
+}
+
+
+def split_list(value: str) -> list:
+    return [x.strip() for x in value.split(",") if x.strip()]
+
+
+def run_cli(cli_args: list, log_path: str) -> dict:
+    """Runs the CLI and returns its exit code, wall time and peak RSS (Linux/macOS only)"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")])))
+    start = time.perf_counter()
+    with open(log_path, "w") as log_file:
+        proc = subprocess.Popen([sys.executable, "-m", "mend_sbom_export_cli.sbom_export_cli"] + cli_args,
+                                stdout=log_file, stderr=subprocess.STDOUT, env=env)
+        _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {"exit_code": os.waitstatus_to_exitcode(status), "seconds": elapsed, "peak_rss_mb": peak_rss / 1024 / 1024}
+
+
+def run_scenario(args, size: int, type_: str, lictext: str) -> dict:
+    org = MockOrg(projects=size, products=args.products, components=args.components, skew=args.skew)
+    server = MockMendServer(org, latency=args.latency, async_duration=args.async_duration,
+                            error_rate=args.error_rate, throttle_rate=args.throttle_rate).start()
+    out_dir = tempfile.mkdtemp(prefix="sbom_bench_")
+    try:
+        cli_args = ["--user-key", "u" * 64, "--api-key", make_token("org", 0), "--url", server.url,
+                    "--dir", out_dir, "--type", type_, "--licensetext", lictext,
+                    "--threads", str(args.threads), "--engine", args.engine] + args.cli_args
+        res = run_cli(cli_args, os.path.join(tempfile.gettempdir(), f"sbom_bench_{type_}_{lictext}_{size}.log"))
+        reports = [x for x in os.listdir(out_dir) if not x.startswith(".")]
+        res.update({
+            "projects": size,
+            "type": type_,
+            "licensetext": lictext,
+            "engine": args.engine,
+            "threads": args.threads,
+            "reports": len(reports),
+            "projects_per_sec": len(reports) / res["seconds"] if res["seconds"] else 0,
+            "output_mb": sum(os.path.getsize(os.path.join(out_dir, x)) for x in reports) / 1024 / 1024,
+            "requests": {phase: sum(server.counters.get(x, 0) for x in types_) for phase, types_ in PHASES.items()},
+            "request_types": dict(server.counters),
+        })
+        return res
+    finally:
+        server.stop()
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def print_results(results: list):
+    header = f"{'type':<5} {'lic':<5} {'projects':>8} {'reports':>7} {'seconds':>8} {'prj/s':>8} {'rss MB':>7} " \
+             f"{'discovery':>9} {'licenses':>8} {'reports':>8}"
+    print(header)
+    print("-" * len(header))
+    for res in results:
+        print(f"{res['type']:<5} {res['licensetext']:<5} {res['projects']:>8} {res['reports']:>7} "
+              f"{res['seconds']:>8.2f} "
+              f"{res['projects_per_sec']:>8.2f} {res['peak_rss_mb']:>7.1f} {res['requests']['discovery']:>9} "
+              f"{res['requests']['licenses']:>8} {res['requests']['reports']:>8}"
+              f"{'' if res['exit_code'] == 0 else '  (exit code ' + str(res['exit_code']) + ')'}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="sbom_export_cli throughput benchmark")
+    parser.add_argument("--sizes", default="10,100", help="Comma-separated org sizes (number of projects)")
+    parser.add_argument("--types", default="spdx,cdx", help="Comma-separated report types")
+    parser.add_argument("--lictext", default="false,true", help="Comma-separated --licensetext values")
+    parser.add_argument("--engine", default="thread", help="CLI execution engine (thread or async)")
+    parser.add_argument("--threads", type=int, default=10, help="CLI --threads value")
+    parser.add_argument("--products", type=int, default=5)
+    parser.add_argument("--components", type=int, default=200, help="Components per project (mean if skewed)")
+    parser.add_argument("--skew", type=float, default=0.0, help="Spread of project sizes, 0 - all projects equal")
+    parser.add_argument("--latency", type=float, default=0.02, help="Mean latency of a mock request in seconds")
+    parser.add_argument("--async-duration", type=float, default=1.0,
+                        help="Duration of a mock CDX report job in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with HTTP 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with HTTP 429")
+    parser.add_argument("--json", dest="json_out", default="", help="Write the results to this JSON file")
+    parser.add_argument("cli_args", nargs=argparse.REMAINDER, help="Extra CLI arguments, after --")
+    args = parser.parse_args()
+    args.cli_args = [x for x in args.cli_args if x != "--"]
+    return args
+
+
+def main():
+    args = parse_args()
+    results = []
+    for size, type_, lictext in itertools.product([int(x) for x in split_list(args.sizes)], split_list(args.types),
+                                                  split_list(args.lictext)):
+        results.append(run_scenario(args, size, type_, lictext))
+    print_results(results)
+    if args.json_out:
+        with open(args.json_out, "w") as out_file:
+            json.dump(results, out_file, indent=2)
+    return 0 if all(x["exit_code"] == 0 for x in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,311 @@
+"""Local stand-in for the Mend API v1.4 requests used by sbom_export_cli
+
+Run standalone:
+    python benchmarks/mock_server.py --projects 1000 --components 500 --port 8080
+and point the CLI at it with --url http://127.0.0.1:8080
+"""
+import argparse
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+import uuid
+import zipfile
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LICENSES = ["Apache-2.0", "MIT", "BSD-3-Clause", "GPL-2.0-only", "LGPL-2.1-only", "MPL-2.0", "ISC", "EPL-2.0"]
+
+
+def make_token(kind: str, idx: int) -> str:
+    return hashlib.sha256(f"{kind}-{idx}".encode()).hexdigest()
+
+
+class MockOrg:
+    """Deterministic org content: products, projects and the libraries of each project"""
+
+    def __init__(self, projects: int = 100, products: int = 5, components: int = 200, skew: float = 0.0,
+                 libraries: int = 5000, lic_text_size: int = 8000, seed: int = 0):
+        self.products = [{"name": f"Product {i}", "token": make_token("product", i)} for i in range(max(products, 1))]
+        self.projects = []
+        self.libraries = libraries
+        self.lic_text_size = lic_text_size
+        self.seed = seed
+        for i in range(projects):
+            rnd = random.Random(f"{seed}-{i}")
+            size = int(components * rnd.paretovariate(1 + 1 / skew) / (1 + skew)) if skew > 0 else components
+            product = self.products[i % len(self.products)]
+            self.projects.append({
+                "name": f"Project {i}",
+                "token": make_token("project", i),
+                "productName": product["name"],
+                "productToken": product["token"],
+                "creationDate": "2024-01-01 00:00:00",
+                "lastUpdatedDate": "2024-06-01 00:00:00",
+                "components": max(size, 1),
+            })
+        self.by_token = {x["token"]: x for x in self.projects}
+        self._lic_texts = {lic_: f"{lic_} license text\n" + ("Lorem ipsum dolor sit amet. " * (lic_text_size // 28))
+                           for lic_ in LICENSES}
+
+    def project_libraries(self, project: dict) -> list:
+        rnd = random.Random(f"{self.seed}-{project['token']}")
+        res = []
+        for lib_id in rnd.sample(range(self.libraries), min(project["components"], self.libraries)):
+            res.append({
+                "name": f"lib{lib_id}",
+                "version": f"{lib_id % 7}.{lib_id % 13}.{lib_id % 5}",
+                "licenses": [LICENSES[lib_id % len(LICENSES)]] + (
+                    [LICENSES[(lib_id // 3) % len(LICENSES)]] if lib_id % 4 == 0 else []),
+            })
+        return res
+
+    @staticmethod
+    def vitals(project: dict) -> dict:
+        return {k: project[k] for k in ("name", "token", "productName", "creationDate", "lastUpdatedDate")}
+
+    def attribution(self, project: dict) -> dict:
+        return {"detail": {"libraries": [
+            {"library": lib_["name"], "version": lib_["version"],
+             "licenses": [{"license": lic_, "licenseText": self._lic_texts[lic_]} for lic_ in lib_["licenses"]]}
+            for lib_ in self.project_libraries(project)]}}
+
+    @staticmethod
+    def library_dependencies(libraries: list) -> list:
+        """Every third library depends on the next one"""
+        return [(lib_, libraries[i + 1]) for i, lib_ in enumerate(libraries[:-1]) if i % 3 == 0]
+
+    def spdx(self, project: dict) -> dict:
+        libraries = self.project_libraries(project)
+        return {
+            "spdxVersion": "SPDX-2.2",
+            "dataLicense": "CC0-1.0",
+            "SPDXID": "SPDXRef-DOCUMENT",
+            "name": project["name"],
+            "documentNamespace": f"http://mock.mend.local/{project['token']}",
+            "packages": [{
+                "SPDXID": f"SPDXRef-PACKAGE-{lib_['name']}",
+                "name": lib_["name"],
+                "versionInfo": lib_["version"],
+                "licenseConcluded": " AND ".join(lib_["licenses"]),
+                "licenseDeclared": " AND ".join(lib_["licenses"]),
+                "externalRefs": [{"referenceCategory": "PACKAGE-MANAGER", "referenceType": "purl",
+                                  "referenceLocator": f"pkg:maven/org.mock/{lib_['name']}@{lib_['version']}"}],
+            } for lib_ in libraries],
+            "relationships": [{"spdxElementId": f"SPDXRef-PACKAGE-{lib_['name']}", "relationshipType": "DEPENDS_ON",
+                               "relatedSpdxElement": f"SPDXRef-PACKAGE-{dep_['name']}"}
+                              for lib_, dep_ in self.library_dependencies(libraries)],
+        }
+
+    def cyclonedx(self, project: dict) -> dict:
+        libraries = self.project_libraries(project)
+        deps = {lib_["name"]: dep_ for lib_, dep_ in self.library_dependencies(libraries)}
+        return {
+            "bomFormat": "CycloneDX",
+            "specVersion": "1.4",
+            "version": 1,
+            "metadata": {"component": {"type": "application", "name": project["name"]}},
+            "components": [{
+                "type": "library",
+                "bom-ref": f"pkg:maven/org.mock/{lib_['name']}@{lib_['version']}",
+                "name": lib_["name"],
+                "version": lib_["version"],
+                "purl": f"pkg:maven/org.mock/{lib_['name']}@{lib_['version']}",
+                "licenses": [{"license": {"id": lic_}} for lic_ in lib_["licenses"]],
+            } for lib_ in libraries],
+            "dependencies": [{
+                "ref": f"pkg:maven/org.mock/{lib_['name']}@{lib_['version']}",
+                "dependsOn": [f"pkg:maven/org.mock/{deps[lib_['name']]['name']}@{deps[lib_['name']]['version']}"]
+                if lib_["name"] in deps else [],
+            } for lib_ in libraries],
+        }
+
+
+class MockMendServer:
+    """Threaded HTTP server answering /api/v1.4 requests from a MockOrg
+
+    `latency` is the mean service time of every request, `async_duration` the time a CDX report job takes,
+    `error_rate` and `throttle_rate` the share of requests answered with HTTP 503 and 429 respectively.
+    """
+
+    def __init__(self, org: MockOrg, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 async_duration: float = 2.0, error_rate: float = 0.0, throttle_rate: float = 0.0):
+        self.org = org
+        self.latency = latency
+        self.async_duration = async_duration
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.jobs = {}
+        self.counters = defaultdict(int)
+        self.bytes_sent = defaultdict(int)
+        self._lock = threading.Lock()
+        self._rnd = random.Random(org.seed)
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockMendServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.counters.clear()
+            self.bytes_sent.clear()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                try:
+                    request = json.loads(body)
+                except ValueError:
+                    request = {}
+                status, headers, payload = server.handle(request, self.path)
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def handle(self, request: dict, path: str):
+        request_type = request.get("requestType", "login" if path.endswith("/login") else "")
+        with self._lock:
+            self.counters[request_type] += 1
+            draw = self._rnd.random()
+        if self.latency:
+            time.sleep(self._rnd.expovariate(1 / self.latency))
+        if draw < self.throttle_rate:
+            return 429, {"Retry-After": "1"}, b""
+        if draw < self.throttle_rate + self.error_rate:
+            return 503, {}, b""
+
+        handler = getattr(self, f"_on_{request_type}", None)
+        res = handler(request) if handler else {"errorCode": 5001,
+                                                "errorMessage": f"Unsupported request {request_type}"}
+        if isinstance(res, bytes):
+            headers, payload = {"Content-Type": "application/octet-stream"}, res
+        else:
+            headers, payload = {"Content-Type": "application/json"}, json.dumps(res).encode("utf-8")
+        with self._lock:
+            self.bytes_sent[request_type] += len(payload)
+        return 200, headers, payload
+
+    def _project(self, request: dict):
+        return self.org.by_token.get(request.get("projectToken"))
+
+    @staticmethod
+    def _error(msg: str) -> dict:
+        return {"errorCode": 2015, "errorMessage": msg}
+
+    def _on_login(self, request: dict) -> dict:
+        return {"retVal": {"jwtToken": "mock-jwt", "orgUuid": str(uuid.UUID(make_token("org", 0)[:32]))}}
+
+    def _on_getOrganizationProjectVitals(self, request: dict) -> dict:
+        return {"projectVitals": [self.org.vitals(x) for x in self.org.projects]}
+
+    def _on_getProductProjectVitals(self, request: dict) -> dict:
+        return {"projectVitals": [self.org.vitals(x) for x in self.org.projects
+                                  if x["productToken"] == request.get("productToken")]}
+
+    def _on_getAllProjects(self, request: dict) -> dict:
+        if request.get("productToken") not in {x["token"] for x in self.org.products}:
+            return self._error("Product not found")
+        return {"projects": [{"projectName": x["name"], "projectToken": x["token"]}
+                             for x in self.org.projects if x["productToken"] == request.get("productToken")]}
+
+    def _on_getProjectVitals(self, request: dict) -> dict:
+        project = self._project(request)
+        return {"projectVitals": [self.org.vitals(project)]} if project else self._error("Project not found")
+
+    def _on_getProjectAttributionReport(self, request: dict) -> dict:
+        project = self._project(request)
+        return self.org.attribution(project) if project else self._error("Project not found")
+
+    def _on_getProjectSpdxReport(self, request: dict) -> dict:
+        project = self._project(request)
+        return self.org.spdx(project) if project else self._error("Project not found")
+
+    def _on_generateProjectReportAsync(self, request: dict) -> dict:
+        project = self._project(request)
+        if not project:
+            return self._error("Project not found")
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self.jobs[job_id] = (time.monotonic() + self.async_duration, project)
+        return {"asyncProcessStatus": {"uuid": job_id, "status": "PENDING", "contextType": "PROJECT"}}
+
+    def _on_getAsyncProcessStatus(self, request: dict) -> dict:
+        job = self.jobs.get(request.get("uuid"))
+        if not job:
+            return self._error("Process not found")
+        status = "SUCCESS" if time.monotonic() >= job[0] else "IN_PROGRESS"
+        return {"asyncProcessStatus": {"uuid": request.get("uuid"), "status": status}}
+
+    def _on_downloadAsyncReport(self, request: dict):
+        job = self.jobs.get(request.get("reportStatusUUID"))
+        if not job or time.monotonic() < job[0]:
+            return self._error("Report is not ready")
+        project = job[1]
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+            zip_ref.writestr(f"{project['name']}-CycloneDX.json", json.dumps(self.org.cyclonedx(project), indent=2))
+        return buf.getvalue()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Mock Mend API server for sbom_export_cli benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--projects", type=int, default=100, help="Number of projects in the org")
+    parser.add_argument("--products", type=int, default=5, help="Number of products in the org")
+    parser.add_argument("--components", type=int, default=200, help="Components per project (mean if skewed)")
+    parser.add_argument("--skew", type=float, default=0.0, help="Spread of project sizes, 0 - all projects equal")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean latency of a request in seconds")
+    parser.add_argument("--async-duration", type=float, default=2.0, help="Duration of a CDX report job in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with HTTP 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with HTTP 429")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    org = MockOrg(projects=args.projects, products=args.products, components=args.components, skew=args.skew)
+    server = MockMendServer(org, host=args.host, port=args.port, latency=args.latency,
+                            async_duration=args.async_duration, error_rate=args.error_rate,
+                            throttle_rate=args.throttle_rate)
+    print(f"Mock Mend API listening on {server.url}")
+    print(f"Org token: {make_token('org', 0)}")
+    print(f"Product tokens: {','.join(x['token'] for x in org.products)}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+import hashlib
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+from mend_sbom_export_cli._version import __tool_name__, __version__
+from mend_sbom_export_cli.output import COMPRESSION_SUFFIXES, open_report
+from mend_sbom_export_cli.streaming import ReportFeed
+
+logger = logging.getLogger(__tool_name__)
+
+AGGREGATE_SCOPES = ("product", "org")
+DEPENDENCY_BUCKETS = 16  # spool files of the CDX dependency edges, grouped by ref one file at a time
+
+
+def get_digest(*parts) -> bytes:
+    return hashlib.blake2b("\0".join(parts).encode("utf-8"), digest_size=16).digest()
+
+
+def get_spdx_purl(package: dict) -> str:
+    return next((ref_.get("referenceLocator", "") for ref_ in package.get("externalRefs", [])
+                 if ref_.get("referenceType") == "purl"), "")
+
+
+class AggregateGroup:
+    """Unique elements of one aggregated document, spooled to disk as JSON lines
+
+    Only the 16-byte digest of every element key and its id in the merged document are kept in memory. The CDX
+    dependency edges are spooled to DEPENDENCY_BUCKETS files by ref and merged per ref when the document is written.
+    """
+
+    def __init__(self, spool_dir: str, index: int, name: str, sections: tuple, dependencies: bool = False):
+        self.name = name
+        self.projects = 0
+        self.spec_version = ""
+        self.ids = {}  # element key digest -> id in the merged document
+        self.used_ids = set()
+        self.seen = set()  # digests of elements without an id (relationships, dependency edges)
+        self.counts = dict.fromkeys(sections, 0)
+        self.dep_sections = tuple(f"dependencies-{i}" for i in range(DEPENDENCY_BUCKETS)) if dependencies else ()
+        self.spools = {x: os.path.join(spool_dir, f"{index}-{x}.jsonl") for x in sections + self.dep_sections}
+        self._pending = {x: [] for x in self.spools}
+
+    def register(self, key_digest: bytes, id_: str):
+        """Returns the id of the element in the merged document and whether the element is new
+
+        An id already taken by another element gets the hash of the element key as a suffix.
+        """
+        merged_id = self.ids.get(key_digest)
+        if merged_id is not None:
+            return merged_id, False
+        merged_id = id_ if id_ not in self.used_ids else f"{id_}-{key_digest.hex()[:12]}"
+        self.ids[key_digest] = merged_id
+        self.used_ids.add(merged_id)
+        return merged_id, True
+
+    def append(self, section: str, element: dict):
+        self._pending[section].append(json.dumps(element, ensure_ascii=False))
+        self.counts[section] += 1
+
+    def append_dependency(self, ref_: str, dep_ref: str = ""):
+        """Adds the edge ref -> dep_ref, or only the ref without `dep_ref`"""
+        edge_digest = get_digest("dependency", ref_, dep_ref)
+        if edge_digest not in self.seen:
+            self.seen.add(edge_digest)
+            bucket = self.dep_sections[zlib.crc32(ref_.encode("utf-8")) % DEPENDENCY_BUCKETS]
+            self._pending[bucket].append(json.dumps([ref_, dep_ref], ensure_ascii=False))
+
+    def flush(self):
+        """Appends the new elements of the last report to the spool files, which stay closed between reports"""
+        for section, lines in self._pending.items():
+            if not lines:
+                continue
+            with open(self.spools[section], "a", encoding="utf-8") as spool:
+                spool.writelines(f"{line}\n" for line in lines)
+            lines.clear()
+
+    def iter_section(self, section: str):
+        if not os.path.exists(self.spools[section]):
+            return
+        with open(self.spools[section], encoding="utf-8") as spool:
+            for line in spool:
+                yield json.loads(line)
+
+    def iter_dependencies(self):
+        for section in self.dep_sections:
+            dependencies = {}  # bom-ref -> set of bom-refs, of the refs of this bucket only
+            for ref_, dep_ref in self.iter_section(section):
+                refs = dependencies.setdefault(ref_, set())
+                if dep_ref:
+                    refs.add(dep_ref)
+            for ref_, refs in dependencies.items():
+                yield {"ref": ref_, "dependsOn": sorted(refs)}
+
+    def close(self):
+        for path in self.spools.values():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class AggregateReport:
+    """Elements of one project report, collected while the report is written and merged into the group by finish()
+
+    The elements already in the group are kept as their digest only.
+    """
+
+    def __init__(self, aggregator: "SbomAggregator", group: AggregateGroup):
+        self.aggregator = aggregator
+        self.group = group
+        self.spdx = aggregator.sbom_type == "spdx"
+        self.keys = {"spdxVersion", "packages", "hasExtractedLicensingInfos", "relationships"} if self.spdx else \
+            {"specVersion", "components", "dependencies"}
+        self.spec_version = ""
+        self.elements = []  # (section, key digest, id, element or None when the group already has it)
+        self.links = []  # SPDX relationships and CDX dependencies, merged once the ids of the report are known
+
+    def add(self, key_: str, value):
+        if key_ in ("spdxVersion", "specVersion"):
+            self.spec_version = value
+        elif key_ in ("relationships", "dependencies"):
+            self.links.append(value)
+        elif key_ == "packages":
+            id_ = value.get("SPDXID", "")
+            self.add_element("packages", get_digest("package", get_spdx_purl(value) or id_), id_, value)
+        elif key_ == "hasExtractedLicensingInfos":
+            id_ = value.get("licenseId", "")
+            self.add_element("licenses", get_digest("license", id_, value.get("extractedText", "")), id_, value)
+        else:
+            ref_ = value.get("bom-ref") or value.get("purl") or f"{value.get('name')}@{value.get('version')}"
+            self.add_element("components", get_digest("component", value.get("purl") or ref_), ref_, value)
+
+    def add_element(self, section: str, key_digest: bytes, id_: str, element: dict):
+        self.elements.append((section, key_digest, id_, None if key_digest in self.group.ids else element))
+
+    def finish(self):
+        with self.aggregator.lock:
+            group = self.group
+            group.projects += 1
+            group.spec_version = group.spec_version or self.spec_version
+            id_map = {}
+            for section, key_digest, id_, element in self.elements:
+                merged_id, is_new = group.register(key_digest, id_)
+                if section != "licenses":
+                    id_map[id_] = merged_id
+                if is_new:
+                    group.append(section, self.rename(section, element, id_, merged_id))
+            if self.spdx:
+                self.merge_relationships(id_map)
+            else:
+                self.merge_dependencies(id_map)
+            group.flush()
+
+    @staticmethod
+    def rename(section: str, element: dict, id_: str, merged_id: str) -> dict:
+        if section == "packages":
+            return dict(element, SPDXID=merged_id) if merged_id != id_ else element
+        if section == "licenses":
+            return dict(element, licenseId=merged_id) if merged_id != id_ else element
+        return dict(element, **{"bom-ref": merged_id}) if merged_id != element.get("bom-ref") else element
+
+    def merge_relationships(self, id_map: dict):
+        for rel_ in self.links:
+            rel_ = dict(rel_, spdxElementId=id_map.get(rel_.get("spdxElementId"), rel_.get("spdxElementId")),
+                        relatedSpdxElement=id_map.get(rel_.get("relatedSpdxElement"), rel_.get("relatedSpdxElement")))
+            rel_digest = get_digest(rel_["spdxElementId"] or "", rel_.get("relationshipType", ""),
+                                    rel_["relatedSpdxElement"] or "")
+            if rel_digest not in self.group.seen:
+                self.group.seen.add(rel_digest)
+                self.group.append("relationships", rel_)
+
+    def merge_dependencies(self, id_map: dict):
+        for dep_ in self.links:
+            ref_ = id_map.get(dep_.get("ref"), dep_.get("ref"))
+            if not ref_:
+                continue
+            self.group.append_dependency(ref_)
+            for dep_ref in dep_.get("dependsOn", []):
+                self.group.append_dependency(ref_, id_map.get(dep_ref, dep_ref))
+
+
+class SbomAggregator:
+    """Merges the project reports into one SPDX or CycloneDX document per product (`product`) or for the org (`org`)
+
+    The elements of every report are passed by start() while the report is written, packages/components are
+    deduplicated by purl (or by SPDXID/bom-ref when there is no purl), and the merged documents are streamed from
+    the spool files at the end. Memory use depends on the number of unique components, not on the number of projects.
+    """
+
+    def __init__(self, out_dir: str, sbom_type: str, scope: str, compression: str = "", compact: bool = False,
+                 name_suffix: str = ""):
+        self.out_dir = out_dir
+        self.sbom_type = sbom_type
+        self.scope = scope
+        self.compression = compression
+        self.compact = compact
+        self.name_suffix = name_suffix
+        self.groups = {}
+        self.lock = threading.Lock()
+        self._group_index = itertools.count()
+        self.spool_dir = tempfile.mkdtemp(prefix=".sbom_aggregate_", dir=out_dir)
+
+    def get_group_name(self, prj_title: str) -> str:
+        return prj_title.split(":")[0] if self.scope == "product" else "organization"
+
+    def get_group(self, name: str) -> AggregateGroup:
+        group = self.groups.get(name)
+        if group is None:
+            sections = ("packages", "licenses", "relationships") if self.sbom_type == "spdx" else ("components",)
+            group = self.groups[name] = AggregateGroup(self.spool_dir, next(self._group_index), name, sections,
+                                                       dependencies=self.sbom_type != "spdx")
+        return group
+
+    def start(self, prj_title: str) -> AggregateReport:
+        """Collector of the elements of the project report; the report is added by its finish()"""
+        with self.lock:
+            return AggregateReport(self, self.get_group(self.get_group_name(prj_title)))
+
+    def add_file(self, prj_title: str, path: str):
+        """Adds a report that is already in the output directory"""
+        report = self.start(prj_title)
+        try:
+            ReportFeed({"aggregate": report}).add_file(path, self.compression)
+        except Exception as err:
+            logger.warning(f"The report {os.path.basename(path)} was not added to the aggregated SBOM: {err}")
+            return
+        report.finish()
+
+    def get_rep_name(self, group_name: str) -> str:
+        base = f"Aggregated {self.sbom_type.upper()} report for {group_name}".replace("/", "_")
+        suffix = f".{self.name_suffix}" if self.name_suffix else ""
+        return f"{base}{suffix}.json{COMPRESSION_SUFFIXES[self.compression]}"
+
+    def write_json_array(self, out_file, name: str, elements, last: bool = False):
+        indent = None if self.compact else 4
+        separators = (",", ":") if self.compact else (",", ": ")
+        out_file.write(f'"{name}":[' if self.compact else f'    "{name}": [')
+        for i, element in enumerate(elements):
+            text = json.dumps(element, indent=indent, separators=separators, ensure_ascii=False)
+            if not self.compact:
+                text = "\n" + "\n".join(f"        {line}" for line in text.splitlines())
+            out_file.write(f"{',' if i else ''}{text}")
+        out_file.write("]" if self.compact else "\n    ]")
+        out_file.write("" if last else ("," if self.compact else ",\n"))
+
+    def write_group(self, group: AggregateGroup, path: str):
+        created = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        if self.sbom_type == "spdx":
+            header = {
+                "spdxVersion": group.spec_version or "SPDX-2.2",
+                "dataLicense": "CC0-1.0",
+                "SPDXID": "SPDXRef-DOCUMENT",
+                "name": group.name,
+                "documentNamespace": f"https://mend.io/{__tool_name__}/{uuid.uuid4()}",
+                "creationInfo": {"created": created, "creators": [f"Tool: {__tool_name__}-{__version__}"]},
+            }
+            sections = [("packages", "packages"), ("hasExtractedLicensingInfos", "licenses"),
+                        ("relationships", "relationships")]
+        else:
+            header = {
+                "bomFormat": "CycloneDX",
+                "specVersion": group.spec_version or "1.4",
+                "serialNumber": f"urn:uuid:{uuid.uuid4()}",
+                "version": 1,
+                "metadata": {"timestamp": created,
+                             "tools": [{"vendor": "Mend", "name": __tool_name__, "version": __version__}],
+                             "component": {"type": "application", "name": group.name, "bom-ref": group.name}},
+            }
+            sections = [("components", "components")]
+        with open_report(path, self.compression) as out_file:
+            header_text = json.dumps(header, indent=None if self.compact else 4, ensure_ascii=False,
+                                     separators=(",", ":") if self.compact else (",", ": "))
+            out_file.write(header_text[:-1].rstrip() + ("," if self.compact else ",\n"))
+            for i, (name, section) in enumerate(sections):
+                self.write_json_array(out_file, name, group.iter_section(section),
+                                      last=i == len(sections) - 1 and self.sbom_type == "spdx")
+            if self.sbom_type != "spdx":
+                self.write_json_array(out_file, "dependencies", group.iter_dependencies(), last=True)
+            out_file.write("}" if self.compact else "\n}")
+
+    def close(self) -> list:
+        """Writes the merged documents and returns their file names"""
+        res = []
+        try:
+            for group in self.groups.values():
+                rep_name = self.get_rep_name(group.name)
+                path = os.path.join(self.out_dir, rep_name)
+                try:
+                    self.write_group(group, path)
+                    res.append(rep_name)
+                    logger.info(f"The aggregated report {rep_name} was created from {group.projects} project(s): "
+                                f"{', '.join(f'{v} {k}' for k, v in group.counts.items())}")
+                except Exception as err:
+                    logger.error(f"The aggregated report {rep_name} was not created: {err}")
+        finally:
+            for group in self.groups.values():
+                group.close()
+            try:
+                os.rmdir(self.spool_dir)
+            except OSError:
+                pass
+        return res
@@ -0,0 +1,410 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Optional, Tuple
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from mend_sbom_export_cli._version import __tool_name__
+from mend_sbom_export_cli import mend_api, processing, streaming
+from mend_sbom_export_cli import sbom_export_cli as cli
+from mend_sbom_export_cli.scheduling import TailTracker
+from mend_sbom_export_cli.ws_client import RequestGovernor
+
+logger = logging.getLogger(__tool_name__)
+
+
+class AsyncWsClient:
+    """aiohttp counterpart of call_ws_api, limited to `concurrency` requests in flight
+
+    Requests follow the same RequestGovernor policy as the threaded client: the slot limit follows
+    `governor.limit`, so throttling responses lower the concurrency of the event loop as well. `config` is the
+    mend_api configuration of the run, which gives the URL, the metrics and the request bodies.
+    """
+
+    def __init__(self, config: mend_api.ApiConfig, concurrency: int = 10, governor: Optional[RequestGovernor] = None):
+        if aiohttp is None:
+            raise ImportError("The async engine requires aiohttp. Install it with: pip install aiohttp")
+        self.config = config
+        self.governor = governor or RequestGovernor(max_concurrency=concurrency)
+        self._slot_cond = asyncio.Condition()
+        self._in_flight = 0
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=max(concurrency, 1)),
+            headers={"Accept-Encoding": "gzip, deflate"},
+            auto_decompress=True)
+
+    async def _acquire(self):
+        async with self._slot_cond:
+            await self._slot_cond.wait_for(lambda: self._in_flight < self.governor.limit)
+            self._in_flight += 1
+
+    async def _release(self):
+        async with self._slot_cond:
+            self._in_flight -= 1
+            self._slot_cond.notify_all()
+
+    async def _send(self, data: str, header: dict, method: str, download: bool, stream_to: str):
+        """One attempt; returns (status, body, Retry-After header)"""
+        async with self.session.request(method=method,
+                                        url=f"{self.config.url}/api/v{mend_api.API_VERSION}",
+                                        data=data,
+                                        headers=header) as res_:
+            if res_.status != 200:
+                return res_.status, "", res_.headers.get("Retry-After")
+            if stream_to:
+                # The file is opened, written and closed on worker threads, so the disk never blocks the event loop
+                out_file = await asyncio.to_thread(open, stream_to, 'wb')
+                try:
+                    async for chunk in res_.content.iter_chunked(mend_api.DOWNLOAD_CHUNK_SIZE):
+                        await asyncio.to_thread(out_file.write, chunk)
+                finally:
+                    await asyncio.to_thread(out_file.close)
+                return res_.status, stream_to, None
+            return res_.status, await res_.read() if download else await res_.text(), None
+
+    async def call_ws_api(self, data: str, header={"Content-Type": "application/json"}, method="POST", download=False,
+                          stream_to: str = ""):
+        data_json = json.loads(data)
+        data_json["agentInfo"] = mend_api.AGENT_INFO
+        request_type = data_json.get("requestType", "")
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            wait = self.governor.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            await self._acquire()
+            try:
+                status, res, retry_after = await self._send(json.dumps(data_json), header, method, download, stream_to)
+                error = None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                status, res, retry_after, error = None, "", None, err
+            except Exception as err:
+                logger.error(f'[{cli.ex()}] {err}')
+                return ""
+            finally:
+                await self._release()
+            if status is not None and not self.governor.is_retriable(status):
+                self.governor.on_response(request_type, status)
+                self._observe(request_type, start, res, status == 200, stream_to)
+                return res
+            delay = self.governor.on_failure(request_type, attempt, status=status, retry_after=retry_after, error=error)
+            if delay is None:
+                if error:
+                    logger.error(f'[{request_type}] {error}')
+                self._observe(request_type, start, res, False)
+                return res
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _observe(self, request_type: str, start: float, res, ok: bool, stream_to: str = ""):
+        if not ok:
+            size = 0
+        elif stream_to:
+            size = cli.try_or_error(lambda: os.path.getsize(stream_to), 0)
+        else:
+            size = len(res.encode("utf-8") if isinstance(res, str) else res)
+        self.config.metrics.observe_request(request_type, time.perf_counter() - start, size, ok)
+
+    async def close(self):
+        await self.session.close()
+
+
+class AsyncRateLimiter:
+    def __init__(self, rate: float = 0):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0
+        self._next_time = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        start = max(now, self._next_time)
+        self._next_time = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+async def send_requests(client: AsyncWsClient, requests: list) -> list:
+    return list(await asyncio.gather(*[client.call_ws_api(data=x) for x in requests]))
+
+
+async def get_project_list(client: AsyncWsClient) -> list:
+    """The discovery of the CLI, run on a worker thread; the requests of each of its steps are sent together by the
+    client on the event loop"""
+    loop = asyncio.get_running_loop()
+
+    def send_all(requests: list) -> list:
+        return asyncio.run_coroutine_threadsafe(send_requests(client, requests), loop).result()
+
+    return await asyncio.to_thread(cli.get_project_list, send_all)
+
+
+async def get_prj_lic_texts(client: AsyncWsClient, token: str, lic_keys: Optional[list] = None) -> dict:
+    """License texts of the project, taken from the license cache when it knows every key of `lic_keys`"""
+    config = client.config
+    if not config.lic_text:
+        return {}
+    with config.metrics.phase("licenses"):
+        res_lic = mend_api.get_cached_lic_texts(config, lic_keys)
+        if res_lic is not None:
+            config.metrics.inc("license_cache_hits")
+            return res_lic
+        response_ = await client.call_ws_api(data=mend_api.get_attribution_request(config, token))
+        return mend_api.store_lic_texts(config, mend_api.parse_lic_texts(config, response_), lic_keys)
+
+
+async def run_in_process(func, *args_):
+    with cli.metrics.phase("processing"):
+        return await asyncio.wrap_future(cli.process_pool.submit(func, *args_))
+
+
+async def get_spdx_report(client: AsyncWsClient, token: str, download: bool = False):
+    with cli.metrics.phase("download"):
+        return await client.call_ws_api(data=mend_api.get_spdx_request(client.config, token), download=download)
+
+
+async def create_spdx_in_process(client: AsyncWsClient, prj_: dict) -> str:
+    token = next(iter(prj_))
+    rep_name = cli.get_spdx_rep_name(prj_)
+    if cli.lic_cache and cli.is_lic_text_required():
+        raw = await get_spdx_report(client, token, download=True)
+        prj_lic_texts = await get_prj_lic_texts(client, token, await run_in_process(processing.spdx_lic_keys, raw))
+    else:
+        raw, prj_lic_texts = await asyncio.gather(get_spdx_report(client, token, download=True),
+                                                  get_prj_lic_texts(client, token))
+    created = await run_in_process(processing.write_spdx, raw, prj_lic_texts, cli.get_out_path(rep_name),
+                                   cli.get_compression(), cli.is_compact(), cli.is_lic_dedup())
+    await asyncio.to_thread(cli.record_report, prj_, rep_name if created else "", processing.NOT_SBOM_ERROR)
+    return cli.get_spdx_result_msg(rep_name, created)
+
+
+async def run_cpu(func, *args_):
+    if cli.process_pool:
+        return await run_in_process(func, *args_)
+    with cli.metrics.phase("processing"):
+        return await asyncio.to_thread(func, *args_)
+
+
+async def download_spdx_report(client: AsyncWsClient, token: str, src_path: str) -> bool:
+    with cli.metrics.phase("download"):
+        return await client.call_ws_api(data=mend_api.get_spdx_request(client.config, token),
+                                        stream_to=src_path) == src_path
+
+
+async def create_spdx_streamed(client: AsyncWsClient, prj_: dict) -> str:
+    token = next(iter(prj_))
+    rep_name = cli.get_spdx_rep_name(prj_)
+    src_path = cli.get_tmp_path(".json.part")
+    try:
+        if cli.lic_cache and cli.is_lic_text_required():
+            downloaded = await download_spdx_report(client, token, src_path)
+            prj_lic_texts = await get_prj_lic_texts(client, token, await run_cpu(streaming.spdx_lic_keys, src_path)) \
+                if downloaded else {}
+        else:
+            downloaded, prj_lic_texts = await asyncio.gather(download_spdx_report(client, token, src_path),
+                                                             get_prj_lic_texts(client, token))
+        if not downloaded:
+            await asyncio.to_thread(cli.record_report, prj_, "")
+            return cli.get_spdx_result_msg(rep_name, False)
+        feed = cli.get_report_feed(prj_) if not cli.process_pool else None
+        created = await run_cpu(streaming.write_spdx, src_path, prj_lic_texts, cli.get_out_path(rep_name),
+                                cli.get_compression(), cli.is_compact(), cli.is_lic_dedup(), feed)
+        await asyncio.to_thread(cli.record_report, prj_, rep_name if created else "", processing.NOT_SBOM_ERROR,
+                                None, feed)
+    finally:
+        cli.try_or_error(lambda: os.remove(src_path), None)
+    return cli.get_spdx_result_msg(rep_name, created)
+
+
+async def create_spdx(client: AsyncWsClient, prj_: dict) -> str:
+    if cli.is_streamed():
+        return await create_spdx_streamed(client, prj_)
+    if cli.process_pool:
+        return await create_spdx_in_process(client, prj_)
+    token = next(iter(prj_))
+    if cli.lic_cache:
+        response_ = await get_spdx_report(client, token)
+        with cli.metrics.phase("processing"):
+            sbom_prj = cli.try_or_error(lambda: processing.loads(response_), [])
+        prj_lic_texts = await get_prj_lic_texts(client, token, cli.get_spdx_lic_keys(sbom_prj))
+    else:
+        response_, prj_lic_texts = await asyncio.gather(get_spdx_report(client, token),
+                                                        get_prj_lic_texts(client, token))
+        with cli.metrics.phase("processing"):
+            sbom_prj = cli.try_or_error(lambda: processing.loads(response_), [])
+    res = await asyncio.to_thread(cli.write_spdx_report, prj_, sbom_prj, prj_lic_texts)
+    error = processing.get_sbom_error(sbom_prj, "spdx")
+    await asyncio.to_thread(cli.record_report, prj_, "" if error else cli.get_spdx_rep_name(prj_), error, sbom_prj)
+    return res
+
+
+def get_cdx_status_sender(client: AsyncWsClient):
+    """Status request of the CdxPoller, sent from its threads by the client on the event loop"""
+    loop = asyncio.get_running_loop()
+
+    def get_status(uuid: str) -> Tuple[str, str]:
+        response_ = asyncio.run_coroutine_threadsafe(
+            client.call_ws_api(data=mend_api.get_cdx_status_request(client.config, uuid)), loop).result()
+        return mend_api.parse_cdx_status(response_)
+
+    return get_status
+
+
+async def submit_cyclone(client: AsyncWsClient, limiter: AsyncRateLimiter, prj_: dict,
+                         resubmit: bool = False) -> Tuple[str, str, bool]:
+    """Submits the CDX report of the project, or takes the job submitted by the resumed run: (uuid, error, resumed)"""
+    token = next(iter(prj_))
+    uuid = cli.get_resumed_uuid(token) if not resubmit else ""
+    if uuid:
+        return uuid, "", True
+    await limiter.wait()
+    uuid, err_status = mend_api.parse_cdx_uuid(
+        await client.call_ws_api(data=mend_api.get_cdx_request(client.config, token)))
+    cli.record_submitted(token, uuid)
+    return uuid, err_status, False
+
+
+async def create_cyclone(client: AsyncWsClient, limiter: AsyncRateLimiter, poller: mend_api.CdxPoller,
+                         downloads: asyncio.Semaphore, prj_: dict, uuid: str, err_status: str, resumed: bool) -> str:
+    """Waits for the submitted job of the project and writes its report; at most `downloads` are written at once"""
+    if not uuid:
+        logger.error(f"Report generation for the project {next(iter(prj_.values()))} was not started: {err_status}")
+        await asyncio.to_thread(cli.record_failed, prj_)
+        return "The creation report file was failed."
+
+    res_status, err_status = await asyncio.wrap_future(poller.add(uuid))
+    if res_status != "SUCCESS":
+        if resumed:
+            logger.info(f"The report job {uuid} of the previous run is not available, submitting it again")
+            return await create_cyclone(client, limiter, poller, downloads, prj_,
+                                        *await submit_cyclone(client, limiter, prj_, resubmit=True))
+        logger.error(f"Downloading status is FAILED: {err_status}. Please, repeat later")
+        await asyncio.to_thread(cli.record_failed, prj_)
+        return "The creation report file was failed."
+    async with downloads:
+        return await download_cyclone(client, prj_, uuid)
+
+
+async def download_cyclone(client: AsyncWsClient, prj_: dict, uuid: str) -> str:
+    token = next(iter(prj_))
+    zip_path = cli.get_cdx_tmp_path()
+    rep_name = ""
+    error = ""
+    cdx_data = feed = None
+    res = cli.get_cdx_result_msg(rep_name)
+    try:
+        with cli.metrics.phase("download"):
+            downloaded = await client.call_ws_api(data=mend_api.get_cdx_download_request(client.config, uuid),
+                                                  stream_to=zip_path) == zip_path
+        if not downloaded:
+            pass
+        elif not cli.is_lic_text_required():
+            feed = cli.get_report_feed(prj_) if not streaming.check_streaming() else None
+            rep_name = await asyncio.to_thread(cli.copy_cdx_report, zip_path, feed)
+            error = "" if rep_name else processing.NOT_SBOM_ERROR
+            res = cli.get_cdx_result_msg(rep_name)
+        elif cli.process_pool:
+            # License texts are fetched once the report is ready, so only the reports being written hold them
+            lic_keys = await run_in_process(processing.cdx_lic_keys, zip_path) if cli.lic_cache else None
+            prj_lic_texts = await get_prj_lic_texts(client, token, lic_keys)
+            rep_name = await run_in_process(processing.write_cdx, zip_path, prj_lic_texts, cli.args.out_dir,
+                                            cli.get_compression(), cli.is_compact(), cli.is_lic_dedup())
+            error = "" if rep_name else processing.NOT_SBOM_ERROR
+            res = cli.get_cdx_result_msg(rep_name)
+        else:
+            cdx_data, rep_name = await asyncio.to_thread(cli.read_cdx_report, zip_path)
+            prj_lic_texts = await get_prj_lic_texts(client, token,
+                                                    cli.get_cdx_lic_keys(cdx_data) if cli.lic_cache else None)
+            await asyncio.to_thread(cli.write_cdx_data, cdx_data, rep_name, prj_lic_texts)
+            error = processing.get_sbom_error(cdx_data, "cdx") if rep_name else ""
+            rep_name = "" if error else rep_name
+            res = cli.get_cdx_result_msg(rep_name)
+    finally:
+        cli.try_or_error(lambda: os.remove(zip_path), None)
+    await asyncio.to_thread(cli.record_report, prj_, rep_name, error, cdx_data, feed)
+    return res
+
+
+async def run_timed(prj_: dict, tail: TailTracker, coro, start: Optional[float] = None):
+    start = start or time.perf_counter()
+    try:
+        return await coro
+    finally:
+        cli.cost_history.record(next(iter(prj_)), time.perf_counter() - start)
+        tail.done()
+
+
+async def log_result(coro, errors: list):
+    try:
+        temp_l = await coro
+        if temp_l:
+            logger.info(temp_l)
+    except Exception as e:
+        errors.append(e)
+        logger.error(f"Error on future: {e}")
+
+
+async def run_projects(prj_lst: list, workers: int, start, errors: list):
+    """Runs `start` for each project from `workers` tasks, so that the tasks do not grow with the number of
+    projects; the projects are taken in the order of the list"""
+    prj_iter = iter(prj_lst)
+
+    async def worker():
+        for prj_ in prj_iter:
+            await log_result(start(prj_), errors)
+
+    await asyncio.gather(*[worker() for _ in range(max(min(workers, len(prj_lst)), 1))])
+
+
+async def run(concurrency: int) -> list:
+    """Runs discovery, license collection and report generation on one event loop
+
+    SPDX reports are created by `concurrency` tasks. CDX reports are submitted by `concurrency` tasks; each submitted
+    job then waits for the CdxPoller in a task of its own, and at most `concurrency` reports are downloaded at once.
+    """
+    errors = []
+    client = AsyncWsClient(cli.get_api_config(), concurrency=concurrency, governor=cli.get_ws_client().governor)
+    poller = None
+    try:
+        with cli.metrics.phase("discovery"):
+            cli.short_lst_prj = cli.filter_projects(await get_project_list(client))
+        if not cli.short_lst_prj:
+            logger.info("No one project was found for the generation report")
+            return errors
+
+        # The projects are taken largest first, so the longest projects take the request slots first
+        prj_lst = cli.cost_history.order(cli.short_lst_prj)
+        tail = TailTracker(len(cli.short_lst_prj), concurrency)
+        if cli.args.type.lower() == "spdx":
+            await run_projects(prj_lst, concurrency, lambda prj_: run_timed(prj_, tail, create_spdx(client, prj_)),
+                               errors)
+        else:
+            limiter = AsyncRateLimiter(rate=cli.try_or_error(lambda: float(cli.args.submit_rate), 0))
+            poller = mend_api.CdxPoller(client.config, concurrency, get_status=get_cdx_status_sender(client))
+            downloads = asyncio.Semaphore(concurrency)
+            jobs = []
+
+            async def submit(prj_: dict):
+                start = time.perf_counter()
+                try:
+                    submitted = await submit_cyclone(client, limiter, prj_)
+                except Exception as err:
+                    submitted = "", str(err), False
+                jobs.append(asyncio.create_task(log_result(run_timed(
+                    prj_, tail, create_cyclone(client, limiter, poller, downloads, prj_, *submitted), start), errors)))
+
+            await run_projects(prj_lst, concurrency, submit, errors)
+            await asyncio.gather(*jobs)
+        tail.observe(cli.metrics)
+    finally:
+        if poller:
+            await asyncio.to_thread(poller.close)
+        await client.close()
+    return errors
@@ -10,10 +10,34 @@ class aliases(Enum): # List of aliases for params
     output = ("--out","--dir")
     sbom = ("--sbom","--input")
     lic = ("--licensetext", "--lictext")
+    deduplicenses = ("--dedupLicenses", "--dedup-licenses")
     exclude = ("--exclude", "-exclude")
     threads = ("--threads", "-threads")
     type = ("--type", "-type")
     serviceuser = ("--service", "-service")
+    submitrate = ("--submitRate", "--submit-rate")
+    engine = ("--engine", "-engine")
+    liccache = ("--licCache", "--lic-cache")
+    liccachesize = ("--licCacheSize", "--lic-cache-size")
+    liccachettl = ("--licCacheTtl", "--lic-cache-ttl")
+    discoveryttl = ("--discoveryTtl", "--discovery-ttl")
+    refreshdiscovery = ("--refreshDiscovery", "--refresh-discovery")
+    incremental = ("--incremental", "-incremental")
+    resume = ("--resume", "-resume")
+    ratelimit = ("--rateLimit", "--rate-limit")
+    retries = ("--maxRetries", "--max-retries")
+    compact = ("--compact", "-compact")
+    stream = ("--stream", "-stream")
+    compress = ("--compress", "-compress")
+    bundle = ("--bundle", "-bundle")
+    processes = ("--processes", "-processes")
+    aggregate = ("--aggregate", "-aggregate")
+    delta = ("--delta", "-delta")
+    smalllane = ("--smallLane", "--small-lane")
+    shardindex = ("--shardIndex", "--shard-index")
+    shardcount = ("--shardCount", "--shard-count")
+    metricsout = ("--metricsOut", "--metrics-out")
+    prometheusout = ("--prometheusOut", "--prometheus-out")
 
     @classmethod
     def get_aliases_str(cls, key):
@@ -34,6 +58,11 @@ class varenvs(Enum): # Lit of Env.variables
     wsproject = ("WS_PROJECTTOKEN", "MEND_PROJECTTOKEN")
     wsexclude = ("WS_EXCLUDETOKEN", "MEND_EXCLUDETOKEN")
     serviceuser = ("WS_SERVICEUSER", "MEND_SERVICEUSER")
+    liccache = ("WS_LICCACHE", "MEND_LICCACHE")
+    shardindex = ("WS_SHARDINDEX", "MEND_SHARDINDEX")
+    shardcount = ("WS_SHARDCOUNT", "MEND_SHARDCOUNT")
+    metricsout = ("WS_METRICSOUT", "MEND_METRICSOUT")
+    prometheusout = ("WS_PROMETHEUSOUT", "MEND_PROMETHEUSOUT")
 
     @classmethod
     def get_env(cls, key):
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+from mend_sbom_export_cli._version import __tool_name__
+from mend_sbom_export_cli.output import COMPRESSION_SUFFIXES
+from mend_sbom_export_cli.processing import dump, get_cdx_lic_name
+from mend_sbom_export_cli.state import write_json_atomic
+
+logger = logging.getLogger(__tool_name__)
+
+DELTA_MODES = ("false", "true", "only")
+
+
+def get_spdx_component(package: dict) -> dict:
+    return {
+        "name": package.get("name", ""),
+        "version": package.get("versionInfo", ""),
+        "purl": next((ref_.get("referenceLocator", "") for ref_ in package.get("externalRefs", [])
+                      if ref_.get("referenceType") == "purl"), ""),
+        "licenses": sorted(set(x for x in (package.get("licenseConcluded"), package.get("licenseDeclared")) if x)),
+        "id": package.get("SPDXID", ""),
+    }
+
+
+def get_cdx_component(component: dict) -> dict:
+    licenses = set(get_cdx_lic_name(x) or x.get("expression", "") for x in component.get("licenses", []))
+    return {
+        "name": component.get("name", ""),
+        "version": component.get("version", ""),
+        "purl": component.get("purl", ""),
+        "licenses": sorted(x for x in licenses if x),
+        "id": component.get("bom-ref", ""),
+    }
+
+
+def get_versionless_key(key_: str) -> str:
+    """The purl without its version, so that a version bump of a component is a change rather than a removal and
+    an addition; qualifiers and subpath are kept. Keys that are not purls are returned as they are."""
+    if not key_.startswith("pkg:"):
+        return key_
+    end = min((key_.find(x) for x in "?#" if x in key_), default=len(key_))
+    version_at = key_.find("@", key_.rfind("/", 0, end) + 1, end)
+    return key_ if version_at < 0 else key_[:version_at] + key_[end:]
+
+
+def get_component_keys(keys: list) -> dict:
+    """Full key -> key of the components in the delta: the versionless purl, or the full purl when several
+    versions of the component are in the same report"""
+    versionless = [get_versionless_key(x) for x in keys]
+    counts = {}
+    for key_ in versionless:
+        counts[key_] = counts.get(key_, 0) + 1
+    return {x: y if counts[y] == 1 else x for x, y in zip(keys, versionless)}
+
+
+def get_fingerprint(component: dict) -> str:
+    text = "\0".join([component["name"], component["version"], component["purl"]] + component["licenses"])
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class DeltaReport:
+    """Components of one project report, collected while the report is written"""
+
+    def __init__(self, sbom_type: str):
+        self.get_component = get_spdx_component if sbom_type == "spdx" else get_cdx_component
+        self.keys = {"packages"} if sbom_type == "spdx" else {"components"}
+        self._components = {}  # full component key (purl, or SPDXID/bom-ref, or name) -> component
+
+    def add(self, key_: str, value):
+        component = self.get_component(value)
+        self._components[component["purl"] or component["id"] or component["name"]] = component
+
+    @property
+    def components(self) -> dict:
+        """Component key of the delta -> component"""
+        keys = get_component_keys(list(self._components))
+        return {keys[x]: y for x, y in self._components.items()}
+
+
+class DeltaIndex:
+    """Component fingerprints of every exported project, kept between runs to write delta reports
+
+    For each project the index stores, per component key (purl without its version, or SPDXID/bom-ref, or name),
+    a fingerprint of its name, version, purl and license set plus the name and version, so that removed components
+    can be named and a new version of a component is reported as changed.
+    """
+    INDEX_DIR = ".sbom_export_fingerprints"
+
+    def __init__(self, out_dir: str, compression: str = "", compact: bool = False):
+        self.out_dir = out_dir
+        self.index_dir = os.path.join(out_dir, self.INDEX_DIR)
+        self.compression = compression
+        self.compact = compact
+        os.makedirs(self.index_dir, exist_ok=True)
+
+    def _index_path(self, token: str) -> str:
+        return os.path.join(self.index_dir, f"{token}.json")
+
+    def load(self, token: str) -> dict:
+        try:
+            with open(self._index_path(token), encoding="utf-8") as index_file:
+                return json.load(index_file)
+        except FileNotFoundError:
+            return {}
+        except Exception as err:
+            logger.warning(f"The component index of the project {token} is unreadable, "
+                           f"the delta is a full baseline: {err}")
+            return {}
+
+    @staticmethod
+    def get_delta_name(rep_name: str) -> str:
+        base = rep_name[:-len(".json")] if rep_name.endswith(".json") else rep_name
+        return f"{base}.delta.json"
+
+    def write_delta(self, token: str, prj_title: str, sbom_type: str, rep_name: str, components: dict) -> str:
+        """Compares the components of the written report, collected by its DeltaReport, with the previous index of
+        the project, writes the delta report and replaces the index. Returns the name of the delta report."""
+        previous = self.load(token)
+        prev_components = previous.get("components", {})
+        # Indexes written before the keys dropped the purl version are keyed by the full purl
+        prev_keys = get_component_keys(list(prev_components))
+        prev_components = {prev_keys[x]: y for x, y in prev_components.items()}
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        delta = {
+            "project": prj_title,
+            "token": token,
+            "type": sbom_type,
+            "baseline": not previous,
+            "previous": previous.get("generated", ""),
+            "generated": now,
+            "added": [],
+            "removed": [{"key": k, "name": v[1], "version": v[2]} for k, v in prev_components.items()
+                        if k not in components],
+            "changed": [],
+        }
+        index = {}
+        for key_, component in components.items():
+            fingerprint = get_fingerprint(component)
+            index[key_] = [fingerprint, component["name"], component["version"]]
+            prev = prev_components.get(key_)
+            if prev is None:
+                delta["added"].append(dict(component, key=key_))
+            elif prev[0] != fingerprint:
+                delta["changed"].append({"key": key_, "previous": {"name": prev[1], "version": prev[2]},
+                                         "current": component})
+        delta_name = self.get_delta_name(rep_name)
+        dump(delta, os.path.join(self.out_dir, f"{delta_name}{COMPRESSION_SUFFIXES[self.compression]}"),
+             self.compression, self.compact)
+        write_json_atomic(self._index_path(token), {"generated": now, "components": index})
+        logger.debug(f"Delta of {prj_title}: {len(delta['added'])} added, {len(delta['removed'])} removed, "
+                     f"{len(delta['changed'])} changed")
+        return delta_name
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from mend_sbom_export_cli._version import __tool_name__
+from mend_sbom_export_cli.state import get_shard_file_name, write_json_atomic
+
+logger = logging.getLogger(__tool_name__)
+
+
+class DiscoveryCache:
+    """Project discovery results of earlier runs, kept in the output directory for `ttl` seconds
+
+    - scopes: discovery request (org, product or project vitals) -> project tokens it returned
+    - projects: project token -> project vitals (name, product name, last update)
+    - products: product token -> project tokens, from product vitals and the --exclude project lists
+
+    The cache belongs to one org and one shard; it is kept in memory as dicts and sets, so that the lookups of the
+    vitals of a project and of the projects of a product do not depend on the size of the org.
+    """
+    CACHE_FILE = ".sbom_export_discovery.json"
+
+    def __init__(self, out_dir: str, org_token: str, ttl: float, refresh: bool = False, shard: str = ""):
+        self.path = os.path.join(out_dir, get_shard_file_name(self.CACHE_FILE, shard))
+        self.org = hashlib.sha256(org_token.encode("utf-8")).hexdigest()
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.scopes = {}  # request key -> {"ts": float, "tokens": list}
+        self.projects = {}  # token -> {"ts": float, "vitals": dict}
+        self.products = {}  # product token -> {"ts": float, "tokens": set}
+        self.hits = 0
+        self.misses = 0
+        if refresh:
+            logger.info("The cached project discovery is ignored, the projects are discovered again")
+        else:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as cache_file:
+                cache = json.load(cache_file)
+        except FileNotFoundError:
+            return
+        except Exception as err:
+            logger.warning(f"The discovery cache {self.path} is unreadable, the projects are discovered again: {err}")
+            return
+        if cache.get("org") != self.org:
+            return
+        self.scopes = {k: v for k, v in cache.get("scopes", {}).items() if self._is_fresh(v)}
+        self.projects = {k: v for k, v in cache.get("projects", {}).items() if self._is_fresh(v)}
+        self.products = {k: {"ts": v["ts"], "tokens": set(v["tokens"])} for k, v in cache.get("products", {}).items()
+                         if self._is_fresh(v)}
+
+    def save(self):
+        with self._lock:
+            write_json_atomic(self.path, {
+                "org": self.org,
+                "scopes": self.scopes,
+                "projects": self.projects,
+                "products": {k: {"ts": v["ts"], "tokens": sorted(v["tokens"])} for k, v in self.products.items()},
+            })
+        logger.debug(f"Discovery cache: {self.hits} hits, {self.misses} misses, {len(self.projects)} projects stored")
+
+    def _is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry["ts"] < self.ttl
+
+    def _count(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def get_scope(self, key: str) -> Optional[list]:
+        """Vitals of the projects returned by the discovery request, or None if it is not cached"""
+        with self._lock:
+            entry = self.scopes.get(key)
+            vitals = [self.projects.get(x) for x in entry["tokens"]] if entry and self._is_fresh(entry) else None
+            if vitals is not None and not all(vitals):
+                vitals = None
+            self._count(vitals is not None)
+            return [x["vitals"] for x in vitals] if vitals is not None else None
+
+    def put_scope(self, key: str, vitals: list, product_token: str = ""):
+        now = time.time()
+        with self._lock:
+            self.scopes[key] = {"ts": now, "tokens": [x["token"] for x in vitals]}
+            self.projects.update({x["token"]: {"ts": now, "vitals": x} for x in vitals})
+            if product_token:
+                self.products[product_token] = {"ts": now, "tokens": set(x["token"] for x in vitals)}
+
+    def get_project(self, token: str) -> Optional[dict]:
+        with self._lock:
+            entry = self.projects.get(token)
+            vitals = entry["vitals"] if entry and self._is_fresh(entry) else None
+            self._count(vitals is not None)
+            return vitals
+
+    def get_product(self, product_token: str) -> Optional[set]:
+        """Project tokens of the product, or None if they are not cached"""
+        with self._lock:
+            entry = self.products.get(product_token)
+            tokens = entry["tokens"] if entry and self._is_fresh(entry) else None
+            self._count(tokens is not None)
+            return tokens
+
+    def put_product(self, product_token: str, tokens: set):
+        with self._lock:
+            self.products[product_token] = {"ts": time.time(), "tokens": set(tokens)}
@@ -0,0 +1,234 @@
+"""Python API of the export: SBOM documents are returned to the caller instead of being written to files
+
+    from mend_sbom_export_cli.exporter import SbomExporter
+
+    with SbomExporter(url="https://saas.mend.io", user_key=USER_KEY, org_token=ORG_TOKEN, sbom_type="cdx") as exporter:
+        for project, sbom in exporter.export():
+            ingest(project["token"], sbom)
+
+Unlike main(), an exporter keeps its configuration and state in the object, so several exporters, or several
+export() calls of one exporter, may run at once in one process.
+"""
+import logging
+import queue
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional, Tuple, Union
+
+from mend_sbom_export_cli._version import __tool_name__
+from mend_sbom_export_cli import mend_api, processing
+from mend_sbom_export_cli.discovery import DiscoveryCache
+from mend_sbom_export_cli.lic_cache import LicenseCache
+from mend_sbom_export_cli.metrics import RunMetrics
+from mend_sbom_export_cli.ws_client import RequestGovernor, WsClient
+
+logger = logging.getLogger(__tool_name__)
+
+
+class SbomExporter:
+    """Exports the SBOM reports of the projects of an org, products or projects
+
+    - export() yields (project, sbom) as each report completes, in completion order. The project is a dict with
+      the token, name and product name; the sbom is the document as a dict, or its JSON bytes with `raw`
+      (without license texts the bytes are the report of the server as is, the document is never parsed)
+    - at most `max_in_flight` reports (default `threads`) are being generated, downloading or waiting for the
+      caller, so a slow consumer holds back the downloads instead of buffering the whole org in memory
+    - the CDX jobs are polled by one CdxPoller per export, so a report being generated takes no thread
+    - the projects that fail are logged and skipped
+
+    Nothing is written to disk, apart from the optional LicenseCache and DiscoveryCache shared by the exports and
+    the CDX archives, downloaded to temporary files that are removed once the report is read.
+    With a service user, the org token is taken by logging in on the first get_projects() or export().
+    The requests and the per-project steps are those of the CLI, see mend_api.
+    """
+
+    def __init__(self, url: str, user_key: str, org_token: str = "", service_user: str = "", sbom_type: str = "spdx",
+                 product_tokens: Optional[list] = None, project_tokens: Optional[list] = None,
+                 exclude_tokens: Optional[list] = None, lic_text: bool = False, dedup_licenses: bool = False,
+                 raw: bool = False, compact: bool = False, threads: int = 10, max_in_flight: int = 0,
+                 rate_limit: float = 0, max_retries: int = 5, lic_cache: Optional[LicenseCache] = None,
+                 discovery_cache: Optional[DiscoveryCache] = None):
+        if sbom_type.lower() not in ("spdx", "cdx"):
+            raise ValueError(f"The type {sbom_type} is not supported.")
+        if not org_token and not service_user:
+            raise ValueError("Either the org token or the service user is required.")
+        self.url = url
+        self.user_key = user_key
+        self.service_user = service_user
+        self.sbom_type = sbom_type.lower()
+        self.product_tokens = list(product_tokens or [])
+        self.project_tokens = list(project_tokens or [])
+        self.exclude_tokens = list(exclude_tokens or [])
+        self.lic_text = lic_text
+        self.dedup_licenses = dedup_licenses
+        self.raw = raw
+        self.compact = compact
+        self.threads = max(int(threads), 1)
+        self.max_in_flight = max(int(max_in_flight or self.threads), 1)
+        self.lic_cache = lic_cache
+        self.discovery_cache = discovery_cache
+        self.metrics = RunMetrics()
+        self.ws_client = WsClient(pool_size=self.threads, governor=RequestGovernor(
+            rate=rate_limit, max_concurrency=self.threads, max_retries=max_retries))
+        self.config = mend_api.ApiConfig(url=url, user_key=user_key, ws_client=self.ws_client, metrics=self.metrics,
+                                         org_token=org_token, sbom_type=self.sbom_type, lic_text=lic_text,
+                                         dedup_licenses=dedup_licenses, lic_cache=lic_cache)
+        self.org_token = org_token
+        self._login_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.ws_client.close()
+        if self.lic_cache:
+            self.lic_cache.save()
+        if self.discovery_cache:
+            self.discovery_cache.save()
+
+    def login(self) -> str:
+        """Org token of the service user"""
+        return mend_api.login(self.config, self.service_user)[1]
+
+    def get_config(self) -> mend_api.ApiConfig:
+        """Configuration of the requests, logging the service user in first when the org token is not known yet"""
+        with self._login_lock:
+            if not self.org_token:
+                self.org_token = self.config.org_token = self.login()
+        return self.config
+
+    def get_projects(self) -> list:
+        """Projects of the export as dicts with the token, name and product name"""
+        prj_vitals = mend_api.discover_projects(self.get_config(), self.product_tokens, self.project_tokens,
+                                                self.exclude_tokens, threads=self.threads,
+                                                discovery_cache=self.discovery_cache)
+        return [{"token": token, "name": x["name"], "product": x.get("productName", "")}
+                for token, x in prj_vitals.items()]
+
+    def get_lic_texts(self, token: str, lic_keys: Optional[list] = None) -> dict:
+        return mend_api.get_prj_lic_texts(self.config, token, lic_keys)
+
+    @staticmethod
+    def check_raw(raw_: bytes, sbom_type: str) -> bytes:
+        """The report of the server as is, once its beginning shows it is an SBOM and not an error response"""
+        if not processing.is_sbom_head(raw_[:mend_api.DOWNLOAD_CHUNK_SIZE], sbom_type):
+            raise RuntimeError(mend_api.get_error_message(raw_, processing.NOT_SBOM_ERROR))
+        return raw_
+
+    def get_result(self, sbom: dict, sbom_type: str) -> Union[dict, bytes]:
+        error = processing.get_sbom_error(sbom, sbom_type)
+        if error:
+            raise RuntimeError(error)
+        return processing.dumps(sbom, self.compact) if self.raw else sbom
+
+    def create_spdx(self, token: str) -> Optional[Union[dict, bytes]]:
+        raw_ = mend_api.call_ws_api(self.config, mend_api.get_spdx_request(self.config, token), download=True)
+        if not raw_:
+            return None
+        if self.raw and not self.lic_text:
+            return self.check_raw(raw_, "spdx")
+        sbom = processing.loads(raw_)
+        if processing.is_sbom(sbom, "spdx"):
+            mend_api.enrich_spdx_report(self.config, token, sbom)
+        return self.get_result(sbom, "spdx")
+
+    def submit_cyclone(self, token: str) -> str:
+        """uuid of the CDX report job of the project"""
+        uuid, err_status = mend_api.submit_cdx_report(self.config, token)
+        if not uuid:
+            raise RuntimeError(f"The report generation was not started: {err_status}")
+        return uuid
+
+    def download_cyclone(self, token: str, uuid: str) -> Optional[Union[dict, bytes]]:
+        """The report of the finished job; its archive is streamed to a temporary file instead of memory"""
+        with tempfile.TemporaryFile() as zip_file:
+            if not mend_api.download_cdx_report(self.config, uuid, zip_file):
+                return None
+            zip_file.seek(0)
+            if self.raw and not self.lic_text:
+                with zipfile.ZipFile(zip_file) as zip_ref:
+                    return self.check_raw(zip_ref.read(zip_ref.namelist()[0]), "cdx")
+            cdx_data = processing.read_cdx_zip(zip_file)[0]
+        if processing.is_sbom(cdx_data, "cdx"):
+            mend_api.enrich_cdx_report(self.config, token, cdx_data)
+        return self.get_result(cdx_data, "cdx")
+
+    def export(self, projects: Optional[list] = None) -> Iterator[Tuple[dict, Union[dict, bytes]]]:
+        """Yields (project, sbom) as each report completes; `projects` defaults to get_projects()
+
+        Closing the generator early stops the export: the projects not started are dropped and the CDX jobs
+        still being generated are abandoned.
+        """
+        projects = self.get_projects() if projects is None else projects
+        config = self.get_config()
+        stop = threading.Event()
+        slots = threading.Semaphore(self.max_in_flight)  # reports generated, downloading or not yet taken by the caller
+        results = queue.Queue()
+        poller = mend_api.CdxPoller(config, self.threads) if self.sbom_type == "cdx" else None
+
+        def create(project: dict, func, *args_):
+            """Puts the report made by `func` in the results; None when it failed or the export was stopped"""
+            sbom = None
+            try:
+                if not stop.is_set():
+                    with self.metrics.phase("reports"):
+                        sbom = func(*args_)
+            except Exception as err:
+                logger.error(f"The report of the project {project['name']} was not created: {err}")
+            results.put((project, sbom))
+
+        def on_generated(project: dict, uuid: str, future):
+            """Runs on the poller thread once the CDX job is finished; the report is downloaded by the executer"""
+            try:
+                res_status, err_status = ("", "The export was stopped") if future.cancelled() else future.result()
+                if res_status != "SUCCESS":
+                    raise RuntimeError(f"The report generation failed: {err_status}")
+                executer.submit(create, project, self.download_cyclone, project["token"], uuid)
+            except Exception as err:
+                if not stop.is_set():
+                    logger.error(f"The report of the project {project['name']} was not created: {err}")
+                results.put((project, None))
+
+        def run(project: dict):
+            if not poller:
+                create(project, self.create_spdx, project["token"])
+                return
+            try:
+                with self.metrics.phase("reports"):
+                    uuid = self.submit_cyclone(project["token"]) if not stop.is_set() else ""
+                if uuid:
+                    poller.add(uuid).add_done_callback(lambda future: on_generated(project, uuid, future))
+                    return
+            except Exception as err:
+                logger.error(f"The report of the project {project['name']} was not created: {err}")
+            results.put((project, None))
+
+        def submit_all():
+            for project in projects:
+                slots.acquire()
+                if stop.is_set():
+                    return
+                executer.submit(run, project)
+
+        executer = ThreadPoolExecutor(max_workers=min(self.threads, self.max_in_flight))
+        feeder = threading.Thread(target=submit_all, daemon=True)
+        feeder.start()
+        try:
+            for _ in projects:
+                project, sbom = results.get()
+                if sbom:
+                    self.metrics.inc("reports_created")
+                    yield project, sbom
+                slots.release()
+        finally:
+            stop.set()
+            slots.release()
+            feeder.join()
+            if poller:
+                poller.close()
+            executer.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from mend_sbom_export_cli._version import __tool_name__
+
+logger = logging.getLogger(__tool_name__)
+
+
+class LicenseCache:
+    """On-disk license text store shared between runs
+
+    Texts are stored once per content hash under `texts/`, and `index.json` maps library+license keys to
+    the hash of their text (or to None when the attribution report has no text for that key). Entries older
+    than `ttl` seconds are treated as missing; texts beyond `max_size` bytes are evicted least recently used first.
+    """
+    INDEX_FILE = "index.json"
+    MEM_TEXTS = 256
+
+    def __init__(self, cache_dir: str, max_size: int = 100 * 1024 * 1024, ttl: float = 7 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.texts_dir = os.path.join(cache_dir, "texts")
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._mem_texts = OrderedDict()
+        self.keys = {}  # key -> {"hash": str or None, "ts": float}
+        self.texts = {}  # hash -> {"size": int, "atime": float}
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.texts_dir, exist_ok=True)
+        self.load()
+
+    def load(self):
+        try:
+            with open(os.path.join(self.cache_dir, self.INDEX_FILE), encoding="utf-8") as index_file:
+                index = json.load(index_file)
+            self.keys = index.get("keys", {})
+            self.texts = {h: v for h, v in index.get("texts", {}).items() if os.path.exists(self._text_path(h))}
+        except FileNotFoundError:
+            pass
+        except Exception as err:
+            logger.warning(f"The license cache index in {self.cache_dir} is unreadable and will be rebuilt: {err}")
+            self.keys = {}
+            self.texts = {}
+
+    def save(self):
+        with self._lock:
+            self.keys = {k: v for k, v in self.keys.items() if self._is_fresh(v)}
+            index = {"keys": self.keys, "texts": self.texts}
+            tmp_path = os.path.join(self.cache_dir, f"{self.INDEX_FILE}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as index_file:
+                json.dump(index, index_file)
+            os.replace(tmp_path, os.path.join(self.cache_dir, self.INDEX_FILE))
+        logger.debug(f"License cache: {self.hits} hits, {self.misses} misses, {len(self.texts)} texts stored")
+
+    def _text_path(self, text_hash: str) -> str:
+        return os.path.join(self.texts_dir, f"{text_hash}.txt")
+
+    def _is_fresh(self, entry: dict) -> bool:
+        return self.ttl <= 0 or time.time() - entry["ts"] < self.ttl
+
+    def _read_text(self, text_hash: str) -> Optional[str]:
+        text = self._mem_texts.get(text_hash)
+        if text is None:
+            try:
+                with open(self._text_path(text_hash), encoding="utf-8") as text_file:
+                    text = text_file.read()
+            except OSError:
+                return None
+            self._mem_texts[text_hash] = text
+            if len(self._mem_texts) > self.MEM_TEXTS:
+                self._mem_texts.popitem(last=False)
+        else:
+            self._mem_texts.move_to_end(text_hash)
+        self.texts[text_hash]["atime"] = time.time()
+        return text
+
+    def lookup(self, lic_keys: list) -> Optional[dict]:
+        """Returns the texts for all keys, or None if any key is unknown or expired
+
+        `lic_keys` is a list of key variants; a group is resolved by the first variant present in the cache.
+        """
+        res = {}
+        with self._lock:
+            for variants in lic_keys:
+                entry = next((self.keys[key_] for key_ in variants if key_ in self.keys), None)
+                if entry is None or not self._is_fresh(entry) or (entry["hash"] and entry["hash"] not in self.texts):
+                    self.misses += 1
+                    return None
+                if entry["hash"]:
+                    key_ = next(key_ for key_ in variants if key_ in self.keys)
+                    text = self._read_text(entry["hash"])
+                    if text is None:
+                        self.misses += 1
+                        return None
+                    res[key_] = text
+            self.hits += 1
+        return res
+
+    def update(self, lic_texts: dict, lic_keys: Optional[list] = None):
+        """Stores the texts of one attribution report and marks the keys of `lic_keys` it has no text for"""
+        now = time.time()
+        with self._lock:
+            for key_, text in lic_texts.items():
+                text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+                if text_hash not in self.texts:
+                    with open(self._text_path(text_hash), "w", encoding="utf-8") as text_file:
+                        text_file.write(text)
+                    self.texts[text_hash] = {"size": len(text.encode("utf-8")), "atime": now}
+                self.keys[key_] = {"hash": text_hash, "ts": now}
+            for variants in lic_keys or []:
+                if not any(key_ in lic_texts for key_ in variants):
+                    self.keys[variants[0]] = {"hash": None, "ts": now}
+            self._evict()
+
+    def _evict(self):
+        total = sum(x["size"] for x in self.texts.values())
+        if total <= self.max_size:
+            return
+        evicted = set()
+        for text_hash, meta in sorted(self.texts.items(), key=lambda x: x[1]["atime"]):
+            if total <= self.max_size:
+                break
+            total -= meta["size"]
+            evicted.add(text_hash)
+            try:
+                os.remove(self._text_path(text_hash))
+            except OSError:
+                pass
+        for text_hash in evicted:
+            self.texts.pop(text_hash)
+            self._mem_texts.pop(text_hash, None)
+        self.keys = {k: v for k, v in self.keys.items() if v["hash"] not in evicted}
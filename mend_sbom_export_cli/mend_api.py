@@ -0,0 +1,556 @@
+"""Requests to Mend API and the per-project steps of an export, shared by the CLI and the Python API
+
+Every function takes the configuration of the export explicitly as an ApiConfig: the CLI builds it from its
+arguments and globals, every SbomExporter keeps its own. Both run the same login, discovery, exclusion, license
+and CDX request code.
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from importlib import metadata
+from typing import IO, Callable, Optional, Tuple, Union
+
+from mend_sbom_export_cli._version import __tool_name__, __version__
+from mend_sbom_export_cli import processing
+from mend_sbom_export_cli.discovery import DiscoveryCache
+from mend_sbom_export_cli.lic_cache import LicenseCache
+from mend_sbom_export_cli.metrics import RunMetrics
+from mend_sbom_export_cli.ws_client import WsClient
+
+logger = logging.getLogger(__tool_name__)
+
+try:
+    APP_VERSION = metadata.version(f'mend_{__tool_name__}') or __version__
+except Exception:
+    APP_VERSION = __version__
+
+API_VERSION = "1.4"
+AGENT_INFO = {"agent": f"ps-{__tool_name__.replace('_', '-')}", "agentVersion": APP_VERSION}
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+CDX_POLL_MIN_DELAY = 2
+CDX_POLL_MAX_DELAY = 30
+CDX_POLL_BACKOFF = 1.5
+local_url_pattern = r"^http://(localhost|127\.0\.0\.1)(:\d+)?(/|$)"
+
+
+class ApiConfig:
+    """Configuration of the requests and of the per-project steps of one export"""
+
+    def __init__(self, url: str, user_key: str, ws_client: WsClient, metrics: RunMetrics, org_token: str = "",
+                 sbom_type: str = "spdx", lic_text: bool = False, dedup_licenses: bool = False,
+                 lic_cache: Optional[LicenseCache] = None):
+        self.url = extract_url(url)
+        self.user_key = user_key
+        self.ws_client = ws_client
+        self.metrics = metrics
+        self.org_token = org_token
+        self.sbom_type = sbom_type.lower()
+        self.lic_text = lic_text
+        self.dedup_licenses = dedup_licenses
+        self.lic_cache = lic_cache
+
+
+def extract_url(url: str) -> str:
+    if re.match(local_url_pattern, url):  # Plain HTTP is kept only for a local server, e.g. the benchmark mock
+        pos = url.find("/", 7)
+        return url[0:pos] if pos > -1 else url
+    url_ = url if url.startswith("https://") else f"https://{url}"
+    url_ = url_.replace("http://", "")
+    pos = url_.find("/", 8)  # Not using any suffix, just direct url
+    return url_[0:pos] if pos > -1 else url_
+
+
+def ws_request(config: ApiConfig, request_type: str, **kwargs) -> str:
+    return json.dumps({"requestType": request_type, "userKey": config.user_key, **kwargs})
+
+
+def call_ws_api(config: ApiConfig, data: str, download: bool = False,
+                stream_to: Union[str, IO] = "") -> Union[str, bytes, IO]:
+    """Sends the request to Mend API and returns the response body, "" when the request failed. With `stream_to`
+    the response body is written in chunks to that file, a path or a binary file object, and `stream_to` is
+    returned instead of the content"""
+    data_json = json.loads(data)
+    data_json["agentInfo"] = AGENT_INFO
+    request_type = data_json.get("requestType", "")
+    start = time.perf_counter()
+    size = 0
+    ok = False
+    res = ""
+    try:
+        res_ = config.ws_client.request(
+            method="POST",
+            url=f"{config.url}/api/v{API_VERSION}",
+            data=json.dumps(data_json),
+            headers={"Content-Type": "application/json"},
+            stream=bool(stream_to),
+            request_type=request_type)
+        ok = res_.status_code == 200
+        if stream_to:
+            with res_:
+                if ok:
+                    with open(stream_to, 'wb') if isinstance(stream_to, str) else nullcontext(stream_to) as out_file:
+                        for chunk in res_.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            out_file.write(chunk)
+                            size += len(chunk)
+                    res = stream_to
+        else:
+            size = len(res_.content)
+            if ok:
+                res = res_.content if download else res_.text
+    except Exception as err:
+        ok = False
+        logger.error(f'[{request_type}] {err}')
+    config.metrics.observe_request(request_type, time.perf_counter() - start, size, ok)
+    return res
+
+
+def login(config: ApiConfig, service_user: str) -> Tuple[str, str]:
+    """JWT token and org token of the service user; raises ValueError when the authentication fails"""
+    url_ = f"{config.url}/api/v2.0/login".replace("https://", "https://api-")
+    response = config.ws_client.request("POST", url_, headers={'Content-Type': 'application/json'},
+                                        data=json.dumps({"email": service_user, "userKey": config.user_key}),
+                                        request_type="login")
+    try:
+        ret_val = json.loads(response.text)['retVal']
+        return ret_val['jwtToken'], ret_val['orgUuid']
+    except Exception as err:
+        reason = err
+        try:
+            reason = response.reason
+        except Exception:
+            pass
+        raise ValueError(f"The authentication failed. Details: {reason}")
+
+
+# Discovery
+
+def get_prj_title(prj_vitals: dict, product_name: str = "") -> str:
+    return f'{prj_vitals.get("productName", product_name)}:{prj_vitals["name"]}'
+
+
+def get_error_message(response_, default: str = "Unexpected response") -> str:
+    try:
+        return json.loads(response_)["errorMessage"]
+    except Exception:
+        return default
+
+
+def get_discovery_requests(config: ApiConfig, product_tokens: list, project_tokens: list) -> list:
+    """(request, scope) of the vitals of the products, or of the org when neither products nor projects are set"""
+    if product_tokens:
+        return [(ws_request(config, "getProductProjectVitals", productToken=product_), f"product token {product_}")
+                for product_ in product_tokens]
+    elif not project_tokens:
+        return [(ws_request(config, "getOrganizationProjectVitals", orgToken=config.org_token),
+                 f"org token {config.org_token}")]
+    return []
+
+
+def get_discovery_key(data_prj: str) -> str:
+    request_ = json.loads(data_prj)
+    return f'{request_["requestType"]}:{request_.get("productToken") or request_.get("projectToken", "")}'
+
+
+def parse_prj_vitals(response_: str, scope: str, warn: bool = True) -> Optional[list]:
+    """Project vitals of the response, None (with a warning) when the projects were not received"""
+    try:
+        return json.loads(response_)["projectVitals"]
+    except Exception:
+        if warn:
+            logger.warning(f"Projects from the {scope} were not received. Reason: {get_error_message(response_)}")
+        return None
+
+
+def parse_project_vitals(response_: str, token: str) -> Optional[dict]:
+    """Vitals of the project of a getProjectVitals response"""
+    try:
+        vitals = json.loads(response_)["projectVitals"][0]
+    except Exception:
+        return None
+    return vitals if vitals.get("token") == token else None
+
+
+def get_lookup_tokens(project_tokens: list, found) -> list:
+    # Explicit project tokens are the only ones resolved one by one, deduplicated
+    return list(dict.fromkeys(x for x in project_tokens if x not in found))
+
+
+def parse_product_tokens(response_: str) -> Optional[list]:
+    """Project tokens of a getAllProjects response"""
+    try:
+        return [x["projectToken"] for x in json.loads(response_)["projects"]]
+    except Exception:
+        return None
+
+
+def parse_exclude_tokens(response_: str, exclude_: str) -> Optional[set]:
+    """Project tokens of the excluded product, None (with a warning) when they were not received"""
+    tokens = parse_product_tokens(response_)
+    if tokens is None:
+        logger.warning(f"Projects of the excluded product {exclude_} were not received, the token is excluded as a "
+                       f"project token. Reason: {get_error_message(response_)}")
+        return None
+    return set(tokens)
+
+
+def send_requests(config: ApiConfig, requests: list, threads: int = 10) -> list:
+    """Responses of the requests, sent concurrently from `threads` threads"""
+    if len(requests) < 2:
+        return [call_ws_api(config, x) for x in requests]
+    with ThreadPoolExecutor(max_workers=max(threads, 1)) as executer:
+        return list(executer.map(lambda x: call_ws_api(config, x), requests))
+
+
+def get_excluded(config: ApiConfig, exclude_tokens: list, discovery_cache: Optional[DiscoveryCache] = None,
+                 send_all: Optional[Callable[[list], list]] = None) -> set:
+    """Project tokens excluded by the product (or project) tokens of `exclude_tokens`"""
+    send_all = send_all or (lambda requests: send_requests(config, requests))
+    res = set()
+    missing = []
+    for exclude_ in exclude_tokens:
+        tokens = discovery_cache.get_product(exclude_) if discovery_cache else None
+        if tokens is None:
+            missing.append(exclude_)
+        else:
+            res.update(tokens)
+    responses = send_all([ws_request(config, "getAllProjects", productToken=x) for x in missing])
+    for exclude_, response_ in zip(missing, responses):
+        tokens = parse_exclude_tokens(response_, exclude_)
+        if tokens is not None and discovery_cache:
+            discovery_cache.put_product(exclude_, tokens)
+        res.update(tokens if tokens is not None else {exclude_})
+    return res
+
+
+def get_product_lookups(config: ApiConfig, product_tokens: list, send_all: Callable[[list], list]) -> dict:
+    """Product token -> project tokens of the products whose project vitals were not received, listed with
+    getAllProjects so that the vitals of their projects can be looked up one by one"""
+    res = {}
+    responses = send_all([ws_request(config, "getAllProjects", productToken=x) for x in product_tokens])
+    for product_, response_ in zip(product_tokens, responses):
+        tokens = parse_product_tokens(response_)
+        if tokens is None:
+            logger.warning(f"Projects from the product token {product_} were not received. "
+                           f"Reason: {get_error_message(response_)}")
+        else:
+            logger.info(f"The project vitals of the product token {product_} were not received, the vitals of its "
+                        f"{len(tokens)} projects are looked up one by one")
+            res[product_] = tokens
+    return res
+
+
+def discover_projects(config: ApiConfig, product_tokens: list, project_tokens: list, exclude_tokens: list,
+                      threads: int = 10, discovery_cache: Optional[DiscoveryCache] = None,
+                      cached_vitals: bool = True, send_all: Optional[Callable[[list], list]] = None) -> dict:
+    """Vitals of the projects of the export by token, without the excluded projects
+
+    The projects of a product come from one getProductProjectVitals request, which returns their names, product
+    name and last update; when it fails, they are listed with getAllProjects and their vitals are looked up one by
+    one. With a discovery cache the vitals are taken from it unless `cached_vitals` is False; the vitals received
+    are stored in it either way. The requests of each step are sent together by `send_all`, which returns the
+    responses of a list of requests; by default they are sent from `threads` threads.
+    """
+    send_all = send_all or (lambda requests: send_requests(config, requests, threads))
+    prj_vitals = {}
+    vitals_cache = discovery_cache if cached_vitals else None
+    requests = []
+    for data_prj, scope in get_discovery_requests(config, product_tokens, project_tokens):
+        vitals = vitals_cache.get_scope(get_discovery_key(data_prj)) if vitals_cache else None
+        if vitals is None:
+            requests.append((data_prj, scope))
+        else:
+            prj_vitals.update({x["token"]: x for x in vitals})
+
+    failed_products = []
+    for (data_prj, scope), response_ in zip(requests, send_all([x for x, _ in requests])):
+        product_token = json.loads(data_prj).get("productToken", "")
+        vitals = parse_prj_vitals(response_, scope, warn=not product_token)
+        if vitals is None and product_token:
+            failed_products.append(product_token)
+        elif vitals is not None and discovery_cache:
+            discovery_cache.put_scope(get_discovery_key(data_prj), vitals, product_token=product_token)
+        prj_vitals.update({x["token"]: x for x in vitals or []})
+    product_lookups = get_product_lookups(config, failed_products, send_all) if failed_products else {}
+
+    for token in get_lookup_tokens(project_tokens, prj_vitals) if vitals_cache else []:
+        vitals = vitals_cache.get_project(token)
+        if vitals:
+            prj_vitals[token] = vitals
+
+    explicit_tokens = get_lookup_tokens(project_tokens, prj_vitals)
+    lookup_tokens = list(dict.fromkeys(explicit_tokens + [x for tokens in product_lookups.values() for x in tokens
+                                                          if x not in prj_vitals]))
+    responses = send_all([ws_request(config, "getProjectVitals", projectToken=x) for x in lookup_tokens])
+    explicit_set = set(explicit_tokens)
+    found = {}
+    for token, response_ in zip(lookup_tokens, responses):
+        vitals = parse_project_vitals(response_, token)
+        if vitals is None:
+            logger.warning(f"The project token {token} was not found. Reason: {get_error_message(response_)}")
+            continue
+        found[token] = vitals
+        if discovery_cache and token in explicit_set:
+            discovery_cache.put_scope(f"getProjectVitals:{token}", [vitals])
+    prj_vitals.update(found)
+    for product_, tokens in product_lookups.items():
+        if discovery_cache and all(x in found for x in tokens):
+            discovery_cache.put_scope(get_discovery_key(ws_request(config, "getProductProjectVitals",
+                                                                   productToken=product_)),
+                                      [found[x] for x in tokens], product_token=product_)
+
+    excluded = get_excluded(config, exclude_tokens, discovery_cache, send_all)
+    return {token: x for token, x in prj_vitals.items() if token not in excluded}
+
+
+# License texts
+
+def get_lic_text_from_data_attr_cdx(data):
+    res = []
+    for key, value in data.items():
+        for el_ in value:
+            for lic_ in el_["licenses"]:
+                license_text = lic_["licenseText"] if lic_["licenseText"] else lic_["license"]
+                res.append({
+                    f'SPDXRef-PACKAGE-{el_["library"]}::{lic_["license"]}' : license_text
+                })
+    return res
+
+
+def get_lic_text_from_data_attr_spdx(data):
+    res = []
+    for key, value in data.items():
+        for el_ in value:
+            license_text = ""
+            for lic_ in el_["licenses"]:
+                license_text += "\n" if license_text else ""
+                license_text += lic_["licenseText"] if lic_["licenseText"] else lic_["license"]
+            if license_text:
+                res.append({
+                    f'SPDXRef-PACKAGE-{el_["library"]}' : license_text
+                })
+    return res
+
+
+def get_attribution_request(config: ApiConfig, token: str) -> str:
+    return ws_request(config, "getProjectAttributionReport", projectToken=token, reportingAggregationMode="BY_PROJECT",
+                      reportingScope="LICENSES", exportFormat="JSON")
+
+
+def parse_lic_texts(config: ApiConfig, response_: str) -> Optional[dict]:
+    res_lic = dict()
+    try:
+        data = json.loads(response_)["detail"]
+        if config.sbom_type == "spdx":
+            for res_lic_ in get_lic_text_from_data_attr_spdx(data=data):
+                res_lic.update(res_lic_)
+        elif config.sbom_type == "cdx":
+            for res_lic_ in get_lic_text_from_data_attr_cdx(data=data):
+                res_lic.update(res_lic_)
+    except Exception:
+        return None
+    return res_lic
+
+
+def get_cached_lic_texts(config: ApiConfig, lic_keys: Optional[list]) -> Optional[dict]:
+    return config.lic_cache.lookup(lic_keys) if config.lic_cache and lic_keys is not None else None
+
+
+def store_lic_texts(config: ApiConfig, res_lic: Optional[dict], lic_keys: Optional[list]) -> dict:
+    if res_lic is None:
+        return {}
+    if config.lic_cache:
+        config.lic_cache.update(res_lic, lic_keys)
+    return res_lic
+
+
+def get_prj_lic_texts(config: ApiConfig, token: str, lic_keys: Optional[list] = None) -> dict:
+    """License texts of the project, taken from the license cache when it knows every key of `lic_keys`"""
+    if not config.lic_text:
+        return {}
+    with config.metrics.phase("licenses"):
+        res_lic = get_cached_lic_texts(config, lic_keys)
+        if res_lic is not None:
+            config.metrics.inc("license_cache_hits")
+            return res_lic
+        response_ = call_ws_api(config, get_attribution_request(config, token))
+        return store_lic_texts(config, parse_lic_texts(config, response_), lic_keys)
+
+
+# Reports
+
+def get_spdx_request(config: ApiConfig, token: str) -> str:
+    return ws_request(config, "getProjectSpdxReport", projectToken=token, format="JSON")
+
+
+def enrich_spdx_report(config: ApiConfig, token: str, sbom_prj: dict):
+    """Adds the license texts of the project to the SPDX document"""
+    lic_texts = get_prj_lic_texts(config, token, processing.get_spdx_lic_keys(sbom_prj) if config.lic_cache else None)
+    try:
+        with config.metrics.phase("processing"):
+            processing.enrich_spdx_data(sbom_prj, lic_texts, config.dedup_licenses)
+    except Exception:
+        pass
+
+
+def enrich_cdx_report(config: ApiConfig, token: str, cdx_data: dict):
+    """Adds the license texts of the project to the CDX document"""
+    lic_texts = get_prj_lic_texts(config, token, processing.get_cdx_lic_keys(cdx_data) if config.lic_cache else None)
+    try:
+        with config.metrics.phase("processing"):
+            processing.enrich_cdx_data(cdx_data, lic_texts, config.dedup_licenses)
+    except Exception:
+        pass
+
+
+def get_cdx_request(config: ApiConfig, token: str) -> str:
+    return ws_request(config, "generateProjectReportAsync", projectToken=token, reportType="ProjectSBOMReport",
+                      standard="CycloneDX", format="json")
+
+
+def get_cdx_status_request(config: ApiConfig, uuid: str) -> str:
+    return ws_request(config, "getAsyncProcessStatus", orgToken=config.org_token, uuid=uuid)
+
+
+def get_cdx_download_request(config: ApiConfig, uuid: str) -> str:
+    return ws_request(config, "downloadAsyncReport", orgToken=config.org_token, reportStatusUUID=uuid)
+
+
+def parse_cdx_uuid(response_: str) -> Tuple[str, str]:
+    try:
+        uuid = json.loads(response_)["asyncProcessStatus"]["uuid"]
+    except Exception:
+        uuid = ""
+    return uuid, "" if uuid else get_error_message(response_, "Unexpected error")
+
+
+def parse_cdx_status(response_: str) -> Tuple[str, str]:
+    try:
+        return json.loads(response_)["asyncProcessStatus"]["status"], ""
+    except Exception:
+        return "FAILED", get_error_message(response_, "Unexpected error")
+
+
+def submit_cdx_report(config: ApiConfig, token: str) -> Tuple[str, str]:
+    """uuid of the report job of the project, or "" and the reason"""
+    return parse_cdx_uuid(call_ws_api(config, get_cdx_request(config, token)))
+
+
+def get_cdx_report_status(config: ApiConfig, uuid: str) -> Tuple[str, str]:
+    return parse_cdx_status(call_ws_api(config, get_cdx_status_request(config, uuid)))
+
+
+def download_cdx_report(config: ApiConfig, uuid: str, stream_to: Union[str, IO]) -> bool:
+    """Writes the zip archive of the finished report job to `stream_to`, a path or a binary file object"""
+    return call_ws_api(config, get_cdx_download_request(config, uuid), stream_to=stream_to) is stream_to
+
+
+def get_next_poll_delay(delay: float) -> float:
+    """Delay of the next status request of a CDX job that is not ready yet"""
+    return min(delay * CDX_POLL_BACKOFF, CDX_POLL_MAX_DELAY)
+
+
+def get_poll_wait(delay: float) -> float:
+    # The jitter keeps the jobs submitted together from being polled in bursts
+    return delay * random.uniform(0.9, 1.1)
+
+
+class CdxPoller:
+    """Polls the status of the submitted CDX report jobs from one thread
+
+    add() returns a Future that is completed with (status, error) once the job is SUCCESS or FAILED. The jobs that
+    are due are polled together from a pool of `threads` threads, and each job backs off from CDX_POLL_MIN_DELAY
+    to CDX_POLL_MAX_DELAY, so waiting for a report takes no thread. The time from add() to the final status is
+    recorded as the `generation` or `generation_failed` phase. `get_status` replaces the status request, e.g. to
+    send it from another client; it returns (status, error) like get_cdx_report_status.
+    """
+
+    def __init__(self, config: ApiConfig, threads: int = 10,
+                 get_status: Optional[Callable[[str], Tuple[str, str]]] = None):
+        self.config = config
+        self.get_status = get_status or (lambda uuid: get_cdx_report_status(config, uuid))
+        self._jobs = {}  # uuid -> [future, next poll (monotonic), current delay, start (perf_counter)]
+        self._cond = threading.Condition()
+        self._closed = False
+        self._pool = ThreadPoolExecutor(max_workers=max(threads, 1))
+        self._thread = threading.Thread(target=self._run, name="cdx-poller", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, uuid: str) -> Future:
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The CDX poller is closed")
+            self._jobs[uuid] = [future, time.monotonic() + CDX_POLL_MIN_DELAY, CDX_POLL_MIN_DELAY,
+                                time.perf_counter()]
+            self._cond.notify()
+        return future
+
+    def close(self):
+        """Stops polling; the futures of the jobs still being generated are cancelled"""
+        with self._cond:
+            self._closed = True
+            jobs = list(self._jobs.values())
+            self._jobs.clear()
+            self._cond.notify()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+        self._pool.shutdown(wait=True)
+        for job in jobs:
+            job[0].cancel()
+
+    def _get_status(self, uuid: str) -> Tuple[str, str]:
+        try:
+            return self.get_status(uuid)
+        except Exception as err:
+            return "FAILED", str(err)
+
+    def _get_due(self) -> list:
+        """uuids of the jobs to poll now, waiting until there are some; [] once the poller is closed"""
+        with self._cond:
+            while not self._closed:
+                now = time.monotonic()
+                for uuid in [x for x, job in self._jobs.items() if job[0].cancelled()]:
+                    del self._jobs[uuid]
+                due = [x for x, job in self._jobs.items() if job[1] <= now]
+                if due:
+                    return due
+                next_poll = min((job[1] for job in self._jobs.values()), default=None)
+                self._cond.wait(next_poll - now if next_poll is not None else None)
+            return []
+
+    def _run(self):
+        while True:
+            due = self._get_due()
+            if not due:
+                return
+            statuses = list(self._pool.map(self.config.metrics.pool_task("poll", self._get_status), due))
+            finished = []
+            with self._cond:
+                for uuid, (res_status, err_status) in zip(due, statuses):
+                    job = self._jobs.get(uuid)
+                    if job is None:
+                        continue
+                    if res_status in ("SUCCESS", "FAILED"):
+                        del self._jobs[uuid]
+                        self.config.metrics.observe_phase(
+                            "generation" if res_status == "SUCCESS" else "generation_failed",
+                            time.perf_counter() - job[3])
+                        finished.append((job[0], res_status, err_status))
+                    else:
+                        job[2] = get_next_poll_delay(job[2])
+                        job[1] = time.monotonic() + get_poll_wait(job[2])
+            # The callbacks of the futures run here, outside of the lock
+            for future, res_status, err_status in finished:
+                if future.set_running_or_notify_cancel():
+                    future.set_result((res_status, err_status))
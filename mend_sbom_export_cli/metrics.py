@@ -0,0 +1,228 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from mend_sbom_export_cli._version import __tool_name__
+from mend_sbom_export_cli.state import write_json_atomic
+
+logger = logging.getLogger(__tool_name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+BUCKETS = tuple(2.0 ** x for x in range(-10, 13))  # Upper bounds from ~1ms to ~68min, the last bucket is unbounded
+
+
+def get_quantile(buckets: list, count: int, max_: float, q: float) -> float:
+    """Quantile estimated from the bucket counts, interpolated within its bucket"""
+    rank, seen = q * count, 0
+    for i, bucket_count in enumerate(buckets):
+        if bucket_count and seen + bucket_count > rank:
+            lower = BUCKETS[i - 1] if i else 0.0
+            upper = min(BUCKETS[i], max_) if i < len(BUCKETS) else max_
+            return round(lower + (upper - lower) * (rank - seen) / bucket_count, 6)
+        seen += bucket_count
+    return max_
+
+
+class Histogram:
+    """Number of observed values per bucket, with their sum and maximum
+
+    The memory does not grow with the observations; the quantiles are estimated from the bucket counts.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def summary(self) -> dict:
+        res = {"count": self.count, "sum": round(self.total, 6), "max": round(self.max, 6)}
+        for q in QUANTILES:
+            res[f"p{int(q * 100)}"] = get_quantile(self.buckets, self.count, res["max"], q)
+        res["buckets"] = list(self.buckets)
+        return res
+
+
+def merge_histograms(summaries: list) -> dict:
+    """Combines histogram summaries of several runs"""
+    buckets = [0] * (len(BUCKETS) + 1)
+    for summary in summaries:
+        buckets = [x + y for x, y in zip(buckets, summary.get("buckets", []))]
+    res = {"count": sum(x["count"] for x in summaries), "sum": round(sum(x["sum"] for x in summaries), 6),
+           "max": max((x["max"] for x in summaries), default=0.0)}
+    for q in QUANTILES:
+        res[f"p{int(q * 100)}"] = get_quantile(buckets, res["count"], res["max"], q)
+    res["buckets"] = buckets
+    return res
+
+
+def merge_summaries(summaries: list) -> dict:
+    """Combines the --metrics-out files of several runs, e.g. of the shards of one export"""
+
+    def merge_section(section: str, fields: tuple) -> dict:
+        res = {}
+        for key_ in sorted(set(k for x in summaries for k in x.get(section, {}))):
+            items = [x[section][key_] for x in summaries if key_ in x.get(section, {})]
+            res[key_] = {}
+            for field_ in fields:
+                if isinstance(items[0].get(field_), dict):
+                    res[key_][field_] = merge_histograms([x[field_] for x in items])
+                else:
+                    res[key_][field_] = sum(x.get(field_, 0) for x in items)
+        return res
+
+    counters = defaultdict(int)
+    for summary in summaries:
+        for k, v in summary.get("counters", {}).items():
+            counters[k] += v
+    return {
+        "tool": __tool_name__,
+        "runs": len(summaries),
+        "started": min((x["started"] for x in summaries), default=""),
+        "duration_seconds": max((x["duration_seconds"] for x in summaries), default=0.0),
+        "counters": dict(counters),
+        "phases": {k: merge_histograms([x["phases"][k] for x in summaries if k in x.get("phases", {})])
+                   for k in sorted(set(k for x in summaries for k in x.get("phases", {})))},
+        "requests": merge_section("requests", ("latency", "bytes", "errors")),
+        "pools": merge_section("pools", ("queue_wait", "service")),
+        "projects": sum(x.get("projects", 0) for x in summaries),
+    }
+
+
+class RunMetrics:
+    """Timings and request statistics of a run
+
+    - phases: duration of discovery, license collection, server-side CDX generation, downloads,
+      JSON processing and report writes
+    - requests: latency (including retries), response bytes and errors per API request type
+    - pools: time a task waited in the executor queue vs. the time it ran, per thread pool
+    - tail: the end of the run when fewer projects were left than workers (`tail`), and the idle
+      worker-seconds of that time (`tail_idle`)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self._start_time = time.perf_counter()
+        self.phases = defaultdict(Histogram)
+        self.requests = defaultdict(lambda: {"latency": Histogram(), "bytes": 0, "errors": 0})
+        self.pools = defaultdict(lambda: {"queue_wait": Histogram(), "service": Histogram()})
+        self.counters = defaultdict(int)
+
+    def observe_phase(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase].observe(seconds)
+
+    @contextmanager
+    def phase(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(phase, time.perf_counter() - start)
+
+    def observe_request(self, request_type: str, seconds: float, size: int = 0, ok: bool = True):
+        with self._lock:
+            stats = self.requests[request_type or "unknown"]
+            stats["latency"].observe(seconds)
+            stats["bytes"] += size
+            stats["errors"] += 0 if ok else 1
+
+    def inc(self, counter: str, value: int = 1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def pool_task(self, pool: str, func):
+        """Wraps `func` for an executor; the time between this call and the task start is the queue wait"""
+        queued = time.perf_counter()
+
+        def run(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                with self._lock:
+                    self.pools[pool]["queue_wait"].observe(start - queued)
+                    self.pools[pool]["service"].observe(end - start)
+
+        return run
+
+    def summary(self, extra: dict = None) -> dict:
+        with self._lock:
+            res = {
+                "tool": __tool_name__,
+                "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                "duration_seconds": round(time.perf_counter() - self._start_time, 6),
+                "counters": dict(self.counters),
+                "phases": {k: v.summary() for k, v in self.phases.items()},
+                "requests": {k: {"latency": v["latency"].summary(), "bytes": v["bytes"], "errors": v["errors"]}
+                             for k, v in self.requests.items()},
+                "pools": {k: {"queue_wait": v["queue_wait"].summary(), "service": v["service"].summary()}
+                          for k, v in self.pools.items()},
+            }
+        res.update(extra or {})
+        return res
+
+    def write_json(self, path: str, extra: dict = None):
+        write_json_atomic(path, self.summary(extra))
+        logger.info(f"Run metrics were written to {path}")
+
+    def write_prometheus(self, path: str, extra: dict = None):
+        """Writes the metrics in the Prometheus text format, e.g. for the node_exporter textfile collector"""
+        summary = self.summary(extra)
+        prefix = "sbom_export"
+        lines = []
+
+        def add_summary(name: str, help_: str, label: str, items: dict):
+            lines.extend([f"# HELP {prefix}_{name} {help_}", f"# TYPE {prefix}_{name} summary"])
+            for key_, hist in items.items():
+                for q in QUANTILES:
+                    lines.append(f'{prefix}_{name}{{{label}="{key_}",quantile="{q}"}} {hist[f"p{int(q * 100)}"]}')
+                lines.append(f'{prefix}_{name}_sum{{{label}="{key_}"}} {hist["sum"]}')
+                lines.append(f'{prefix}_{name}_count{{{label}="{key_}"}} {hist["count"]}')
+
+        def add_counter(name: str, help_: str, label: str, items: dict):
+            lines.extend([f"# HELP {prefix}_{name} {help_}", f"# TYPE {prefix}_{name} counter"])
+            lines.extend(f'{prefix}_{name}{{{label}="{k}"}} {v}' for k, v in items.items())
+
+        add_summary("phase_seconds", "Duration of a run phase", "phase", summary["phases"])
+        add_summary("request_seconds", "API request latency including retries", "request_type",
+                    {k: v["latency"] for k, v in summary["requests"].items()})
+        add_counter("request_bytes_total", "API response bytes", "request_type",
+                    {k: v["bytes"] for k, v in summary["requests"].items()})
+        add_counter("request_errors_total", "Failed API requests", "request_type",
+                    {k: v["errors"] for k, v in summary["requests"].items()})
+        add_summary("pool_queue_wait_seconds", "Time a task waited for a worker", "pool",
+                    {k: v["queue_wait"] for k, v in summary["pools"].items()})
+        add_summary("pool_service_seconds", "Time a task ran in a worker", "pool",
+                    {k: v["service"] for k, v in summary["pools"].items()})
+        add_counter("events_total", "Run events", "event", summary["counters"])
+        lines.extend([f"# HELP {prefix}_run_duration_seconds Duration of the last run",
+                      f"# TYPE {prefix}_run_duration_seconds gauge",
+                      f"{prefix}_run_duration_seconds {summary['duration_seconds']}",
+                      f"# HELP {prefix}_last_run_timestamp_seconds Start time of the last run",
+                      f"# TYPE {prefix}_last_run_timestamp_seconds gauge",
+                      f"{prefix}_last_run_timestamp_seconds {round(self.started, 3)}"])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as prom_file:
+            prom_file.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+        logger.info(f"Prometheus metrics were written to {path}")
+
+    def log_summary(self):
+        for phase, hist in sorted(self.phases.items()):
+            summary = hist.summary()
+            logger.debug(f"Phase {phase}: {summary['count']} time(s), {summary['sum']:.2f}s total, "
+                         f"p50 {summary['p50']:.3f}s, p95 {summary['p95']:.3f}s, p99 {summary['p99']:.3f}s")
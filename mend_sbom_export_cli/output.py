@@ -0,0 +1,99 @@
+import gzip
+import io
+import logging
+import os
+import tarfile
+import threading
+import zipfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from mend_sbom_export_cli._version import __tool_name__
+
+logger = logging.getLogger(__tool_name__)
+
+COMPRESSION_SUFFIXES = {"": "", "none": "", "gzip": ".gz", "zstd": ".zst"}
+BUNDLE_TYPES = ("tar", "zip")
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def check_compression(compression: str) -> str:
+    """Returns an error message if the compression is unknown or its module is not installed"""
+    if compression not in COMPRESSION_SUFFIXES:
+        return f"The compression {compression} is not supported."
+    if compression == "zstd" and zstandard is None:
+        return "The zstd compression requires zstandard. Install it with: pip install zstandard"
+    return ""
+
+
+def open_report(path: str, compression: str = "", binary: bool = False):
+    """Opens the report file for writing; the content is compressed on the fly while it is written"""
+    if compression == "gzip":
+        return gzip.open(path, "wb" if binary else "wt", compresslevel=GZIP_LEVEL, encoding=None if binary else "utf-8")
+    if compression == "zstd":
+        writer = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(path, "wb"), closefd=True)
+        return writer if binary else io.TextIOWrapper(writer, encoding="utf-8")
+    return open(path, "wb" if binary else "w", encoding=None if binary else "utf-8")
+
+
+def open_report_reader(path: str, compression: str = ""):
+    """Opens a written report for reading in binary mode; the content is decompressed while it is read"""
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    if compression == "zstd":
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+def read_report(path: str, compression: str = "") -> bytes:
+    """Content of a written report, decompressed"""
+    if compression == "gzip":
+        with gzip.open(path, "rb") as report_file:
+            return report_file.read()
+    if compression == "zstd":
+        with open(path, "rb") as report_file, zstandard.ZstdDecompressor().stream_reader(report_file) as reader:
+            return reader.read()
+    with open(path, "rb") as report_file:
+        return report_file.read()
+
+
+class ReportBundle:
+    """Single .tar or .zip archive of the run, reports are added to it as soon as they are written
+
+    The archive is opened in append mode for a resumed run. Unless `keep_files` is set, the report files are
+    removed from the output directory once they are in the archive.
+    """
+
+    def __init__(self, path: str, append: bool = False, keep_files: bool = False):
+        self.path = path
+        self.keep_files = keep_files
+        self._lock = threading.Lock()
+        mode = "a" if append and os.path.exists(path) else "w"
+        self.is_zip = path.endswith(".zip")
+        if self.is_zip:
+            self._archive = zipfile.ZipFile(path, mode, compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        else:
+            self._archive = tarfile.open(path, mode)
+        self.count = 0
+
+    def add(self, file_path: str, arcname: str):
+        with self._lock:
+            if self.is_zip:
+                # Reports compressed while written are stored as is
+                compressed = arcname.endswith(tuple(x for x in COMPRESSION_SUFFIXES.values() if x))
+                self._archive.write(file_path, arcname=arcname,
+                                    compress_type=zipfile.ZIP_STORED if compressed else zipfile.ZIP_DEFLATED)
+            else:
+                self._archive.add(file_path, arcname=arcname)
+            self.count += 1
+        if not self.keep_files:
+            os.remove(file_path)
+
+    def close(self):
+        with self._lock:
+            self._archive.close()
+        logger.info(f"{self.count} report(s) were added to {self.path}")
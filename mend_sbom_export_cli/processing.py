@@ -0,0 +1,307 @@
+"""CPU-bound report steps: JSON decoding, license enrichment and JSON encoding
+
+Nothing here depends on the CLI globals, so every function can run in a worker process of --processes.
+The process entry points take raw bytes or the path of the downloaded archive instead of parsed documents,
+so that large objects are not pickled between processes.
+"""
+import base64
+import functools
+import hashlib
+import json
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from mend_sbom_export_cli.output import COMPRESSION_SUFFIXES, open_report
+
+LIC_TEXT_REF_PREFIX = "license-text-"
+LIC_TEXT_REF_PROPERTY = "mend:license-text-ref"  # property of a CDX license whose text is in another component
+LIC_TEXT_REF_SPEC_VERSION = "1.5"  # first CycloneDX version with license bom-refs and properties
+LIC_TEXT_B64_CACHE_SIZE = 1024
+SBOM_KEYS = {"spdx": "spdxVersion", "cdx": "bomFormat"}  # a member every document of the type has
+NOT_SBOM_ERROR = "The response is not an SBOM document"
+
+
+def loads(data):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def dump(data, path: str, compression: str = "", compact: bool = False):
+    if compact and orjson:
+        # orjson only supports 2-space indents, so it is used for the minified output only
+        with open_report(path, compression, binary=True) as json_file:
+            json_file.write(orjson.dumps(data))
+        return
+    with open_report(path, compression) as json_file:
+        json.dump(data, json_file, **({"separators": (",", ":")} if compact else {"indent": 4}), ensure_ascii=False)
+
+
+def dumps(data, compact: bool = False) -> bytes:
+    """The encoding of `dump`, returned as bytes"""
+    if compact:
+        if orjson:
+            return orjson.dumps(data)
+        return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return json.dumps(data, indent=4, ensure_ascii=False).encode("utf-8")
+
+
+def is_sbom(doc, sbom_type: str) -> bool:
+    """Whether the document is an SBOM; errors of the API come with HTTP 200 and an errorCode/errorMessage body"""
+    return isinstance(doc, dict) and "errorCode" not in doc and SBOM_KEYS[sbom_type] in doc
+
+
+def get_sbom_error(doc, sbom_type: str) -> str:
+    """Why the document is not an SBOM, "" for an SBOM"""
+    if is_sbom(doc, sbom_type):
+        return ""
+    return str(doc["errorMessage"]) if isinstance(doc, dict) and doc.get("errorMessage") else NOT_SBOM_ERROR
+
+
+def is_sbom_head(head: bytes, sbom_type: str) -> bool:
+    """is_sbom for the beginning of a document that is not parsed; an error response fits in it as a whole"""
+    return f'"{SBOM_KEYS[sbom_type]}"'.encode("utf-8") in head and b'"errorCode"' not in head
+
+
+def get_spdx_lic_keys(sbom_prj) -> list:
+    try:
+        return [(item['SPDXID'],) for item in sbom_prj["packages"]]
+    except Exception:
+        return []
+
+
+@functools.lru_cache(maxsize=4096)
+def get_lic_text_hash(lic_text: str) -> str:
+    return hashlib.sha256(lic_text.encode("utf-8")).hexdigest()[:16]
+
+
+_lic_text_b64 = OrderedDict()  # text hash -> base64 encoding of the text, the most recently used last
+_lic_text_b64_lock = threading.Lock()
+
+
+def get_lic_text_b64(text_hash: str, lic_text: str) -> str:
+    """Base64 encoding of the license text; the most used texts are encoded once per process
+
+    The encodings are cached by the hash of the text, so the cache does not keep the texts themselves.
+    """
+    with _lic_text_b64_lock:
+        encoded = _lic_text_b64.get(text_hash)
+        if encoded is not None:
+            _lic_text_b64.move_to_end(text_hash)
+            return encoded
+    encoded = base64.b64encode(lic_text.encode('utf-8')).decode('utf-8')
+    with _lic_text_b64_lock:
+        _lic_text_b64[text_hash] = encoded
+        if len(_lic_text_b64) > LIC_TEXT_B64_CACHE_SIZE:
+            _lic_text_b64.popitem(last=False)
+    return encoded
+
+
+def clear_lic_text_b64():
+    with _lic_text_b64_lock:
+        _lic_text_b64.clear()
+
+
+def get_spdx_lic_infos(package_ids, lic_texts: dict) -> list:
+    # The license texts of the project are joined with its packages, in the order of the attribution report
+    package_ids = set(package_ids)
+    return [{
+        "licenseId": lic_lib.replace('SPDXRef-PACKAGE-', 'LicenseRef-'),
+        "extractedText": lic_texts.get(lic_lib),
+        "name": lic_lib.replace('SPDXRef-PACKAGE-', 'LicenseRef-'),
+    } for lic_lib in lic_texts if lic_lib in package_ids]
+
+
+def get_spdx_lic_refs(package_ids, lic_texts: dict) -> Tuple[list, dict]:
+    """Extracted licensing infos with one `LicenseRef-<hash>` entry per distinct text, and the LicenseRef of each
+    package"""
+    lic_infos, lic_refs = {}, {}
+    package_ids = set(package_ids)
+    for lic_lib in (x for x in lic_texts if x in package_ids):
+        lic_text = lic_texts[lic_lib]
+        lic_ref = lic_refs[lic_lib] = f"LicenseRef-{get_lic_text_hash(lic_text)}"
+        if lic_ref not in lic_infos:
+            lic_infos[lic_ref] = {"licenseId": lic_ref, "extractedText": lic_text, "name": lic_ref}
+    return list(lic_infos.values()), lic_refs
+
+
+def add_spdx_lic_ref(package: dict, lic_ref: str):
+    """Refers to the extracted licensing info of the package from its concluded license expression"""
+    concluded = package.get("licenseConcluded")
+    if not concluded or concluded in ("NOASSERTION", "NONE"):
+        package["licenseConcluded"] = lic_ref
+    elif lic_ref not in concluded.split():
+        package["licenseConcluded"] = f"({concluded}) AND {lic_ref}" if " " in concluded else \
+            f"{concluded} AND {lic_ref}"
+
+
+def enrich_spdx_data(sbom_prj: dict, lic_texts: dict, dedup: bool = False):
+    if dedup:
+        lic_infos, lic_refs = get_spdx_lic_refs((item['SPDXID'] for item in sbom_prj["packages"]), lic_texts)
+        for package in sbom_prj["packages"]:
+            if package['SPDXID'] in lic_refs:
+                add_spdx_lic_ref(package, lic_refs[package['SPDXID']])
+    else:
+        lic_infos = get_spdx_lic_infos((item['SPDXID'] for item in sbom_prj["packages"]), lic_texts)
+    if lic_infos:
+        sbom_prj.setdefault("hasExtractedLicensingInfos", []).extend(lic_infos)
+
+
+def get_cdx_lic_name(license_: dict) -> str:
+    for field_ in ('id', 'name'):
+        try:
+            if license_['license'][field_] != '':
+                return license_['license'][field_]
+        except Exception:
+            pass
+    return ''
+
+
+def norm_lic_name(license_name: str) -> str:
+    return license_name.replace('-',' ').replace('_',' ')
+
+
+def get_cdx_lic_keys(cdx_data: dict) -> list:
+    return [(f"SPDXRef-PACKAGE-{el_['name']}::{license_name}",
+             f"SPDXRef-PACKAGE-{el_['name']}::{norm_lic_name(license_name)}")
+            for el_ in cdx_data.get("components", [])
+            for license_name in map(get_cdx_lic_name, el_.get("licenses", []))]
+
+
+def build_cdx_lic_index(lic_texts: dict) -> dict:
+    """Indexes `SPDXRef-PACKAGE-<library>::<license>` texts as library -> license -> text
+
+    The license names are kept as the attribution report has them; only the license names of the components are
+    normalized by the lookup.
+    """
+    lic_index = {}
+    for key_, text in lic_texts.items():
+        library, _, license_name = key_[len("SPDXRef-PACKAGE-"):].rpartition("::")
+        lic_index.setdefault(library, {})[license_name] = text
+    return lic_index
+
+
+def get_cdx_lic_text(license_name: str, text_hash: str, lic_text: str, ref_: str = "") -> dict:
+    license_ = {"name": f"{license_name}"}
+    if ref_:
+        license_["bom-ref"] = ref_
+    license_["text"] = {
+        "contentType": "text/plain",
+        "encoding": "base64",
+        "content": get_lic_text_b64(text_hash, lic_text)
+    }
+    return {"license": license_}
+
+
+def get_cdx_lic_text_ref(license_name: str, ref_: str) -> dict:
+    return {"license": {"name": f"{license_name}", "properties": [{"name": LIC_TEXT_REF_PROPERTY, "value": ref_}]}}
+
+
+def set_cdx_spec_version(cdx_data: dict, spec_version: str):
+    """Raises the specVersion of the document to `spec_version` when it is lower"""
+    try:
+        current = tuple(int(x) for x in str(cdx_data.get("specVersion", "")).split("."))
+    except ValueError:
+        return
+    if current < tuple(int(x) for x in spec_version.split(".")):
+        cdx_data["specVersion"] = spec_version
+
+
+def enrich_cdx_data(cdx_data: dict, lic_texts: dict, dedup: bool = False):
+    """Adds the license texts to the evidence of the components
+
+    With `dedup` every distinct text is added once, by the first license with the text, with the bom-ref
+    `license-text-<hash>`. The other licenses with the same text carry the `mend:license-text-ref` property,
+    whose value is that bom-ref. License bom-refs and properties need CycloneDX 1.5, the specVersion of an older
+    document is raised to it.
+    """
+    lic_index = build_cdx_lic_index(lic_texts)
+    text_refs = set()
+    for i, el_ in enumerate(cdx_data["components"]):
+        lic_txt = []
+        library_lics = lic_index.get(el_['name'])
+        if not library_lics:
+            continue
+        for license_ in el_["licenses"]:
+            license_name = get_cdx_lic_name(license_)
+            lic_text = library_lics.get(license_name)
+            lic_text = lic_text if lic_text else library_lics.get(norm_lic_name(license_name))
+            if lic_text is None:
+                continue
+            text_hash = get_lic_text_hash(lic_text)
+            ref_ = f"{LIC_TEXT_REF_PREFIX}{text_hash}" if dedup else ""
+            if ref_ in text_refs:
+                lic_txt.append(get_cdx_lic_text_ref(license_name, ref_))
+            else:
+                lic_txt.append(get_cdx_lic_text(license_name, text_hash, lic_text, ref_))
+                if ref_:
+                    text_refs.add(ref_)
+        if lic_txt:
+            cdx_data["components"][i].update({
+                "evidence": {
+                    "licenses": lic_txt
+                }
+            })
+    if text_refs:
+        set_cdx_spec_version(cdx_data, LIC_TEXT_REF_SPEC_VERSION)
+
+
+def read_cdx_zip(zip_path: str) -> Tuple[dict, str]:
+    """Returns the CDX document of the downloaded archive and its file name"""
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        rep_name = zip_ref.namelist()[0]
+        with zip_ref.open(rep_name) as file:
+            return loads(file.read()), rep_name
+
+
+# Entry points of the worker processes
+
+def spdx_lic_keys(raw: bytes) -> list:
+    try:
+        return get_spdx_lic_keys(loads(raw))
+    except Exception:
+        return []
+
+
+def write_spdx(raw: bytes, lic_texts: dict, path: str, compression: str = "", compact: bool = False,
+               dedup: bool = False) -> bool:
+    """Writes the enriched SPDX report and returns whether the server returned an SPDX document"""
+    try:
+        sbom_prj = loads(raw)
+    except Exception:
+        sbom_prj = []
+    try:
+        enrich_spdx_data(sbom_prj, lic_texts, dedup)
+    except Exception:
+        pass
+    dump(sbom_prj, path, compression, compact)
+    return is_sbom(sbom_prj, "spdx")
+
+
+def cdx_lic_keys(zip_path: str) -> list:
+    try:
+        return get_cdx_lic_keys(read_cdx_zip(zip_path)[0])
+    except Exception:
+        return []
+
+
+def write_cdx(zip_path: str, lic_texts: dict, out_dir: str, compression: str = "", compact: bool = False,
+              dedup: bool = False) -> str:
+    """Writes the enriched CDX report of the downloaded archive and returns its name ("" on failure or when the
+    archive holds an error response)"""
+    try:
+        cdx_data, rep_name = read_cdx_zip(zip_path)
+    except Exception:
+        return ""
+    try:
+        enrich_cdx_data(cdx_data, lic_texts, dedup)
+    except Exception:
+        pass
+    dump(cdx_data, os.path.join(out_dir, f"{rep_name}{COMPRESSION_SUFFIXES[compression]}"), compression, compact)
+    return rep_name if is_sbom(cdx_data, "cdx") else ""
@@ -1,21 +1,33 @@
 import time
 import argparse
-import concurrent
 import inspect
-import json
 import logging
 import os
+import shutil
 import sys
-from importlib import metadata
-import requests
+import tempfile
+import threading
 import re
-import io
 import zipfile
-from concurrent.futures import ThreadPoolExecutor
-from typing import Tuple
-import base64
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Tuple
 from mend_sbom_export_cli._version import __version__, __tool_name__, __description__
+from mend_sbom_export_cli.aggregate import AGGREGATE_SCOPES, SbomAggregator
 from mend_sbom_export_cli.const import aliases, varenvs
+from mend_sbom_export_cli.delta import DELTA_MODES, DeltaIndex, DeltaReport
+from mend_sbom_export_cli.discovery import DiscoveryCache
+from mend_sbom_export_cli.lic_cache import LicenseCache
+from mend_sbom_export_cli import mend_api
+from mend_sbom_export_cli.mend_api import DOWNLOAD_CHUNK_SIZE, get_prj_title
+from mend_sbom_export_cli.metrics import RunMetrics
+from mend_sbom_export_cli.output import BUNDLE_TYPES, COMPRESSION_SUFFIXES, ReportBundle, check_compression, open_report
+from mend_sbom_export_cli import processing
+from mend_sbom_export_cli.processing import enrich_cdx_data, enrich_spdx_data, get_cdx_lic_keys, get_spdx_lic_keys
+from mend_sbom_export_cli.scheduling import CostHistory, LaneQueue, TailTracker
+from mend_sbom_export_cli.shards import filter_shard, get_shard_id
+from mend_sbom_export_cli import streaming
+from mend_sbom_export_cli.state import ExportState, RunJournal, get_shard_file_name
+from mend_sbom_export_cli.ws_client import RateLimiter, RequestGovernor, WsClient
 
 logger = logging.getLogger(__tool_name__)
 logger.setLevel(logging.DEBUG)
@@ -28,24 +40,30 @@ formatter = logging.Formatter('[%(asctime)s] %(levelname)5s %(message)s', "%Y-%m
 s_handler = logging.StreamHandler()
 s_handler.setFormatter(formatter)
 s_handler.setLevel(is_debug)
-logger.addHandler(s_handler)
+if not logger.handlers:  # `python -m` imports the module a second time, see the end of the file
+    logger.addHandler(s_handler)
 logger.propagate = False
 
 APP_TITLE = "Mend SBOM Cli"
-API_VERSION = "1.4"
-
-try:
-    APP_VERSION = metadata.version(f'mend_{__tool_name__}') if metadata.version(f'mend_{__tool_name__}') else __version__
-except:
-    APP_VERSION = __version__
 
 args = None
 PROJECT_PARALLELISM_LEVEL = 0
-lic_texts = {}
 short_lst_prj = []
+ws_client = None
+lic_cache = None
+export_state = None
+run_journal = None
+report_bundle = None
+process_pool = None
+aggregator = None
+delta_index = None
+cost_history = None
+discovery_cache = None
+prj_vitals_data = {}  # token -> projectVitals entry received during the discovery
+metrics = RunMetrics()
 token_pattern = r"^[0-9a-zA-Z]{64}$"
 uuid_pattern = r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"
-AGENT_INFO = {"agent": f"ps-{__tool_name__.replace('_', '-')}", "agentVersion": APP_VERSION}
+BUNDLE_NAME = "sbom_reports"
 
 
 def try_or_error(supplier, msg):
@@ -105,104 +123,46 @@ def check_patterns():
     return res
 
 
-def get_project_list():
-    def get_prj_name(token):
-        data_prj = json.dumps({
-            "requestType": "getProjectVitals",
-            "userKey": args.ws_user_key,
-            "projectToken": token
-        })
-        res = json.loads(call_ws_api(data=data_prj))
-        return try_or_error(lambda: f'{res["projectVitals"][0]["productName"]}:{res["projectVitals"][0]["name"]}', try_or_error(lambda: res["errorMessage"],
-                                                      f"Internal error during getting project data by token {token}"))
+def get_tokens(tokens: str) -> list:
+    return tokens.split(",") if tokens else []
 
-    res = []
-    if args.projecttoken:
-        res.extend([{x: get_prj_name(x)} for x in args.projecttoken.split(",")])
 
-    if args.producttoken:
-        products = args.producttoken.split(",")
-        for product_ in products:
-            data_prj = json.dumps(
-                {"requestType": "getAllProjects",
-                 "userKey": args.ws_user_key,
-                 "productToken": product_,
-                 })
-            try:
-                response_ = call_ws_api(data=data_prj)
-                err_code = 0
-                err_msg = ""
-                try:
-                    err_code = json.loads(response_)["errorCode"]
-                    err_msg = json.loads(response_)["errorMessage"]
-                except:
-                    prj_data = json.loads(response_)["projects"]
-                    res.extend([{x["projectToken"]: get_prj_name(x["projectToken"])} for x in prj_data])  # x["projectName"]
-                if err_code != 0:
-                    logger.warning(f"Projects from the product token {product_} were not received. Reason: {err_msg}")
-            except Exception as err:
-                pass
-    elif not args.projecttoken:
-        data_prj = json.dumps(
-            {"requestType": "getOrganizationProjectVitals",
-             "userKey": args.ws_user_key,
-             "orgToken": args.ws_token,
-             })
-        try:
-            err_code = 0
-            err_msg = ""
-            response_ = call_ws_api(data=data_prj)
-            try:
-                err_code = json.loads(response_)["errorCode"]
-                err_msg = json.loads(response_)["errorMessage"]
-            except:
-                prj_data = json.loads(response_)["projectVitals"]
-                res.extend([{x["token"]: get_prj_name(x["token"])} for x in prj_data])  # x["name"]
-            if err_code != 0:
-                logger.warning(f"Projects from the org token {args.ws_token} were not received. Reason: {err_msg}")
-        except:
-            pass
+def get_api_config() -> mend_api.ApiConfig:
+    """Configuration of the requests and of the per-project steps of this run, see mend_api"""
+    return mend_api.ApiConfig(url=args.ws_url, user_key=args.ws_user_key, ws_client=get_ws_client(), metrics=metrics,
+                              org_token=args.ws_token, sbom_type=args.type, lic_text=is_lic_text_required(),
+                              dedup_licenses=is_lic_dedup(), lic_cache=lic_cache)
 
-    exclude_tokens = []
-    if args.exclude:
-        excludes = args.exclude.split(",")
-        for exclude_ in excludes:
-            data_prj = json.dumps(
-                {"requestType": "getAllProjects",
-                 "userKey": args.ws_user_key,
-                 "productToken": exclude_,
-                 })
-            try:
-                prj_data = json.loads(call_ws_api(data=data_prj))["projects"]
-                exclude_tokens.extend([{x["projectToken"]: get_prj_name(x["projectToken"])} for x in prj_data])  #  x["projectName"]
-            except:
-                exclude_tokens.append(exclude_)
-        res = list(set(res) - set(exclude_tokens))
-    return res
 
+def is_vitals_cached() -> bool:
+    # --incremental compares the lastUpdatedDate of the projects, which has to come from the server
+    return bool(discovery_cache) and args.incremental.lower() != "true"
 
-def call_ws_api(data, header={"Content-Type": "application/json"}, method="POST", download=False):
-    global args
-    data_json = json.loads(data)
-    data_json["agentInfo"] = AGENT_INFO
-    try:
-        res_ = requests.request(
-            method=method,
-            url=f"{extract_url(args.ws_url)}/api/v{API_VERSION}",
-            data=json.dumps(data_json),
-            headers=header, )
-        if download:
-            res = res_.content if res_.status_code == 200 else ""
-        else:
-            res = res_.text if res_.status_code == 200 else ""
 
-    except Exception as err:
-        res = f"Error was raised. {err}"
-        logger.error(f'[{ex()}] {err}')
-    return res
+def get_project_list(send_all=None):
+    """Projects of the run; `send_all` sends the requests of each discovery step, see mend_api.discover_projects"""
+    prj_vitals = mend_api.discover_projects(get_api_config(), get_tokens(args.producttoken),
+                                            get_tokens(args.projecttoken), get_tokens(args.exclude),
+                                            threads=PROJECT_PARALLELISM_LEVEL, discovery_cache=discovery_cache,
+                                            cached_vitals=is_vitals_cached(), send_all=send_all)
+    prj_vitals_data.update(prj_vitals)
+    return [{token_: get_prj_title(x)} for token_, x in prj_vitals.items()]
+
 
+def get_ws_client() -> WsClient:
+    global ws_client
+    if ws_client is None:
+        ws_client = WsClient(pool_size=PROJECT_PARALLELISM_LEVEL or 10)
+    return ws_client
 
-def parse_args():
+
+def call_ws_api(data: str, download: bool = False, stream_to: str = ""):
+    """Sends the request to Mend API. With `stream_to` the response body is written to that file in chunks
+    and the file path is returned instead of the content"""
+    return mend_api.call_ws_api(get_api_config(), data, download=download, stream_to=stream_to)
+
+
+def parse_args(argv: Optional[list] = None):
     parser = argparse.ArgumentParser(description=__description__)
     parser.add_argument(*aliases.get_aliases_str("serviceuser"), help="Mend service user email", dest='email',
                         default=varenvs.get_env("serviceuser"))
@@ -216,323 +176,830 @@ def parse_args():
                         default=varenvs.get_env("wsproject"))
     parser.add_argument(*aliases.get_aliases_str("exclude"), help="Exclude Mend project/product scope", dest='exclude',
                         default=varenvs.get_env("wsexclude"))
-    parser.add_argument(*aliases.get_aliases_str("output"), help="Output directory", dest='out_dir', default=os.getcwd())
+    parser.add_argument(*aliases.get_aliases_str("output"), help="Output directory", dest='out_dir',
+                        default=os.getcwd())
     parser.add_argument(*aliases.get_aliases_str("url"), help="Mend server URL", dest='ws_url',
                         default=varenvs.get_env("wsurl"), required=not varenvs.get_env("wsurl"))
     parser.add_argument(*aliases.get_aliases_str("lic"), help="Include license text for each project", dest='lictext',
                         default="false")
-    parser.add_argument(*aliases.get_aliases_str("threads"), help="Number of threads", dest='threads',
-                        default=10)
+    parser.add_argument(*aliases.get_aliases_str("deduplicenses"),
+                        help="Add each distinct license text once per report and refer to it from the "
+                             "packages/components",
+                        dest='dedup_licenses', default="false")
+    parser.add_argument(*aliases.get_aliases_str("threads"),
+                        help="Number of threads (concurrent requests for the async engine)", dest='threads', default=10)
+    parser.add_argument(*aliases.get_aliases_str("liccache"), help="License text cache directory (disabled if empty)",
+                        dest='lic_cache_dir', default=varenvs.get_env("liccache"))
+    parser.add_argument(*aliases.get_aliases_str("liccachesize"), help="License text cache size limit in MB",
+                        dest='lic_cache_size', default=100)
+    parser.add_argument(*aliases.get_aliases_str("liccachettl"), help="License text cache entries lifetime in hours",
+                        dest='lic_cache_ttl', default=168)
+    parser.add_argument(*aliases.get_aliases_str("discoveryttl"),
+                        help="Reuse the projects discovered by an earlier run for this many hours "
+                             "(0 - discover every run)",
+                        dest='discovery_ttl', default=0)
+    parser.add_argument(*aliases.get_aliases_str("refreshdiscovery"),
+                        help="Discover the projects again, ignoring the cached discovery", dest='refresh_discovery',
+                        default="false")
+    parser.add_argument(*aliases.get_aliases_str("incremental"),
+                        help="Skip projects not updated since the previous export", dest='incremental',
+                        default="false")
+    parser.add_argument(*aliases.get_aliases_str("resume"),
+                        help="Continue the interrupted run in the same output directory", dest='resume',
+                        default="false")
+    parser.add_argument(*aliases.get_aliases_str("ratelimit"),
+                        help="Max API requests per second for the whole run (0 - unlimited)", dest='rate_limit',
+                        default=0)
+    parser.add_argument(*aliases.get_aliases_str("retries"), help="Max retries of a throttled or failed API request",
+                        dest='max_retries', default=5)
+    parser.add_argument(*aliases.get_aliases_str("engine"), help="Execution engine (thread or async)", dest='engine',
+                        default="thread")
     parser.add_argument(*aliases.get_aliases_str("type"), help="Report type (SPDX or CDX)", dest='type', default="spdx")
-    arguments = parser.parse_args()
+    parser.add_argument(*aliases.get_aliases_str("compact"), help="Write minified JSON reports", dest='compact',
+                        default="false")
+    parser.add_argument(*aliases.get_aliases_str("stream"),
+                        help="Parse the SPDX reports event by event from a temporary file instead of in memory",
+                        dest='stream', default="false")
+    parser.add_argument(*aliases.get_aliases_str("compress"),
+                        help="Compress the reports while writing (none, gzip or zstd)", dest='compress',
+                        default="none")
+    parser.add_argument(*aliases.get_aliases_str("bundle"),
+                        help="Collect the reports of the run into one archive (tar or zip)", dest='bundle', default="")
+    parser.add_argument(*aliases.get_aliases_str("processes"),
+                        help="Worker processes for JSON parsing and license enrichment "
+                             "(0 - in the threads, auto - one per CPU core)",
+                        dest='processes', default=0)
+    parser.add_argument(*aliases.get_aliases_str("aggregate"),
+                        help="Also merge the reports into one SBOM per product or for the org (product or org)",
+                        dest='aggregate', default="")
+    parser.add_argument(*aliases.get_aliases_str("smalllane"),
+                        help="Threads reserved for the smallest projects while the largest run first "
+                             "(auto - a fifth of the threads)",
+                        dest='small_lane', default="auto")
+    parser.add_argument(*aliases.get_aliases_str("delta"),
+                        help="Write the component changes since the previous export next to (true) or instead of "
+                             "(only) the reports",
+                        dest='delta', default="false")
+    parser.add_argument(*aliases.get_aliases_str("shardindex"),
+                        help="Index of this runner's shard, from 0 to shard count - 1", dest='shard_index',
+                        default=varenvs.get_env("shardindex") or 0)
+    parser.add_argument(*aliases.get_aliases_str("shardcount"), help="Number of shards the export is split into",
+                        dest='shard_count', default=varenvs.get_env("shardcount") or 1)
+    parser.add_argument(*aliases.get_aliases_str("metricsout"), help="Write the run metrics to this JSON file",
+                        dest='metrics_out', default=varenvs.get_env("metricsout"))
+    parser.add_argument(*aliases.get_aliases_str("prometheusout"),
+                        help="Write the run metrics to this Prometheus textfile", dest='prometheus_out',
+                        default=varenvs.get_env("prometheusout"))
+    parser.add_argument(*aliases.get_aliases_str("submitrate"),
+                        help="Max CDX report generation requests per second (0 - unlimited)", dest='submit_rate',
+                        default=0)
+    arguments = parser.parse_args(argv)
 
     return arguments
 
 
-def extract_url(url: str) -> str:
-    url_ = url if url.startswith("https://") else f"https://{url}"
-    url_ = url_.replace("http://", "")
-    pos = url_.find("/", 8)  # Not using any suffix, just direct url
-    return url_[0:pos] if pos > -1 else url_
+def is_lic_text_required() -> bool:
+    return args.lictext.lower() == "true"
 
 
-def get_lic_text_from_data_attr_cdx(data):
-    res = []
-    for key, value in data.items():
-        for el_ in value:
-            for lic_ in el_["licenses"]:
-                license_text = lic_["licenseText"] if lic_["licenseText"] else lic_["license"]
-                res.append({
-                    f'SPDXRef-PACKAGE-{el_["library"]}::{lic_["license"]}' : license_text
-                })
-    return res
+def is_lic_dedup() -> bool:
+    return args.dedup_licenses.lower() == "true"
 
 
-def get_lic_text_from_data_attr_spdx(data):
-    res = []
-    for key, value in data.items():
-        for el_ in value:
-            license_text = ""
-            for lic_ in el_["licenses"]:
-                license_text += "\n" if license_text else ""
-                license_text += lic_["licenseText"] if lic_["licenseText"] else lic_["license"]
-            if license_text:
-                res.append({
-                    f'SPDXRef-PACKAGE-{el_["library"]}' : license_text
-                })
-    return res
+def get_prj_lic_texts(token: str, lic_keys: Optional[list] = None) -> dict:
+    """License texts of the project, taken from the license cache when it knows every key of `lic_keys`"""
+    return mend_api.get_prj_lic_texts(get_api_config(), token, lic_keys)
 
 
-def get_lic_list() -> dict:
-    global res_lic
-    res_lic = dict()
+def get_compression() -> str:
+    return args.compress.lower()
 
-    def generic_thread_lic_text(ent_l: list, worker: callable) -> Tuple[list, list]:
-        data = []
-        errors = []
 
-        with ThreadPoolExecutor(max_workers=PROJECT_PARALLELISM_LEVEL) as executer:
-            futures = [executer.submit(worker, ent) for ent in ent_l]
+def get_out_name(rep_name: str) -> str:
+    """Name of the written report file: the compressed report gets the suffix of its compression"""
+    return f"{rep_name}{COMPRESSION_SUFFIXES[get_compression()]}" if rep_name else rep_name
 
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    temp_l = future.result()
-                    if temp_l:
-                        data.extend(temp_l)
-                except Exception as e:
-                    errors.append(e)
-                    logger.error(f"Error on future: {future.result()}")
 
-        return data, errors
+def get_out_path(rep_name: str) -> str:
+    return os.path.join(args.out_dir, get_out_name(rep_name))
 
-    def get_lic_text(prj):
-        try:
-            for key, value in prj.items():
-                data_prj = json.dumps({
-                    "requestType": "getProjectAttributionReport",
-                    "userKey": args.ws_user_key,
-                    "projectToken": key,
-                    "reportingAggregationMode": "BY_PROJECT",
-                    "reportingScope" : "LICENSES",
-                    "exportFormat": "JSON"
-                })
-            data = json.loads(call_ws_api(data=data_prj))["detail"]
-            if args.type.lower() == "spdx":
-                for res_lic_ in get_lic_text_from_data_attr_spdx(data=data):
-                    res_lic.update(res_lic_)
-            elif args.type.lower() == "cdx":
-                for res_lic_ in get_lic_text_from_data_attr_cdx(data=data):
-                    res_lic.update(res_lic_)
-        except Exception as err:
-            pass
-    generic_thread_lic_text(ent_l=short_lst_prj, worker=get_lic_text)
-    return res_lic
+
+def is_compact() -> bool:
+    return args.compact.lower() == "true"
+
+
+def write_json_report(data, rep_name: str):
+    with metrics.phase("write"):
+        processing.dump(data, get_out_path(rep_name), get_compression(), is_compact())
+
+
+def run_cpu(func, *args_):
+    """Runs a CPU-bound step of `processing` in the process pool, or in the calling thread without --processes"""
+    with metrics.phase("processing"):
+        return process_pool.submit(func, *args_).result() if process_pool else func(*args_)
+
+
+def get_spdx_request(token: str) -> str:
+    return mend_api.get_spdx_request(get_api_config(), token)
 
 
 def create_sbom_prj(token: str):
-    data_sbom = json.dumps({
-        "requestType": "getProjectSpdxReport",
-        "userKey": args.ws_user_key,
-        "projectToken": token,
-        "format":"JSON"
-    })
-    return try_or_error(lambda: json.loads(call_ws_api(data=data_sbom)), [])
-
-
-def create_cyclone(prj_: str):
-    for key, value in prj_.items():
-        token = key
-    data_sbom = json.dumps({
-        "requestType": "generateProjectReportAsync",
-        "projectToken": token,
-        "userKey": args.ws_user_key,
-        "reportType": "ProjectSBOMReport",
-        "standard": "CycloneDX",
-        "format": "json"
-    })
-    res = try_or_error(lambda: json.loads(call_ws_api(data=data_sbom)), [])
+    with metrics.phase("download"):
+        response_ = call_ws_api(data=get_spdx_request(token))
+    with metrics.phase("processing"):
+        return try_or_error(lambda: processing.loads(response_), [])
+
+
+def get_spdx_rep_name(prj_: dict) -> str:
+    value = next(iter(prj_.values()))
+    rep_name = f"SPDX report for {value.split(':')[1]}.json"
+    return rep_name.replace("/","_")
+
+
+def get_spdx_result_msg(rep_name: str, created: bool) -> str:
+    if not created:
+        return "The creation report file was failed."
+    return f"The report file {get_out_name(rep_name)} was created."
+
+
+def write_spdx_report(prj_: dict, sbom_prj, lic_texts: dict) -> str:
+    rep_name = get_spdx_rep_name(prj_)
     try:
-        uuid = res["asyncProcessStatus"]["uuid"]
-        data_status = json.dumps(
-            {
-                "requestType": "getAsyncProcessStatus",
-                "orgToken": args.ws_token,
-                "userKey": args.ws_user_key,
-                "uuid": uuid
-            }
-        )
-        res_status = ""
-        while res_status != "SUCCESS" and res_status != "FAILED":
-            time.sleep(5)
-            status = try_or_error(lambda: json.loads(call_ws_api(data=data_status)), [])
-            try:
-                res_status = status["asyncProcessStatus"]["status"]
-            except Exception as err:
-                try:
-                    err_status = status["errorMessage"]
-                    res_status = "FAILED"
-                except:
-                    err_status = "Unexpected error"
-                    res_status = "FAILED"
-        if res_status == "SUCCESS":
-            data_download = json.dumps(
-                {
-                    "requestType": "downloadAsyncReport",
-                    "orgToken": args.ws_token,
-                    "userKey": args.ws_user_key,
-                    "reportStatusUUID": uuid
-                }
-            )
-            status_download = try_or_error(lambda: call_ws_api(data=data_download, download=True), [])
-            if status_download:
-                zip_bytesio = io.BytesIO(status_download)
-                with zipfile.ZipFile(zip_bytesio, 'r') as zip_ref:
-                    zip_file_contents = zip_ref.namelist()
-                    for file_name in zip_file_contents:
-                        with zip_ref.open(file_name) as file:
-                            file_content = file.read()
-                            json_content_str = file_content.decode('utf-8')
-                            cdx_data = json.loads(json_content_str)
-                            rep_name = zip_file_contents[0]
-            else:
-                cdx_data = {}
+        with metrics.phase("processing"):
+            enrich_spdx_data(sbom_prj, lic_texts, is_lic_dedup())
+    except Exception as err:
+        pass
+
+    write_json_report(sbom_prj, rep_name)
+    return get_spdx_result_msg(rep_name, processing.is_sbom(sbom_prj, "spdx"))
+
+
+def create_spdx_in_process(prj_: dict) -> str:
+    """create_spdx with the raw report handed to a worker process for parsing, enrichment and writing"""
+    token = next(iter(prj_))
+    with metrics.phase("download"):
+        raw = call_ws_api(data=get_spdx_request(token), download=True)
+    lic_keys = run_cpu(processing.spdx_lic_keys, raw) if lic_cache and is_lic_text_required() else None
+    rep_name = get_spdx_rep_name(prj_)
+    created = run_cpu(processing.write_spdx, raw, get_prj_lic_texts(token, lic_keys), get_out_path(rep_name),
+                      get_compression(), is_compact(), is_lic_dedup())
+    record_report(prj_, rep_name if created else "", processing.NOT_SBOM_ERROR)
+    return get_spdx_result_msg(rep_name, created)
+
+
+def is_streamed() -> bool:
+    return args.stream.lower() == "true"
+
+
+def create_spdx_streamed(prj_: dict) -> str:
+    """create_spdx through a temporary file; the report is never held in memory as a whole"""
+    token = next(iter(prj_))
+    rep_name = get_spdx_rep_name(prj_)
+    src_path = get_tmp_path(".json.part")
+    try:
+        with metrics.phase("download"):
+            downloaded = call_ws_api(data=get_spdx_request(token), stream_to=src_path) == src_path
+        if not downloaded:
+            record_report(prj_, "")
+            return get_spdx_result_msg(rep_name, False)
+        lic_keys = run_cpu(streaming.spdx_lic_keys, src_path) if lic_cache and is_lic_text_required() else None
+        # Without --processes the report is written in this thread and feeds --aggregate/--delta on the way
+        feed = get_report_feed(prj_) if not process_pool else None
+        created = run_cpu(streaming.write_spdx, src_path, get_prj_lic_texts(token, lic_keys), get_out_path(rep_name),
+                          get_compression(), is_compact(), is_lic_dedup(), feed)
+        record_report(prj_, rep_name if created else "", processing.NOT_SBOM_ERROR, feed=feed)
+    finally:
+        try_or_error(lambda: os.remove(src_path), None)
+    return get_spdx_result_msg(rep_name, created)
+
+
+def create_spdx(prj_: dict) -> str:
+    if is_streamed():
+        return create_spdx_streamed(prj_)
+    if process_pool:
+        return create_spdx_in_process(prj_)
+    token = next(iter(prj_))
+    sbom_prj = create_sbom_prj(token=token)
+    res = write_spdx_report(prj_, sbom_prj, get_prj_lic_texts(token, get_spdx_lic_keys(sbom_prj)))
+    error = processing.get_sbom_error(sbom_prj, "spdx")
+    record_report(prj_, "" if error else get_spdx_rep_name(prj_), error, doc=sbom_prj)
+    return res
+
+
+def get_tmp_path(suffix: str) -> str:
+    fd, tmp_path = tempfile.mkstemp(suffix=suffix, dir=args.out_dir)
+    os.close(fd)
+    return tmp_path
+
+
+def get_cdx_tmp_path() -> str:
+    return get_tmp_path(".zip.part")
+
+
+def read_cdx_report(zip_path: str) -> Tuple[dict, str]:
+    cdx_data = {}
+    rep_name = ""
+    try:
+        if zip_path:
+            with metrics.phase("processing"):
+                cdx_data, rep_name = processing.read_cdx_zip(zip_path)
+    except Exception as err:
+        rep_name = ""
+    return cdx_data, rep_name
+
+
+def copy_cdx_report(zip_path: str, feed: Optional[streaming.ReportFeed] = None) -> str:
+    """Extracts the report from the downloaded archive as is. Returns its name, or "" when the archive holds an error
+    response. Without a feed the report is not parsed and only its beginning is checked; with one the report is
+    parsed while it is copied"""
+    rep_name = ""
+    try:
+        if zip_path:
+            with metrics.phase("write"), zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                rep_name = zip_ref.namelist()[0]
+                with zip_ref.open(rep_name) as file, \
+                        open_report(get_out_path(rep_name), get_compression(), binary=True) as json_file:
+                    if feed:
+                        is_sbom = streaming.copy_report(file, json_file, feed, "cdx")
+                    else:
+                        head = file.read(DOWNLOAD_CHUNK_SIZE)
+                        json_file.write(head)
+                        shutil.copyfileobj(file, json_file, DOWNLOAD_CHUNK_SIZE)
+                        is_sbom = processing.is_sbom_head(head, "cdx")
+            if not is_sbom:
                 rep_name = ""
-        else:
-            logger.error(f"Downloading status is FAILED: {try_or_error(lambda: err_status, '')}. Please, repeat later")
-            cdx_data = {}
-            rep_name = ""
-
-        for i, el_ in enumerate(cdx_data["components"]):
-            lic_txt = []
-            for license_ in el_["licenses"]:
-                license_name = try_or_error(lambda: license_['license']['id'], '')
-                if(license_name == ''):
-                    license_name = try_or_error(lambda: license_['license']['name'], '')
-                lic_text = lic_texts.get(f"SPDXRef-PACKAGE-{el_['name']}::{license_name}")
-                lic_text = lic_text if lic_text else lic_texts.get(f"SPDXRef-PACKAGE-{el_['name']}::{try_or_error(lambda: license_name.replace('-',' ').replace('_',' '), '')}")
-                if lic_text is not None:
-                    lic_text_new = base64.b64encode(lic_text.encode('utf-8')).decode('utf-8')
-                    lic_txt.append(
-                        {
-                            "license": {
-                                "name": f"{license_name}",
-                                "text": {
-                                    "contentType": "text/plain",
-                                    "encoding": "base64",
-                                    "content": f"{lic_text_new}"
-                                }
-                            }
-                        }
-                    )
-            if lic_txt:
-                cdx_data["components"][i].update({
-                    "evidence": {
-                        "licenses": lic_txt
-                    }
-                })
+    except Exception as err:
+        logger.error(f"The downloaded report was not extracted: {err}")
+        rep_name = ""
+    return rep_name
+
+
+def get_cdx_result_msg(rep_name: str) -> str:
+    if not rep_name:
+        return "The creation report file was failed."
+    return f"The report file {get_out_name(rep_name)} was created."
+
+
+def write_cdx_data(cdx_data: dict, rep_name: str, lic_texts: dict) -> str:
+    try:
+        with metrics.phase("processing"):
+            enrich_cdx_data(cdx_data, lic_texts, is_lic_dedup())
     except BaseException as err:
         pass
 
     if rep_name:
-        full_path = os.path.join(args.out_dir, rep_name)
-        with open(full_path, 'w', encoding='utf-8') as json_file:
-            json.dump(cdx_data, json_file, indent=4, ensure_ascii=False)
-        return f"The report file {rep_name} was created."
+        write_json_report(cdx_data, rep_name)
+    return get_cdx_result_msg(rep_name)
+
+
+def get_resumed_uuid(token: str) -> str:
+    return run_journal.get_uuid(token) if run_journal else ""
+
+
+def record_submitted(token: str, uuid: str):
+    if run_journal and uuid:
+        run_journal.record_submitted(token, uuid)
+
+
+def start_cdx_report(token: str, limiter: RateLimiter, resubmit: bool = False) -> Tuple[str, str, bool]:
+    """Submits the CDX report of the project, or takes the job already submitted by the resumed run"""
+    uuid = get_resumed_uuid(token) if not resubmit else ""
+    if uuid:
+        return uuid, "", True
+    limiter.wait()
+    uuid, err_status = mend_api.submit_cdx_report(get_api_config(), token)
+    record_submitted(token, uuid)
+    return uuid, err_status, False
+
+
+def download_cdx_report(prj_: dict, uuid: str) -> str:
+    zip_path = get_cdx_tmp_path()
+    rep_name = ""
+    error = ""
+    cdx_data = feed = None
+    res = get_cdx_result_msg(rep_name)
+    try:
+        with metrics.phase("download"):
+            downloaded = mend_api.download_cdx_report(get_api_config(), uuid, zip_path)
+        if not downloaded:
+            pass
+        elif not is_lic_text_required():
+            feed = get_report_feed(prj_) if not streaming.check_streaming() else None
+            rep_name = copy_cdx_report(zip_path, feed)
+            error = "" if rep_name else processing.NOT_SBOM_ERROR
+            res = get_cdx_result_msg(rep_name)
+        elif process_pool:
+            # License texts are fetched once the report is ready, so only the reports being written hold them
+            lic_keys = run_cpu(processing.cdx_lic_keys, zip_path) if lic_cache else None
+            lic_texts = get_prj_lic_texts(next(iter(prj_)), lic_keys)
+            rep_name = run_cpu(processing.write_cdx, zip_path, lic_texts, args.out_dir, get_compression(), is_compact(),
+                               is_lic_dedup())
+            error = "" if rep_name else processing.NOT_SBOM_ERROR
+            res = get_cdx_result_msg(rep_name)
+        else:
+            cdx_data, rep_name = read_cdx_report(zip_path)
+            lic_texts = get_prj_lic_texts(next(iter(prj_)), get_cdx_lic_keys(cdx_data) if lic_cache else None)
+            write_cdx_data(cdx_data, rep_name, lic_texts)
+            error = processing.get_sbom_error(cdx_data, "cdx") if rep_name else ""
+            rep_name = "" if error else rep_name
+            res = get_cdx_result_msg(rep_name)
+    finally:
+        try_or_error(lambda: os.remove(zip_path), None)
+    record_report(prj_, rep_name, error, doc=cdx_data, feed=feed)
+    return res
+
+
+def run_cdx_pipeline(ent_l: list) -> list:
+    """Submits every CDX report up front, polls all of them from one CdxPoller and downloads finished ones in a pool"""
+    errors = []
+    limiter = RateLimiter(rate=try_or_error(lambda: float(args.submit_rate), 0))
+    started = {}  # token -> time the first submit of the project started
+    tail = TailTracker(len(ent_l), PROJECT_PARALLELISM_LEVEL)
+    remaining = [len(ent_l)]
+    lock = threading.Lock()
+    all_done = threading.Event()
+
+    def finish(prj_: dict):
+        token = next(iter(prj_))
+        cost_history.record(token, time.perf_counter() - started.get(token, time.perf_counter()))
+        tail.done()
+        with lock:
+            remaining[0] -= 1
+            if not remaining[0]:
+                all_done.set()
+
+    def log_error(err: Exception):
+        errors.append(err)
+        logger.error(f"Error on future: {err}")
+
+    def submit(prj_: dict, resubmit: bool = False):
+        started.setdefault(next(iter(prj_)), time.perf_counter())
+        try:
+            uuid, err_status, resumed = start_cdx_report(next(iter(prj_)), limiter, resubmit)
+            if uuid:
+                poller.add(uuid).add_done_callback(lambda future: on_status(prj_, uuid, resumed, future))
+                return
+        except Exception as err:
+            err_status = str(err)
+        logger.error(f"Report generation for the project {next(iter(prj_.values()))} was not started: {err_status}")
+        record_failed(prj_)
+        finish(prj_)
+
+    def on_status(prj_: dict, uuid: str, resumed: bool, future):
+        """Runs on the poller thread once the job is finished; every project is finished exactly once"""
+        try:
+            res_status, err_status = ("FAILED", "The poll was stopped") if future.cancelled() else future.result()
+            if res_status == "SUCCESS":
+                download_pool.submit(metrics.pool_task("download", download), prj_, uuid)
+                return
+            if resumed and not future.cancelled():
+                logger.info(f"The report job {uuid} of the previous run is not available, submitting it again")
+                submit_pool.submit(metrics.pool_task("submit", submit), prj_, True)
+                return
+            logger.error(f"Downloading status is FAILED: {err_status}. Please, repeat later")
+            record_failed(prj_)
+        except Exception as err:
+            log_error(err)
+        finish(prj_)
+
+    def download(prj_: dict, uuid: str):
+        try:
+            temp_l = download_cdx_report(prj_, uuid)
+            if temp_l:
+                logger.info(temp_l)
+        except Exception as err:
+            log_error(err)
+        finally:
+            finish(prj_)
+
+    if not ent_l:
+        return errors
+    with ThreadPoolExecutor(max_workers=PROJECT_PARALLELISM_LEVEL) as submit_pool, \
+            ThreadPoolExecutor(max_workers=PROJECT_PARALLELISM_LEVEL) as download_pool, \
+            mend_api.CdxPoller(get_api_config(), PROJECT_PARALLELISM_LEVEL) as poller:
+        for prj_ in cost_history.order(ent_l):
+            submit_pool.submit(metrics.pool_task("submit", submit), prj_)
+        all_done.wait()
+    tail.observe(metrics)
+    return errors
+
+
+def get_shard() -> Tuple[int, int]:
+    return try_or_error(lambda: int(args.shard_index), 0), try_or_error(lambda: int(args.shard_count), 1)
+
+
+def filter_projects(prj_lst: list) -> list:
+    prj_lst = filter_shard(prj_lst, *get_shard())
+    res = export_state.filter_changed(prj_lst, prj_vitals_data) if export_state else prj_lst
+    res = run_journal.filter_done(res) if run_journal else res
+    if aggregator and len(res) < len(prj_lst):
+        aggregate_skipped(prj_lst, res)
+    return res
+
+
+def aggregate_skipped(prj_lst: list, exported: list):
+    """Adds the reports of the projects skipped by --incremental/--resume, which are still in the output directory"""
+    exported_tokens = set(next(iter(prj_)) for prj_ in exported)
+    for prj_ in prj_lst:
+        token = next(iter(prj_))
+        if token in exported_tokens:
+            continue
+        rep_name = run_journal.done.get(token) if run_journal else None
+        rep_name = rep_name or try_or_error(lambda: export_state.projects[token]["file"], None)
+        if rep_name and os.path.isfile(os.path.join(args.out_dir, rep_name)):
+            with metrics.phase("aggregate"):
+                aggregator.add_file(next(iter(prj_.values())), os.path.join(args.out_dir, rep_name))
+        else:
+            logger.warning(f"The report of the skipped project {next(iter(prj_.values()))} is not in the output "
+                           f"directory and is missing from the aggregated SBOM")
+
+
+def record_failed(prj_: dict, error: str = ""):
+    """Counts the failed project and journals it as failed, so that --resume exports it again"""
+    metrics.inc("reports_failed")
+    if error:
+        logger.error(f"The report of the project {next(iter(prj_.values()))} was not created: {error}")
+    if run_journal:
+        run_journal.record_failed(next(iter(prj_)))
+
+
+def get_report_feed(prj_: dict) -> Optional[streaming.ReportFeed]:
+    """Collectors of the elements of the project report for --aggregate and --delta, fed while the report is written"""
+    collectors = {}
+    if aggregator:
+        collectors["aggregate"] = aggregator.start(next(iter(prj_.values())))
+    if delta_index:
+        collectors["delta"] = DeltaReport(args.type.lower())
+    return streaming.ReportFeed(collectors) if collectors else None
+
+
+def feed_report(prj_: dict, rep_name: str, doc=None) -> Optional[streaming.ReportFeed]:
+    """Feeds a report that was written without a feed: from its document in memory, or else from the written file"""
+    feed = get_report_feed(prj_)
+    if feed and doc is not None:
+        feed.add_doc(doc)
+    elif feed:
+        feed.add_file(get_out_path(rep_name), get_compression())
+    return feed
+
+
+def record_report(prj_: dict, rep_name: str, error: str = "", doc=None, feed: Optional[streaming.ReportFeed] = None):
+    """Records the written report in the state, journal, bundle, aggregated SBOM and delta; "" - the project failed
+
+    The aggregated SBOM and the delta take the elements passed to the `feed` while the report was written, or those
+    of `doc`, the document written from memory; the written file is read again only when there is neither.
+    """
+    if not rep_name:
+        record_failed(prj_, error)
+        return
+    metrics.inc("reports_created")
+    token = next(iter(prj_))
+    try:
+        with metrics.phase("aggregate"):
+            feed = feed or feed_report(prj_, rep_name, doc)
+    except Exception as err:
+        logger.warning(f"The report {get_out_name(rep_name)} was not added to the aggregated SBOM or delta: {err}")
+        feed = None
+    delta_name = write_delta(prj_, rep_name, feed.collectors["delta"].components) \
+        if feed and "delta" in feed.collectors else ""
+    rep_name = get_out_name(rep_name)
+    try:
+        if feed and "aggregate" in feed.collectors:
+            with metrics.phase("aggregate"):
+                feed.collectors["aggregate"].finish()
+        if delta_name and args.delta.lower() == "only":
+            os.remove(os.path.join(args.out_dir, rep_name))
+            rep_name = get_out_name(delta_name)
+        if export_state:
+            export_state.record(token, prj_vitals_data.get(token, {}).get("lastUpdatedDate"), rep_name)
+        if report_bundle:
+            with metrics.phase("bundle"):
+                report_bundle.add(os.path.join(args.out_dir, rep_name), rep_name)
+        if run_journal:
+            run_journal.record_done(token, rep_name)
+    except Exception as err:
+        logger.warning(f"The export state of the report {rep_name} was not recorded: {err}")
+
+
+def finish_journal():
+    """Marks the run as completed, so that the next --resume starts a new run instead of skipping its projects"""
+    if run_journal:
+        run_journal.record_end()
+
+
+def write_delta(prj_: dict, rep_name: str, components: dict) -> str:
+    """Writes the delta report of the project and adds it to the bundle when the full report is kept as well"""
+    try:
+        with metrics.phase("delta"):
+            delta_name = delta_index.write_delta(next(iter(prj_)), next(iter(prj_.values())), args.type.lower(),
+                                                 rep_name, components)
+    except Exception as err:
+        logger.warning(f"The delta report of {next(iter(prj_.values()))} was not created: {err}")
+        return ""
+    metrics.inc("delta_reports_created")
+    if report_bundle and args.delta.lower() != "only":
+        with metrics.phase("bundle"):
+            report_bundle.add(get_out_path(delta_name), get_out_name(delta_name))
+    return delta_name
+
+
+def write_metrics():
+    if not args or not (args.metrics_out or args.prometheus_out):
+        metrics.log_summary()
+        return
+    extra = {"options": {"type": args.type.lower(), "licensetext": is_lic_text_required(),
+                         "engine": args.engine.lower(), "threads": PROJECT_PARALLELISM_LEVEL},
+             "shard": {"index": get_shard()[0], "count": get_shard()[1]},
+             "projects": len(short_lst_prj),
+             "retries": dict(ws_client.governor.stats) if ws_client and ws_client.governor else {}}
+    metrics.log_summary()
+    try:
+        if args.metrics_out:
+            metrics.write_json(args.metrics_out, extra)
+        if args.prometheus_out:
+            metrics.write_prometheus(args.prometheus_out, extra)
+    except Exception as err:
+        logger.error(f"The run metrics were not written: {err}")
+
+
+def create_governor() -> RequestGovernor:
+    return RequestGovernor(rate=try_or_error(lambda: float(args.rate_limit), 0),
+                           max_concurrency=PROJECT_PARALLELISM_LEVEL,
+                           max_retries=try_or_error(lambda: int(args.max_retries), 5))
+
+
+def get_process_count() -> int:
+    if str(args.processes).lower() == "auto":
+        return os.cpu_count() or 1
+    return max(try_or_error(lambda: int(args.processes), 0), 0)
+
+
+def get_small_lane() -> int:
+    """Threads taking the smallest projects; at least one thread is left for the largest ones"""
+    if str(args.small_lane).lower() == "auto":
+        small_lane = PROJECT_PARALLELISM_LEVEL // 5
     else:
-        return "The creation report file was failed."
+        small_lane = try_or_error(lambda: int(args.small_lane), 0)
+    return min(max(small_lane, 0), PROJECT_PARALLELISM_LEVEL - 1)
 
 
-def main():
-    def generic_thread_write_rep(ent_l: list, worker: callable) -> list:
-        errors = []
+def create_aggregator() -> Optional[SbomAggregator]:
+    if not args.aggregate:
+        return None
+    return SbomAggregator(out_dir=args.out_dir, sbom_type=args.type.lower(), scope=args.aggregate.lower(),
+                          compression=get_compression(), compact=is_compact(), name_suffix=get_shard_id(*get_shard()))
 
-        with ThreadPoolExecutor(max_workers=PROJECT_PARALLELISM_LEVEL) as executer:
-            futures = [executer.submit(worker, ent) for ent in ent_l]
 
-            for future in concurrent.futures.as_completed(futures):
+def close_aggregator():
+    with metrics.phase("aggregate"):
+        rep_names = aggregator.close()
+    for rep_name in rep_names if report_bundle else []:
+        report_bundle.add(os.path.join(args.out_dir, rep_name), rep_name)
+
+
+def create_bundle() -> Optional[ReportBundle]:
+    bundle_type = args.bundle.lower()
+    if not bundle_type:
+        return None
+    keep_files = args.incremental.lower() == "true"
+    if keep_files:
+        logger.info("The report files are kept next to the bundle, --incremental compares them with the next export")
+    bundle_name = get_shard_file_name(f"{BUNDLE_NAME}.{bundle_type}", get_shard_id(*get_shard()))
+    return ReportBundle(os.path.join(args.out_dir, bundle_name), append=args.resume.lower() == "true",
+                        keep_files=keep_files)
+
+
+def prepare_out_dir():
+    if not os.path.exists(args.out_dir):
+        logger.info(f"Dir: {args.out_dir} does not exist. Creating it")
+        os.mkdir(args.out_dir)
+
+
+def reset_state():
+    """Forgets the objects of the previous export; the service runs many exports in one process"""
+    global short_lst_prj
+    global lic_cache
+    global export_state
+    global run_journal
+    global report_bundle
+    global process_pool
+    global aggregator
+    global delta_index
+    global cost_history
+    global discovery_cache
+
+    short_lst_prj = []
+    lic_cache = export_state = run_journal = report_bundle = process_pool = None
+    aggregator = delta_index = cost_history = discovery_cache = None
+    prj_vitals_data.clear()
+    processing.clear_lic_text_b64()
+    processing.get_lic_text_hash.cache_clear()
+
+
+def main(argv: Optional[list] = None, session=None):
+    """Runs one export. The service passes the arguments of its job and the ExportSession whose HTTP client,
+    login, caches and process pool stay open between the exports"""
+    def generic_thread_write_rep(ent_l: list, worker: callable) -> list:
+        # The largest projects are started first, the threads of the small lane work from the smallest end
+        errors = []
+        tasks = LaneQueue([(ent, metrics.pool_task("reports", worker)) for ent in cost_history.order(ent_l)])
+        tail = TailTracker(len(ent_l), PROJECT_PARALLELISM_LEVEL)
+
+        def run_lane(small: bool):
+            while True:
+                task = tasks.take(small)
+                if task is None:
+                    return
+                ent, task_worker = task
+                start = time.perf_counter()
                 try:
-                    temp_l = future.result()
+                    temp_l = task_worker(ent)
                     if temp_l:
                         logger.info(temp_l)
                 except Exception as e:
                     errors.append(e)
-                    logger.error(f"Error on future: {future.result()}")
+                    logger.error(f"Error on future: {e}")
+                finally:
+                    cost_history.record(next(iter(ent)), time.perf_counter() - start)
+                    tail.done()
+
+        small_lane = get_small_lane()
+        with ThreadPoolExecutor(max_workers=PROJECT_PARALLELISM_LEVEL) as executer:
+            for i in range(PROJECT_PARALLELISM_LEVEL):
+                executer.submit(run_lane, i < small_lane)
+        tail.observe(metrics)
 
         return errors
 
     def get_apitoken():
-        def login(u_login: str, u_key: str) -> tuple:  # Returns JWT token also, for future migrations to API 2.0/3.0
-            jwt_token = ""
-            orguuid = ""
-            url_ = f"{extract_url(args.ws_url)}/api/v2.0/login".replace("https://","https://api-")
-            payload = json.dumps({
-                "email": u_login,
-                "userKey": u_key,
-            })
-            headers = {
-                'Content-Type': 'application/json'
-            }
-            response = requests.request("POST", url_, headers=headers, data=payload)
-            try:
-                jwt_token = json.loads(response.text)['retVal']['jwtToken']
-                orguuid = json.loads(response.text)['retVal']['orgUuid']
-            except Exception as err:
-                logger.error(f"The authentication failed. Details: {try_or_error(lambda: response.reason, err)}")
-                exit(-1)
-            return jwt_token, orguuid
-
-        if args.email:
-            jwt_token, apitoken = login(args.email, args.ws_user_key)
-            return apitoken
-        else:
+        if not args.email:
             return ""
-
-    def create_spdx(prj_):
-        for key, value in prj_.items():
-            sbom_prj = create_sbom_prj(token=key)
-            rep_name = f"SPDX report for {value.split(':')[1]}.json"
-            rep_name = rep_name.replace("/","_")
-            full_path = os.path.join(args.out_dir, rep_name)
-            try:
-                set_spdx_values = set(item['SPDXID'] for item in sbom_prj["packages"])
-                result = [key_ for key_ in lic_texts.keys() if key_ in set_spdx_values]
-                for lic_lib in result:
-                    lic_text = lic_texts.get(lic_lib)
-                    if sbom_prj.get("hasExtractedLicensingInfos") is None:
-                        sbom_prj["hasExtractedLicensingInfos"] = []
-                    sbom_prj["hasExtractedLicensingInfos"].append({
-                        "licenseId": lic_lib.replace('SPDXRef-PACKAGE-', 'LicenseRef-'),
-                        "extractedText": lic_text,
-                        "name": lic_lib.replace('SPDXRef-PACKAGE-', 'LicenseRef-'),
-                    })
-            except Exception as err:
-                pass
-
-            with open(full_path, 'w', encoding='utf-8') as json_file:
-                json.dump(sbom_prj, json_file, indent=4, ensure_ascii=False)
-            return f"The report file {rep_name} was created."
-        return ""
+        try:
+            return mend_api.login(get_api_config(), args.email)[1]
+        except ValueError as err:
+            logger.error(str(err))
+            exit(-1)
 
     global args
     global PROJECT_PARALLELISM_LEVEL
     global short_lst_prj
-    global lic_texts
-
+    global lic_cache
+    global export_state
+    global run_journal
+    global report_bundle
+    global process_pool
+    global aggregator
+    global delta_index
+    global cost_history
+    global discovery_cache
+    global ws_client
+    global metrics
+
+    metrics = RunMetrics()
+    reset_state()
     hdr_title = f'{APP_TITLE} {__version__}'
     hdr = f'\n{len(hdr_title)*"="}\n{hdr_title}\n{len(hdr_title)*"="}'
     print(hdr)
     try:
-        args = parse_args()
-        args.ws_token = args.ws_token if args.ws_token else get_apitoken()
+        args = parse_args(argv)
+        PROJECT_PARALLELISM_LEVEL = try_or_error(lambda: int(args.threads), 10)
+        if session:
+            ws_client = session.get_ws_client(PROJECT_PARALLELISM_LEVEL, create_governor())
+            args.ws_token = args.ws_token if args.ws_token else session.get_api_token(
+                (args.ws_url, args.email, args.ws_user_key), get_apitoken)
+        else:
+            ws_client = WsClient(pool_size=PROJECT_PARALLELISM_LEVEL, governor=create_governor())
+            args.ws_token = args.ws_token if args.ws_token else get_apitoken()
         check_res = check_patterns()
         if check_res:
             logger.error("Missing or malformed configuration parameters:")
             [logger.error(el_) for el_ in check_res]
             exit(-1)
 
-        PROJECT_PARALLELISM_LEVEL = try_or_error(lambda: int(args.threads), 10)
+        if args.type.lower() not in ("spdx", "cdx"):
+            logger.error(f"The type {args.type} is not supported.")
+            exit(-1)
+
+        compression_error = check_compression(get_compression())
+        if compression_error:
+            logger.error(compression_error)
+            exit(-1)
+
+        shard_index, shard_count = get_shard()
+        if shard_count < 1 or not 0 <= shard_index < shard_count:
+            logger.error(f"The shard index must be from 0 to {shard_count - 1}, the shard count at least 1.")
+            exit(-1)
+
+        stream_error = streaming.check_streaming() if is_streamed() else ""
+        if stream_error:
+            logger.error(stream_error)
+            exit(-1)
+
+        if args.aggregate and args.aggregate.lower() not in AGGREGATE_SCOPES:
+            logger.error(f"The aggregation scope {args.aggregate} is not supported.")
+            exit(-1)
+
+        if args.delta.lower() not in DELTA_MODES:
+            logger.error(f"The delta mode {args.delta} is not supported.")
+            exit(-1)
+
+        if args.aggregate and is_lic_dedup() and args.type.lower() == "cdx":
+            logger.error("The license text references of --dedup-licenses are local to a CDX report, "
+                         "they cannot be combined with --aggregate.")
+            exit(-1)
+
+        if args.aggregate and args.delta.lower() == "only":
+            logger.error("The aggregated SBOM is built from the full reports, "
+                         "--delta only cannot be combined with --aggregate.")
+            exit(-1)
+
+        if args.bundle and args.bundle.lower() not in BUNDLE_TYPES:
+            logger.error(f"The bundle type {args.bundle} is not supported.")
+            exit(-1)
+
+        if args.lic_cache_dir and is_lic_text_required():
+            lic_cache = (session.get_lic_cache if session else LicenseCache)(
+                cache_dir=args.lic_cache_dir,
+                max_size=int(try_or_error(lambda: float(args.lic_cache_size), 100) * 1024 * 1024),
+                ttl=try_or_error(lambda: float(args.lic_cache_ttl), 168) * 3600)
+
+        prepare_out_dir()
+        run_options = f"{args.type.lower()}:{is_lic_text_required()}:{get_compression()}:" \
+                      f"{args.compact.lower() == 'true'}:{args.delta.lower()}:{is_lic_dedup()}"
+        if args.incremental.lower() == "true":
+            export_state = ExportState(out_dir=args.out_dir, options=run_options, shard=get_shard_id(*get_shard()))
+        run_journal = RunJournal(out_dir=args.out_dir, options=run_options, resume=args.resume.lower() == "true",
+                                 shard=get_shard_id(*get_shard()))
+        discovery_ttl = try_or_error(lambda: float(args.discovery_ttl), 0) * 3600
+        if discovery_ttl > 0:
+            discovery_cache = (session.get_discovery_cache if session else DiscoveryCache)(
+                out_dir=args.out_dir, org_token=args.ws_token, ttl=discovery_ttl,
+                refresh=args.refresh_discovery.lower() == "true", shard=get_shard_id(*get_shard()))
+            if not is_vitals_cached():
+                logger.info("The project vitals are requested again for --incremental, only the projects of the "
+                            "excluded products are taken from the discovery cache")
+        cost_history = CostHistory(out_dir=args.out_dir, shard=get_shard_id(*get_shard()))
+        report_bundle = create_bundle()
+        aggregator = create_aggregator()
+        if args.delta.lower() != "false":
+            delta_index = DeltaIndex(out_dir=args.out_dir, compression=get_compression(), compact=is_compact())
+        if get_process_count():
+            process_pool = session.get_process_pool(get_process_count()) if session else \
+                ProcessPoolExecutor(max_workers=get_process_count())
+            logger.debug(f"JSON processing runs in {get_process_count()} worker processes")
+
         logger.info("Starting to create reports...")
-        short_lst_prj = get_project_list()
+        if args.engine.lower() == "async":
+            import asyncio
+            from mend_sbom_export_cli import async_engine
+            asyncio.run(async_engine.run(concurrency=PROJECT_PARALLELISM_LEVEL))
+            finish_journal()
+            return
+        elif args.engine.lower() != "thread":
+            logger.error(f"The engine {args.engine} is not supported.")
+            exit(-1)
+
+        with metrics.phase("discovery"):
+            short_lst_prj = filter_projects(get_project_list())
         if not short_lst_prj:
             logger.info("No one project was found for the generation report")
+            finish_journal()
             exit(0)
 
-        lic_texts = get_lic_list() if args.lictext.lower() == "true" else {}
-        if not os.path.exists(args.out_dir):
-            logger.info(f"Dir: {args.out_dir} does not exist. Creating it")
-            os.mkdir(args.out_dir)
-
         if args.type.lower() == "spdx":
             generic_thread_write_rep(ent_l=short_lst_prj, worker=create_spdx)
-        elif args.type.lower() == "cdx":
-            generic_thread_write_rep(ent_l=short_lst_prj, worker=create_cyclone)
         else:
-            logger.error(f"The type {args.type} is not supported.")
-            exit(-1)
+            run_cdx_pipeline(ent_l=short_lst_prj)
+        finish_journal()
     except Exception as err:
         logger.error(f'[{fn()}] Failed to create report files: {err}')
         exit(-1)
+    finally:
+        if ws_client:
+            if not session:
+                ws_client.close()
+            ws_client.governor.log_summary()
+        if lic_cache:
+            lic_cache.save()
+        if export_state:
+            export_state.save()
+        if cost_history:
+            cost_history.save()
+        if discovery_cache:
+            discovery_cache.save()
+        if process_pool and not session:
+            process_pool.shutdown()
+        if aggregator:
+            close_aggregator()
+        if report_bundle:
+            report_bundle.close()
+        if run_journal:
+            run_journal.close()
+        write_metrics()
 
 
 if __name__ == '__main__':
-    sys.exit(main())
+    # `python -m` runs this file as __main__, a copy of the package module. The package module runs the export,
+    # so that the async engine, the service and the exporter read the state of the running export
+    from mend_sbom_export_cli import sbom_export_cli
+    sys.exit(sbom_export_cli.main())
@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from mend_sbom_export_cli._version import __tool_name__
+from mend_sbom_export_cli.state import get_shard_file_name, write_json_atomic
+
+logger = logging.getLogger(__tool_name__)
+
+
+class CostHistory:
+    """Export duration of every project in earlier runs, kept in the output directory
+
+    The projects of the next run are started longest first, so that a large project does not start last and keep
+    the run waiting while the other workers are idle.
+    """
+    HISTORY_FILE = ".sbom_export_history.json"
+
+    def __init__(self, out_dir: str, shard: str = ""):
+        self.path = os.path.join(out_dir, get_shard_file_name(self.HISTORY_FILE, shard))
+        self._lock = threading.Lock()
+        self.seconds = {}  # token -> duration of the last export
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.seconds = json.load(f).get("projects", {})
+        except FileNotFoundError:
+            pass
+        except Exception as err:
+            logger.warning(f"The history file {self.path} is unreadable, "
+                           f"projects are started in discovery order: {err}")
+
+    def order(self, prj_lst: list) -> list:
+        """Projects by their duration in earlier runs, longest first
+
+        Projects without history are estimated at the median duration; equal estimates keep the discovery order.
+        """
+        known = sorted(x for x in (self.seconds.get(next(iter(prj_))) for prj_ in prj_lst) if x is not None)
+        if not known:
+            return prj_lst
+        default = known[len(known) // 2]
+        return sorted(prj_lst, key=lambda prj_: self.seconds.get(next(iter(prj_)), default), reverse=True)
+
+    def record(self, token: str, seconds: float):
+        with self._lock:
+            self.seconds[token] = round(seconds, 3)
+
+    def save(self):
+        with self._lock:
+            write_json_atomic(self.path, {"projects": self.seconds})
+
+
+class LaneQueue:
+    """Work items ordered largest first
+
+    Workers of the big lane take items from the front and workers of the small lane from the back, so small projects
+    keep flowing while the big ones run.
+    """
+
+    def __init__(self, items: list):
+        self._items = deque(items)
+        self._lock = threading.Lock()
+
+    def take(self, small: bool = False):
+        with self._lock:
+            if not self._items:
+                return None
+            return self._items.pop() if small else self._items.popleft()
+
+
+class TailTracker:
+    """Measures the tail of a run: the time when fewer projects are left than workers, so that some workers idle
+
+    The tail duration and the idle worker-seconds are reported as the `tail` and `tail_idle` phases.
+    """
+
+    def __init__(self, total: int, workers: int):
+        self.remaining = total
+        self.workers = max(workers, 1)
+        self.idle = 0.0
+        self._lock = threading.Lock()
+        self._last = time.perf_counter()
+        self.tail_start = self._last if total < self.workers else None
+
+    def done(self):
+        with self._lock:
+            now = time.perf_counter()
+            if self.remaining < self.workers:
+                self.idle += (self.workers - self.remaining) * (now - self._last)
+            self.remaining -= 1
+            if self.tail_start is None and self.remaining < self.workers:
+                self.tail_start = now
+            self._last = now
+
+    def observe(self, metrics):
+        if self.tail_start is None:
+            return
+        with self._lock:
+            tail = self._last - self.tail_start
+            metrics.observe_phase("tail", tail)
+            metrics.observe_phase("tail_idle", self.idle)
+        logger.debug(f"Run tail: {tail:.2f}s with idle workers, {self.idle:.2f} idle worker-seconds")
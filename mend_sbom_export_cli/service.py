@@ -0,0 +1,406 @@
+"""Long-running export service: one warm process runs the exports requested over a local HTTP API
+
+    sbom_export_service --base-dir /data/sbom       (listens on a Unix socket, or on a port with --port 8089)
+    curl --unix-socket <socket> -X POST localhost/jobs -d '{"args": ["--product", "<token>", "--dir", "prod"]}'
+    curl --unix-socket <socket> localhost/jobs/<id>/events   (status and log lines as JSON lines, until the job ends)
+
+A job takes the export options of sbom_export_cli (JOB_OPTIONS); the credentials and the server come from the
+command line or the environment of the service (WS_USERKEY, WS_APIKEY, WS_WSS_URL...), and the paths of a job
+must be under --base-dir. The HTTP connection pool, the service user login, the license and discovery caches
+and the process pool are kept between the jobs. The CLI keeps its state in module globals, so the jobs run
+one at a time; up to --queue-size jobs wait for their turn.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from mend_sbom_export_cli._version import __tool_name__, __version__
+from mend_sbom_export_cli import sbom_export_cli as cli
+from mend_sbom_export_cli.const import aliases
+from mend_sbom_export_cli.discovery import DiscoveryCache
+from mend_sbom_export_cli.lic_cache import LicenseCache
+from mend_sbom_export_cli.ws_client import RequestGovernor, WsClient
+
+logger = logging.getLogger(__tool_name__)
+
+SECRET_ARGS = set(aliases.get_aliases_str("userkey") + aliases.get_aliases_str("apikey"))
+JOB_HISTORY = 100
+DEFAULT_SOCKET = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or os.path.expanduser("~"), f".{__tool_name__}.sock")
+# Options a job may set: the credentials and the server are the service's own, so a job cannot send them elsewhere
+JOB_OPTIONS = {alias for key_ in (
+    "productkey", "projectkey", "exclude", "output", "lic", "deduplicenses", "threads", "liccache", "liccachesize",
+    "liccachettl", "discoveryttl", "refreshdiscovery", "incremental", "resume", "ratelimit", "retries", "engine",
+    "type", "compact", "stream", "compress", "bundle", "processes", "aggregate", "smalllane", "delta", "shardindex",
+    "shardcount", "metricsout", "prometheusout", "submitrate") for alias in aliases.get_aliases_str(key_)}
+# Options of a job that name a file or a directory, confined to the base directory of the service
+PATH_OPTIONS = {alias for key_ in ("output", "liccache", "metricsout", "prometheusout")
+                for alias in aliases.get_aliases_str(key_)}
+
+
+def get_job_path(path: str, base_dir: str) -> str:
+    """Absolute path of a path of a job, relative to `base_dir`; raises ValueError when it is outside of it"""
+    path_ = os.path.realpath(os.path.join(base_dir, path))
+    if os.path.commonpath([path_, base_dir]) != base_dir:
+        raise ValueError(f"The path {path} is outside of the base directory of the service")
+    return path_
+
+
+def get_job_argv(args: list, base_dir: str) -> list:
+    """Arguments of a job as `--option value` pairs, with the paths resolved under `base_dir`
+
+    Raises ValueError for an option that is not in JOB_OPTIONS (abbreviated options included) or a path outside of
+    the base directory.
+    """
+    argv, args = [], list(args)
+    while args:
+        option, sep, value = args.pop(0).partition("=")
+        if option not in JOB_OPTIONS:
+            raise ValueError(f"The option {option} is not allowed in a job")
+        if not sep:
+            if not args or args[0].startswith("-"):
+                raise ValueError(f"The option {option} requires a value")
+            value = args.pop(0)
+        argv += [option, get_job_path(value, base_dir) if option in PATH_OPTIONS and value else value]
+    return argv
+
+
+class ExportSession:
+    """Objects kept open between the exports of the service"""
+
+    def __init__(self):
+        self.ws_client = None
+        self.api_tokens = {}  # (url, service user, user key) -> org token
+        self.lic_caches = {}  # cache dir -> LicenseCache
+        self.discovery_caches = {}  # (out dir, org token, shard) -> DiscoveryCache
+        self.process_pool = None
+        self.process_count = 0
+
+    def get_ws_client(self, pool_size: int, governor: RequestGovernor) -> WsClient:
+        if self.ws_client is None or self.ws_client.pool_size < pool_size:
+            if self.ws_client:
+                self.ws_client.close()
+            self.ws_client = WsClient(pool_size=pool_size, governor=governor)
+        else:
+            self.ws_client.governor = governor
+        return self.ws_client
+
+    def get_api_token(self, key_: tuple, login) -> str:
+        if not self.api_tokens.get(key_):
+            self.api_tokens[key_] = login()
+        return self.api_tokens[key_]
+
+    def get_lic_cache(self, cache_dir: str, max_size: int, ttl: float) -> LicenseCache:
+        lic_cache = self.lic_caches.get(os.path.abspath(cache_dir))
+        if lic_cache is None:
+            lic_cache = LicenseCache(cache_dir=cache_dir, max_size=max_size, ttl=ttl)
+            self.lic_caches[os.path.abspath(cache_dir)] = lic_cache
+        lic_cache.max_size, lic_cache.ttl = max_size, ttl
+        return lic_cache
+
+    def get_discovery_cache(self, out_dir: str, org_token: str, ttl: float, refresh: bool = False,
+                            shard: str = "") -> DiscoveryCache:
+        key_ = (os.path.abspath(out_dir), org_token, shard)
+        discovery_cache = self.discovery_caches.get(key_)
+        if discovery_cache is None or refresh:
+            discovery_cache = self.discovery_caches[key_] = DiscoveryCache(
+                out_dir=out_dir, org_token=org_token, ttl=ttl, refresh=refresh, shard=shard)
+        discovery_cache.ttl = ttl
+        return discovery_cache
+
+    def get_process_pool(self, count: int) -> ProcessPoolExecutor:
+        if self.process_pool is None or self.process_count != count:
+            if self.process_pool:
+                self.process_pool.shutdown()
+            self.process_pool = ProcessPoolExecutor(max_workers=count)
+            self.process_count = count
+        return self.process_pool
+
+    def close(self):
+        if self.ws_client:
+            self.ws_client.close()
+        if self.process_pool:
+            self.process_pool.shutdown()
+
+
+class ExportJob:
+    def __init__(self, job_id: str, argv: list):
+        self.id = job_id
+        self.argv = argv
+        self.status = "queued"
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.exit_code = None
+        self.reports = []
+        self.counters = {}
+        self.events = []
+        self._cond = threading.Condition()
+
+    def add_event(self, event: dict):
+        with self._cond:
+            self.events.append(dict(event, time=round(time.time(), 3)))
+            self._cond.notify_all()
+
+    def set_status(self, status: str):
+        self.status = status
+        self.add_event({"status": status})
+
+    def is_done(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def iter_events(self):
+        """Events of the job as they are added, until the job ends"""
+        i = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self.events) > i or self.is_done(), timeout=30)
+                events, done = self.events[i:], self.is_done()
+            i += len(events)
+            yield from events
+            if done and i >= len(self.events):
+                return
+
+    def get_args(self) -> list:
+        return [x if i == 0 or self.argv[i - 1] not in SECRET_ARGS else "******" for i, x in enumerate(self.argv)]
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "args": self.get_args(),
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "exit_code": self.exit_code,
+            "reports": self.reports,
+            "counters": self.counters,
+        }
+
+
+class JobLogHandler(logging.Handler):
+    """Adds the log records of the running export to the events of its job"""
+
+    def __init__(self):
+        super().__init__(level=logging.INFO)
+        self.job = None
+
+    def emit(self, record: logging.LogRecord):
+        if self.job:
+            self.job.add_event({"level": record.levelname, "message": record.getMessage()})
+
+
+class ExportService:
+    def __init__(self, default_args: list, queue_size: int = 100, base_dir: str = ""):
+        self.base_dir = os.path.realpath(base_dir or os.getcwd())
+        # The reports of a job that sets no --dir go to the base directory as well
+        self.default_args = ["--dir", self.base_dir] + default_args
+        self.session = ExportSession()
+        self.jobs = {}
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.log_handler = JobLogHandler()
+        self._worker = threading.Thread(target=self.run_jobs, name="export-worker", daemon=True)
+
+    def start(self):
+        cli.logger.addHandler(self.log_handler)
+        self._worker.start()
+
+    def submit(self, argv: list) -> ExportJob:
+        """Queues the job; raises queue.Full when --queue-size jobs are waiting and ValueError for the arguments
+        a job may not have, see get_job_argv"""
+        argv = get_job_argv(argv, self.base_dir)
+        with self._lock:
+            job = ExportJob(f"{int(time.time())}-{next(self._ids)}", argv)
+            self.queue.put_nowait(job)
+            self.jobs[job.id] = job
+            finished = [x for x in self.jobs.values() if x.is_done()]
+            for old_job in finished[:max(len(finished) - JOB_HISTORY, 0)]:
+                del self.jobs[old_job.id]
+        job.add_event({"status": "queued", "position": self.queue.qsize()})
+        logger.info(f"The job {job.id} was queued")
+        return job
+
+    def run_jobs(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            self.run_job(job)
+
+    def run_job(self, job: ExportJob):
+        job.started = time.time()
+        job.set_status("running")
+        self.log_handler.job = job
+        try:
+            cli.main(self.default_args + job.argv, session=self.session)
+            job.exit_code = 0
+        except SystemExit as err:
+            job.exit_code = err.code if isinstance(err.code, int) else (0 if err.code is None else 1)
+        except BaseException as err:
+            logger.error(f"The job {job.id} failed: {err}")
+            job.exit_code = 1
+        finally:
+            self.log_handler.job = None
+        job.reports = sorted(cli.run_journal.done.values()) if cli.run_journal else []
+        job.counters = dict(cli.metrics.counters)
+        job.finished = time.time()
+        job.set_status("succeeded" if job.exit_code == 0 else "failed")
+        logger.info(f"The job {job.id} {job.status} in {job.finished - job.started:.1f}s")
+
+    def close(self):
+        self.queue.put(None)
+        self._worker.join()
+        self.session.close()
+
+    def get_health(self) -> dict:
+        with self._lock:
+            statuses = [x.status for x in self.jobs.values()]
+        return {"status": "ok", "version": __version__, "queued": statuses.count("queued"),
+                "running": statuses.count("running")}
+
+
+def create_handler(service: ExportService):
+    class ServiceHandler(BaseHTTPRequestHandler):
+        server_version = f"{__tool_name__}/{__version__}"
+
+        def address_string(self):
+            return self.client_address[0] if self.client_address else "unix"
+
+        def log_message(self, format, *args):
+            logger.debug(f"{self.address_string()} {format % args}")
+
+        def send_json(self, code: int, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def get_job(self, job_id: str) -> Optional[ExportJob]:
+            job = service.jobs.get(job_id)
+            if job is None:
+                self.send_json(404, {"error": f"The job {job_id} does not exist"})
+            return job
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if parts == ["health"]:
+                self.send_json(200, service.get_health())
+            elif parts == ["jobs"]:
+                self.send_json(200, [x.summary() for x in list(service.jobs.values())])
+            elif len(parts) == 2 and parts[0] == "jobs":
+                job = self.get_job(parts[1])
+                if job:
+                    self.send_json(200, dict(job.summary(), events=job.events[-100:]))
+            elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events":
+                job = self.get_job(parts[1])
+                if job:
+                    self.stream_events(job)
+            else:
+                self.send_json(404, {"error": "Not found"})
+
+        def stream_events(self, job: ExportJob):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            try:
+                for event in job.iter_events():
+                    self.wfile.write(json.dumps(event).encode("utf-8") + b"\n")
+                    self.wfile.flush()
+                self.wfile.write(json.dumps(job.summary()).encode("utf-8") + b"\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def do_POST(self):
+            if self.path.strip("/") != "jobs":
+                self.send_json(404, {"error": "Not found"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                argv = [str(x) for x in body.get("args", [])]
+            except (ValueError, AttributeError, TypeError) as err:
+                self.send_json(400, {"error": f"The job must be a JSON object with the CLI arguments in 'args': {err}"})
+                return
+            try:
+                job = service.submit(argv)
+            except ValueError as err:
+                self.send_json(400, {"error": str(err)})
+                return
+            except queue.Full:
+                self.send_json(429, {"error": "The job queue is full"})
+                return
+            self.send_json(202, job.summary())
+
+    return ServiceHandler
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, handler_class):
+        if os.path.exists(path):
+            os.remove(path)
+        umask = os.umask(0o177)  # only the user of the service may connect, from the moment the socket exists
+        try:
+            super().__init__(path, handler_class)
+        finally:
+            os.umask(umask)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Runs the SBOM exports requested over a local HTTP API")
+    parser.add_argument("--socket", dest="socket", default=DEFAULT_SOCKET,
+                        help="Unix socket to listen on, readable and writable by the user of the service only")
+    parser.add_argument("--port", dest="port", type=int, default=None,
+                        help="Listen on this TCP port instead of the Unix socket (any local user may connect)")
+    parser.add_argument("--host", dest="host", default="127.0.0.1", help="Address to listen on with --port")
+    parser.add_argument("--base-dir", dest="base_dir", default=os.getcwd(),
+                        help="Directory the output, cache and metrics paths of the jobs must be under")
+    parser.add_argument("--queue-size", dest="queue_size", type=int, default=100,
+                        help="Max jobs waiting for their turn")
+    parser.add_argument("--lic-cache", dest="lic_cache", default="",
+                        help="License text cache directory of the jobs that do not set their own")
+    parser.add_argument("--discovery-ttl", dest="discovery_ttl", default="1",
+                        help="Hours the discovered projects are reused by the jobs that do not set their own")
+    return parser.parse_known_args()
+
+
+def main():
+    args, job_args = parse_args()
+    # Defaults of every job; the arguments of the job come after them and take precedence
+    default_args = job_args + ["--discovery-ttl", args.discovery_ttl] + \
+        (["--lic-cache", args.lic_cache] if args.lic_cache else [])
+    service = ExportService(default_args=default_args, queue_size=args.queue_size, base_dir=args.base_dir)
+    if args.port is None:
+        server = UnixHTTPServer(args.socket, create_handler(service))
+        address = args.socket
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), create_handler(service))
+        server.daemon_threads = True
+        address = f"http://{args.host}:{server.server_address[1]}"
+    service.start()
+    logger.info(f"The export service {__version__} is listening on {address}, the jobs write under {service.base_dir}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""Sharding of one export across several runners and the merge of their results
+
+Every runner discovers the same projects and keeps the ones whose stable token hash falls into its shard:
+    sbom_export_cli ... --shard-index 0 --shard-count 4 --metrics-out metrics-0.json
+Once all shards are finished, their journals and metrics files are combined into one run summary:
+    sbom_export_merge --dir out-0 --dir out-1 --metrics metrics-0.json metrics-1.json --out summary.json
+"""
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+
+from mend_sbom_export_cli._version import __tool_name__, __version__
+from mend_sbom_export_cli.metrics import merge_summaries
+from mend_sbom_export_cli.state import RunJournal, get_shard_file_name, parse_journal, write_json_atomic
+
+logger = logging.getLogger(__tool_name__)
+
+shard_pattern = r"\.shard-(\d+)-of-(\d+)\."
+
+
+def get_shard_id(shard_index: int, shard_count: int) -> str:
+    return f"shard-{shard_index}-of-{shard_count}" if shard_count > 1 else ""
+
+
+def shard_of(token: str, shard_count: int) -> int:
+    """Shard of the project; the hash does not depend on the Python process, unlike hash()"""
+    return int(hashlib.sha256(token.encode("utf-8")).hexdigest(), 16) % shard_count
+
+
+def filter_shard(prj_lst: list, shard_index: int, shard_count: int) -> list:
+    if shard_count <= 1:
+        return prj_lst
+    res = [prj_ for prj_ in prj_lst if shard_of(next(iter(prj_)), shard_count) == shard_index]
+    logger.info(f"Shard {shard_index} of {shard_count}: {len(res)} of {len(prj_lst)} project(s)")
+    return res
+
+
+def read_journal(path: str) -> dict:
+    """Summary of one journal: options, completed reports and CDX jobs still pending"""
+    with open(path, encoding="utf-8") as f:
+        journal = parse_journal(f)
+    return {"options": journal["options"] or "", "done": journal["done"], "pending": journal["pending"]}
+
+
+def merge_journals(dirs: list) -> dict:
+    shards = {}
+    shard_counts = set()
+    journal_glob = get_shard_file_name(RunJournal.JOURNAL_FILE, "shard-*-of-*")
+    for dir_ in dirs:
+        for path in sorted(glob.glob(os.path.join(dir_, journal_glob))):
+            match = re.search(shard_pattern, os.path.basename(path))
+            if not match:
+                logger.warning(f"The file {path} is not the journal of a shard and was skipped")
+                continue
+            shard_index, shard_count = int(match.group(1)), int(match.group(2))
+            shard_counts.add(shard_count)
+            journal = read_journal(path)
+            shards[shard_index] = {
+                "journal": path,
+                "options": journal["options"],
+                "reports": len(journal["done"]),
+                "pending_cdx_jobs": len(journal["pending"]),
+                "files": sorted(journal["done"].values()),
+            }
+    if len(shard_counts) > 1:
+        logger.warning(f"The journals belong to exports with different shard counts: {sorted(shard_counts)}")
+    shard_count = max(shard_counts, default=0)
+    return {
+        "shard_count": shard_count,
+        "missing_shards": [i for i in range(shard_count) if i not in shards],
+        "reports": sum(x["reports"] for x in shards.values()),
+        "pending_cdx_jobs": sum(x["pending_cdx_jobs"] for x in shards.values()),
+        "shards": {str(k): v for k, v in sorted(shards.items())},
+    }
+
+
+def merge(dirs: list, metrics_files: list) -> dict:
+    res = merge_journals(dirs)
+    summaries = []
+    for path in metrics_files:
+        try:
+            with open(path, encoding="utf-8") as f:
+                summaries.append(json.load(f))
+        except Exception as err:
+            logger.warning(f"The metrics file {path} was skipped: {err}")
+    if summaries:
+        res["metrics"] = merge_summaries(summaries)
+    return res
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Merges the journals and metrics of the shards of one export")
+    parser.add_argument("--dir", dest="dirs", action="append", default=[],
+                        help="Output directory of one or more shards (repeatable)")
+    parser.add_argument("--metrics", dest="metrics_files", nargs="*", default=[],
+                        help="--metrics-out files of the shards")
+    parser.add_argument("--out", dest="out", default="",
+                        help="Write the run summary to this JSON file (default: stdout)")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)5s %(message)s')
+    args = parse_args()
+    summary = merge(args.dirs or [os.getcwd()], args.metrics_files)
+    summary["version"] = __version__
+    if args.out:
+        write_json_atomic(args.out, summary)
+        logger.info(f"{summary['reports']} report(s) of {len(summary['shards'])} shard(s) were merged into {args.out}")
+    else:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    if summary["missing_shards"]:
+        logger.warning(f"No journal was found for the shard(s) {summary['missing_shards']}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
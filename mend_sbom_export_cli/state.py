@@ -0,0 +1,198 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from mend_sbom_export_cli._version import __tool_name__
+
+logger = logging.getLogger(__tool_name__)
+
+
+def file_sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def get_shard_file_name(file_name: str, shard: str = "") -> str:
+    """Inserts the shard id before the extension, so that shards sharing an output directory keep separate files"""
+    base, ext = os.path.splitext(file_name)
+    return f"{base}.{shard}{ext}" if shard else file_name
+
+
+def write_json_atomic(path: str, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+JOURNAL_FIELDS = {"start": (), "submitted": ("token", "uuid"), "done": ("token", "file"), "failed": ("token",),
+                  "end": ()}  # event -> fields of its records
+
+
+def parse_journal(lines) -> dict:
+    """Options of the run, completed reports and CDX jobs still pending of the lines of a journal, and whether the run
+    ended. Torn lines and lines that are not journal records are skipped"""
+    res = {"options": None, "done": {}, "pending": {}, "ended": False}
+    for line in lines:
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        fields = JOURNAL_FIELDS.get(rec.get("event")) if isinstance(rec, dict) and isinstance(rec.get("event"), str) \
+            else None
+        if fields is None or any(x not in rec for x in fields):
+            continue
+        if rec["event"] == "start":
+            res["options"] = rec.get("options", "")
+            res["ended"] = False
+        elif rec["event"] == "submitted":
+            res["pending"][rec["token"]] = rec["uuid"]
+        elif rec["event"] == "done":
+            res["done"][rec["token"]] = rec["file"]
+            res["pending"].pop(rec["token"], None)
+        elif rec["event"] == "failed":
+            res["done"].pop(rec["token"], None)
+            res["pending"].pop(rec["token"], None)
+        elif rec["event"] == "end":
+            res["ended"] = True
+    return res
+
+
+class ExportState:
+    """Incremental export state kept in the output directory
+
+    For every exported project it records the `lastUpdatedDate` of its vitals, the export options and the name
+    and hash of the written report, so that unchanged projects can be skipped by the next run.
+    """
+    STATE_FILE = ".sbom_export_state.json"
+
+    def __init__(self, out_dir: str, options: str, shard: str = ""):
+        self.path = os.path.join(out_dir, get_shard_file_name(self.STATE_FILE, shard))
+        self.out_dir = out_dir
+        self.options = options
+        self._lock = threading.Lock()
+        self.projects = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.projects = json.load(f).get("projects", {})
+        except FileNotFoundError:
+            pass
+        except Exception as err:
+            logger.warning(f"The state file {self.path} is unreadable, all projects will be exported: {err}")
+
+    def is_unchanged(self, token: str, last_updated: str) -> bool:
+        entry = self.projects.get(token)
+        if not entry or not last_updated or entry.get("lastUpdatedDate") != last_updated or \
+                entry.get("options") != self.options:
+            return False
+        full_path = os.path.join(self.out_dir, entry.get("file", ""))
+        try:
+            return os.path.isfile(full_path) and file_sha256(full_path) == entry.get("sha256")
+        except OSError:
+            return False
+
+    def filter_changed(self, prj_lst: list, prj_vitals: dict) -> list:
+        res = [prj_ for prj_ in prj_lst
+               if not self.is_unchanged(next(iter(prj_)), prj_vitals.get(next(iter(prj_)), {}).get("lastUpdatedDate"))]
+        if len(res) < len(prj_lst):
+            logger.info(f"Skipping {len(prj_lst) - len(res)} project(s) that were not updated since the last export")
+        return res
+
+    def record(self, token: str, last_updated: str, rep_name: str):
+        full_path = os.path.join(self.out_dir, rep_name)
+        entry = {
+            "lastUpdatedDate": last_updated,
+            "options": self.options,
+            "file": rep_name,
+            "sha256": file_sha256(full_path),
+        }
+        with self._lock:
+            self.projects[token] = entry
+
+    def save(self):
+        with self._lock:
+            write_json_atomic(self.path, {"projects": self.projects})
+
+
+class RunJournal:
+    """Append-only journal of a run, used by --resume
+
+    Every completed or failed report and every submitted CDX job is appended as one JSON line and flushed to disk
+    at once, so an interrupted run loses at most the record being written (a torn last line is ignored on load).
+    A run that went through all its projects ends the journal with an `end` record; --resume does not continue a
+    completed run, it starts a new one.
+    """
+    JOURNAL_FILE = ".sbom_export_journal.jsonl"
+
+    def __init__(self, out_dir: str, options: str, resume: bool = False, shard: str = ""):
+        self.path = os.path.join(out_dir, get_shard_file_name(self.JOURNAL_FILE, shard))
+        self.options = options
+        self._lock = threading.Lock()
+        self.done = {}  # token -> report name
+        self.pending = {}  # token -> CDX async report uuid
+        torn = False
+        if resume:
+            torn = self.load()
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+        if torn:
+            self._file.write("\n")
+        if not resume or not os.path.getsize(self.path):
+            self._append({"event": "start", "options": options})
+
+    def load(self) -> bool:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            logger.info("No journal of a previous run was found, starting from the beginning")
+            return False
+        journal = parse_journal(lines)
+        if journal["options"] is not None and journal["options"] != self.options:
+            logger.warning("The previous run used different options, its journal is ignored")
+            os.remove(self.path)
+            return False
+        if journal["ended"]:
+            logger.info("The previous run was completed, starting a new run")
+            os.remove(self.path)
+            return False
+        self.done, self.pending = journal["done"], journal["pending"]
+        logger.info(f"Resuming the previous run: {len(self.done)} report(s) done, "
+                    f"{len(self.pending)} CDX job(s) submitted")
+        return bool(lines) and not lines[-1].endswith("\n")
+
+    def _append(self, rec: dict):
+        with self._lock:
+            self._file.write(json.dumps(rec) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def filter_done(self, prj_lst: list) -> list:
+        return [prj_ for prj_ in prj_lst if next(iter(prj_)) not in self.done]
+
+    def get_uuid(self, token: str) -> str:
+        return self.pending.get(token, "")
+
+    def record_submitted(self, token: str, uuid: str):
+        self._append({"event": "submitted", "token": token, "uuid": uuid})
+
+    def record_done(self, token: str, rep_name: str):
+        self.done[token] = rep_name
+        self._append({"event": "done", "token": token, "file": rep_name})
+
+    def record_failed(self, token: str):
+        """The project is exported again by --resume, its CDX job (if any) is not resumed"""
+        self.done.pop(token, None)
+        self.pending.pop(token, None)
+        self._append({"event": "failed", "token": token})
+
+    def record_end(self):
+        """The run went through all its projects, the next --resume starts a new run"""
+        self._append({"event": "end"})
+
+    def close(self):
+        self._file.close()
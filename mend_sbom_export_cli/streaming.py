@@ -0,0 +1,241 @@
+"""Event by event processing of SPDX reports downloaded to disk, used by --stream
+
+The report is read twice with ijson: once to collect the package SPDXIDs for the license join and once to write it
+with the extracted licensing section spliced in. Only the SPDXIDs and the license texts of the project are kept in
+memory, whatever the size of the report. Like `processing`, nothing here depends on the CLI globals.
+
+A ReportFeed passes the members of a report to the collectors of --aggregate and --delta while the report is
+written, so that the written report does not have to be read again.
+"""
+import json
+import shutil
+from typing import Iterator, Optional, Tuple
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+from mend_sbom_export_cli.output import open_report, open_report_reader, read_report
+from mend_sbom_export_cli.processing import SBOM_KEYS, add_spdx_lic_ref, get_spdx_lic_infos, get_spdx_lic_refs, loads
+
+LIC_INFOS_KEY = "hasExtractedLicensingInfos"
+SCALAR_EVENTS = ("null", "boolean", "integer", "double", "number", "string")
+
+
+def check_streaming() -> str:
+    """Returns an error message if ijson is not installed"""
+    return "" if ijson else "The streaming of the reports requires ijson. Install it with: pip install ijson"
+
+
+class JsonStreamWriter:
+    """Writes ijson parse events as JSON, formatted like json.dump with indent=4 or with the compact separators"""
+
+    def __init__(self, out_file, compact: bool = False):
+        self.out_file = out_file
+        self.compact = compact
+        self.counts = []  # items written in every open container
+        self.after_key = False
+
+    def _begin_item(self):
+        if self.after_key:
+            self.after_key = False
+            return
+        if not self.counts:
+            return
+        sep = "," if self.counts[-1] else ""
+        self.counts[-1] += 1
+        self.out_file.write(sep if self.compact else f"{sep}\n{'    ' * len(self.counts)}")
+
+    def _end_container(self, close: str):
+        count = self.counts.pop()
+        if count and not self.compact:
+            self.out_file.write(f"\n{'    ' * len(self.counts)}")
+        self.out_file.write(close)
+
+    def key(self, key_: str):
+        self._begin_item()
+        self.out_file.write(json.dumps(key_, ensure_ascii=False) + (":" if self.compact else ": "))
+        self.after_key = True
+
+    def value(self, obj):
+        """Writes a whole object at the current position"""
+        self._begin_item()
+        if self.compact:
+            self.out_file.write(json.dumps(obj, separators=(",", ":"), ensure_ascii=False))
+        else:
+            text = json.dumps(obj, indent=4, ensure_ascii=False)
+            self.out_file.write(text.replace("\n", f"\n{'    ' * len(self.counts)}"))
+
+    def event(self, event: str, value):
+        if event == "map_key":
+            self.key(value)
+        elif event in ("start_map", "start_array"):
+            self._begin_item()
+            self.out_file.write("{" if event == "start_map" else "[")
+            self.counts.append(0)
+        elif event == "end_map":
+            self._end_container("}")
+        elif event == "end_array":
+            self._end_container("]")
+        else:
+            self.value(value)
+
+
+class TeeReader:
+    """Binary file object that writes everything read from `src_file` to `out_file`"""
+
+    def __init__(self, src_file, out_file):
+        self.src_file = src_file
+        self.out_file = out_file
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.src_file.read(size)
+        self.out_file.write(data)
+        return data
+
+
+def iter_members(src_file, keys: set) -> Iterator[Tuple[str, object]]:
+    """Yields (key, item) for every item of the top-level arrays `keys`, built one at a time, and (key, value) for
+    the top-level scalars `keys`"""
+    builder, item_prefix = None, ""
+    for prefix, event, value in ijson.parse(src_file, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == item_prefix and event in ("end_map", "end_array"):
+                yield item_prefix[:-len(".item")], builder.value
+                builder = None
+            continue
+        key_, _, rest = prefix.partition(".")
+        if key_ not in keys or rest not in ("", "item"):
+            continue
+        if rest and event in ("start_map", "start_array"):
+            builder, item_prefix = ijson.ObjectBuilder(), prefix
+            builder.event(event, value)
+        elif event in SCALAR_EVENTS:
+            yield key_, value
+
+
+class ReportFeed:
+    """Passes the members of one report to its collectors, by collector name
+
+    A collector has the set `keys` of the top-level members it takes and `add(key, value)`, called for every item
+    of these arrays and for these scalars.
+    """
+
+    def __init__(self, collectors: dict):
+        self.collectors = collectors
+        self.keys = set().union(*(x.keys for x in collectors.values()))
+
+    def add(self, key_: str, value):
+        for collector in self.collectors.values():
+            if key_ in collector.keys:
+                collector.add(key_, value)
+
+    def add_doc(self, doc: dict):
+        """Feeds a document already in memory"""
+        for key_ in self.keys.intersection(doc if isinstance(doc, dict) else ()):
+            value = doc[key_]
+            for item in value if isinstance(value, list) else [value]:
+                self.add(key_, item)
+
+    def add_file(self, path: str, compression: str = ""):
+        """Feeds a report on disk, item by item with ijson, as a whole without it"""
+        if ijson is None:
+            self.add_doc(loads(read_report(path, compression)))
+            return
+        with open_report_reader(path, compression) as src_file:
+            for key_, value in iter_members(src_file, self.keys):
+                self.add(key_, value)
+
+
+def copy_report(src_file, out_file, feed: ReportFeed, sbom_type: str) -> bool:
+    """Copies the report as is and feeds its members from the bytes being copied; returns whether it is an SBOM"""
+    tee = TeeReader(src_file, out_file)
+    top_keys = set()
+    try:
+        for key_, value in iter_members(tee, feed.keys | {SBOM_KEYS[sbom_type], "errorCode"}):
+            top_keys.add(key_)
+            if key_ in feed.keys:
+                feed.add(key_, value)
+    except ijson.JSONError:
+        top_keys = set()
+    shutil.copyfileobj(src_file, out_file)  # the parser may stop before the end of the file
+    return SBOM_KEYS[sbom_type] in top_keys and "errorCode" not in top_keys
+
+
+def feed_lic_infos(feed: Optional[ReportFeed], lic_infos: list) -> list:
+    """Passes the licensing infos spliced into the report to the feed; returns the infos left to write (none)"""
+    if feed and LIC_INFOS_KEY in feed.keys:
+        for lic_info in lic_infos:
+            feed.add(LIC_INFOS_KEY, lic_info)
+    return []
+
+
+def spdx_package_ids(src_path: str) -> list:
+    with open(src_path, "rb") as src_file:
+        return list(ijson.items(src_file, "packages.item.SPDXID"))
+
+
+def spdx_lic_keys(src_path: str) -> list:
+    try:
+        return [(x,) for x in spdx_package_ids(src_path)]
+    except Exception:
+        return []
+
+
+def write_spdx(src_path: str, lic_texts: dict, path: str, compression: str = "", compact: bool = False,
+               dedup: bool = False, feed: Optional[ReportFeed] = None) -> bool:
+    """Writes the enriched SPDX report from the downloaded response and returns whether it is an SPDX document
+
+    The extracted licensing infos are appended to the document's own section, or added as the last member.
+    With `dedup` the packages get their LicenseRef, and the items taken by the `feed` are passed to it, so these
+    items are built as objects, one at a time.
+    """
+    try:
+        package_ids = spdx_package_ids(src_path) if lic_texts else []
+        lic_infos, lic_refs = get_spdx_lic_refs(package_ids, lic_texts) if dedup else \
+            (get_spdx_lic_infos(package_ids, lic_texts), {})
+        feed_keys = feed.keys if feed else set()
+        built_prefixes = set(f"{x}.item" for x in feed_keys) | ({"packages.item"} if lic_refs else set())
+        builder, item_prefix = None, ""
+        top_keys = set()
+        with open(src_path, "rb") as src_file, open_report(path, compression) as out_file:
+            writer = JsonStreamWriter(out_file, compact)
+            for prefix, event, value in ijson.parse(src_file, use_float=True):
+                if event == "map_key" and prefix == "":
+                    top_keys.add(value)
+                if builder is not None:
+                    builder.event(event, value)
+                    if prefix == item_prefix and event in ("end_map", "end_array"):
+                        item = builder.value
+                        if item_prefix == "packages.item" and lic_refs and item.get("SPDXID") in lic_refs:
+                            add_spdx_lic_ref(item, lic_refs[item["SPDXID"]])
+                        writer.value(item)
+                        if feed:
+                            feed.add(item_prefix[:-len(".item")], item)
+                        builder = None
+                    continue
+                if prefix in built_prefixes and event in ("start_map", "start_array"):
+                    builder, item_prefix = ijson.ObjectBuilder(), prefix
+                    builder.event(event, value)
+                    continue
+                if prefix in feed_keys and event in SCALAR_EVENTS:
+                    feed.add(prefix, value)
+                if lic_infos and event == "end_array" and prefix == LIC_INFOS_KEY and len(writer.counts) == 2:
+                    for lic_info in lic_infos:
+                        writer.value(lic_info)
+                    lic_infos = feed_lic_infos(feed, lic_infos)
+                elif lic_infos and event == "end_map" and prefix == "" and len(writer.counts) == 1:
+                    writer.key(LIC_INFOS_KEY)
+                    writer.event("start_array", None)
+                    for lic_info in lic_infos:
+                        writer.value(lic_info)
+                    writer.event("end_array", None)
+                    lic_infos = feed_lic_infos(feed, lic_infos)
+                writer.event(event, value)
+        return SBOM_KEYS["spdx"] in top_keys and "errorCode" not in top_keys
+    except ijson.JSONError:
+        with open_report(path, compression) as out_file:
+            out_file.write("[]")
+        return False
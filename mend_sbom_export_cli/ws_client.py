@@ -0,0 +1,241 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from mend_sbom_export_cli._version import __tool_name__
+
+logger = logging.getLogger(__tool_name__)
+
+
+class RateLimiter:
+    """Spaces out calls so that no more than `rate` of them start per second (0 - unlimited)"""
+
+    def __init__(self, rate: float = 0):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time)
+            self._next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+THROTTLE_STATUSES = (429, 503)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        try:
+            return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except Exception:
+            return None
+
+
+class RequestGovernor:
+    """Rate limit, retry and concurrency policy shared by all API requests of a run
+
+    - a token bucket keeps the request rate at or below `rate` per second (0 - unlimited)
+    - 429/5xx responses and connection errors are retried up to `max_retries` times with jittered exponential
+      backoff, or after the `Retry-After` interval when the server sends one
+    - throttling responses halve the allowed concurrency, which then grows back by one per window of successes;
+      after `breaker_threshold` consecutive failures all requests pause for `breaker_cooldown` seconds
+    """
+
+    def __init__(self, rate: float = 0, max_concurrency: int = 10, max_retries: int = 5, backoff_base: float = 1,
+                 backoff_max: float = 60, breaker_threshold: int = 10, breaker_cooldown: float = 15):
+        self.rate = rate if rate and rate > 0 else 0
+        self.burst = max(self.rate, 1)
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.limit = self.max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._lock = threading.Lock()
+        self._slot_cond = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._tokens = self.burst
+        self._refill_time = time.monotonic()
+        self._open_until = 0.0
+        self._last_decrease = 0.0
+        self._consecutive_failures = 0
+        self._successes = 0
+        self.stats = defaultdict(lambda: {"requests": 0, "ok": 0, "retries": 0, "failed": 0})
+
+    def reserve(self) -> float:
+        """Takes a token and returns how long the caller has to wait before sending"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self._open_until - now, 0)
+            if self.rate:
+                self._tokens = min(self.burst, self._tokens + (now - self._refill_time) * self.rate)
+                self._refill_time = now
+                self._tokens -= 1
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens / self.rate)
+            return wait
+
+    def acquire(self):
+        with self._slot_cond:
+            self._slot_cond.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    def release(self):
+        with self._slot_cond:
+            self._in_flight -= 1
+            self._slot_cond.notify_all()
+
+    def is_retriable(self, status: Optional[int]) -> bool:
+        return status is None or status in RETRY_STATUSES
+
+    def on_success(self, request_type: str):
+        with self._lock:
+            self.stats[request_type]["requests"] += 1
+            self.stats[request_type]["ok"] += 1
+            self._consecutive_failures = 0
+            self._successes += 1
+            if self.limit < self.max_concurrency and self._successes >= self.limit:
+                self._successes = 0
+                self.limit += 1
+                self._slot_cond.notify_all()
+
+    def on_rejected(self, request_type: str):
+        """Registers a response that is not worth retrying (4xx other than 429)"""
+        with self._lock:
+            self.stats[request_type]["requests"] += 1
+            self.stats[request_type]["failed"] += 1
+
+    def on_response(self, request_type: str, status: int):
+        if status < 400:
+            self.on_success(request_type)
+        else:
+            self.on_rejected(request_type)
+
+    def on_failure(self, request_type: str, attempt: int, status: Optional[int] = None,
+                   retry_after: Optional[str] = None, error=None) -> Optional[float]:
+        """Registers a failed attempt and returns the delay before the next one, or None to give up"""
+        with self._lock:
+            now = time.monotonic()
+            stats = self.stats[request_type]
+            stats["requests"] += 1
+            self._consecutive_failures += 1
+            self._successes = 0
+            if status in THROTTLE_STATUSES and now - self._last_decrease > 1:
+                self._last_decrease = now
+                self.limit = max(self.limit // 2, 1)
+                logger.debug(f"The server is throttling requests, concurrency is lowered to {self.limit}")
+            if self._consecutive_failures >= self.breaker_threshold and self._open_until < now:
+                self._open_until = now + self.breaker_cooldown
+                logger.warning(f"{self._consecutive_failures} requests in a row failed, "
+                               f"pausing all requests for {self.breaker_cooldown} seconds")
+            if attempt >= self.max_retries or not self.is_retriable(status):
+                stats["failed"] += 1
+                return None
+            stats["retries"] += 1
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        logger.debug(f"{request_type} failed ({status or error}), "
+                     f"retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        return delay
+
+    def execute(self, request_type: str, send):
+        """Runs `send()` (returning a requests.Response) under the policy and returns the last response"""
+        attempt = 0
+        while True:
+            wait = self.reserve()
+            if wait:
+                time.sleep(wait)
+            self.acquire()
+            try:
+                response = send()
+            except requests.RequestException as err:
+                response = None
+                delay = self.on_failure(request_type, attempt, error=err)
+                if delay is None:
+                    raise
+            finally:
+                self.release()
+            if response is not None:
+                if not self.is_retriable(response.status_code):
+                    self.on_response(request_type, response.status_code)
+                    return response
+                delay = self.on_failure(request_type, attempt, status=response.status_code,
+                                        retry_after=response.headers.get("Retry-After"))
+                if delay is None:
+                    return response
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def log_summary(self):
+        for request_type, stats in sorted(self.stats.items()):
+            logger.info(f"{request_type}: {stats['requests']} request(s), {stats['ok']} succeeded, "
+                        f"{stats['retries']} retried, {stats['failed']} failed")
+
+
+class WsClient:
+    """Shared HTTP client with one keep-alive connection pool for all workers"""
+
+    def __init__(self, pool_size: int = 10, governor: Optional[RequestGovernor] = None):
+        self.pool_size = max(int(pool_size), 1)
+        self.governor = governor
+        self.session = requests.Session()
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        self.adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size, pool_block=True)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self._lock = threading.Lock()
+        self.requests_sent = 0
+
+    def request(self, method: str, url: str, request_type: str = "", **kwargs) -> requests.Response:
+        def send():
+            with self._lock:
+                self.requests_sent += 1
+            return self.session.request(method=method, url=url, **kwargs)
+
+        return self.governor.execute(request_type or url, send) if self.governor else send()
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def connection_stats(self) -> dict:
+        opened = 0
+        pools = self.adapter.poolmanager.pools
+        with pools.lock:
+            pool_list = list(pools._container.values())
+        for pool_ in pool_list:
+            opened += pool_.num_connections
+        return {
+            "requests": self.requests_sent,
+            "connections_opened": opened,
+            "connections_reused": max(self.requests_sent - opened, 0),
+        }
+
+    def log_stats(self, title: str = "HTTP connection pool"):
+        stats = self.connection_stats()
+        logger.debug(f"{title}: {stats['requests']} requests, {stats['connections_opened']} connections opened, "
+                     f"{stats['connections_reused']} reused (pool size {self.pool_size})")
+
+    def close(self):
+        self.log_stats()
+        self.session.close()
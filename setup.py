@@ -7,7 +7,9 @@ setuptools.setup(
     name=mend_name,
     entry_points={
         'console_scripts': [
-            f'{__tool_name__}={mend_name}.{__tool_name__}:main'
+            f'{__tool_name__}={mend_name}.{__tool_name__}:main',
+            f'sbom_export_merge={mend_name}.shards:main',
+            f'sbom_export_service={mend_name}.service:main'
         ]},
     version=__version__,
     author="Mend Professional Services",
@@ -19,6 +21,8 @@ setuptools.setup(
     long_description=open("README.md").read(),
     long_description_content_type="text/markdown",
     install_requires=[line.strip() for line in open("requirements.txt").readlines()],
+    extras_require={"async": ["aiohttp>=3.8"], "zstd": ["zstandard>=0.15"], "fast": ["orjson>=3.6"],
+                    "stream": ["ijson>=3.1"]},
     python_requires='>=3.9',
     classifiers=[
         "Programming Language :: Python :: 3.9",
@@ -0,0 +1,79 @@
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+sys.path.insert(0, ROOT)
+
+from mock_server import MockMendServer, MockOrg, make_token  # noqa: E402
+from mend_sbom_export_cli import mend_api  # noqa: E402
+from mend_sbom_export_cli import sbom_export_cli as cli  # noqa: E402
+
+USER_KEY = "u" * 64
+ORG_TOKEN = make_token("org", 0)
+PROJECTS = 6
+
+
+@pytest.fixture
+def mock_server():
+    server = MockMendServer(MockOrg(projects=PROJECTS, products=2, components=20, libraries=60),
+                            async_duration=0.05).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(autouse=True)
+def fast_cdx_poll(monkeypatch):
+    monkeypatch.setattr(mend_api, "CDX_POLL_MIN_DELAY", 0.05)
+
+
+@pytest.fixture
+def run_export(mock_server, tmp_path):
+    """Runs the CLI against the mock server and returns the output directory"""
+    def run(*args, out_dir=None):
+        out_dir = str(out_dir or tmp_path / "out")
+        argv = ["--user-key", USER_KEY, "--api-key", ORG_TOKEN, "--url", mock_server.url, "--dir", out_dir]
+        try:
+            cli.main(argv + list(args))
+        except SystemExit as err:
+            assert not err.code, f"The export exited with {err.code}"
+        return out_dir
+
+    return run
+
+
+def read_reports(out_dir: str, prefix: str = "") -> dict:
+    """Report name -> document of the JSON reports in the output directory"""
+    res = {}
+    for name in sorted(os.listdir(out_dir)):
+        if name.endswith(".json") and not name.startswith(".") and name.startswith(prefix):
+            with open(os.path.join(out_dir, name), encoding="utf-8") as f:
+                res[name] = json.load(f)
+    return res
+
+
+def fail_project(server: MockMendServer, request_type: str, token: str):
+    """Makes the mock answer `request_type` of the project with an error body"""
+    handler = getattr(server, f"_on_{request_type}")
+
+    def on_request(request: dict):
+        return server._error("Internal error") if request.get("projectToken") == token else handler(request)
+
+    setattr(server, f"_on_{request_type}", on_request)
+    return handler
+
+
+def record_requests(server: MockMendServer, request_type: str) -> list:
+    """Project tokens of the `request_type` requests of the mock, in the order they were received"""
+    handler = getattr(server, f"_on_{request_type}")
+    tokens = []
+
+    def on_request(request: dict):
+        tokens.append(request.get("projectToken"))
+        return handler(request)
+
+    setattr(server, f"_on_{request_type}", on_request)
+    return tokens
@@ -0,0 +1,45 @@
+import pytest
+
+from conftest import PROJECTS, read_reports
+
+
+def get_aggregate(out_dir: str) -> dict:
+    aggregates = read_reports(out_dir, "Aggregated")
+    assert len(aggregates) == 1
+    return next(iter(aggregates.values()))
+
+
+@pytest.mark.parametrize("options", [[], ["--stream", "true"], ["--lictext", "true", "--dedupLicenses", "true"]])
+def test_spdx_packages_are_deduplicated(run_export, options):
+    out_dir = run_export("--aggregate", "org", *options)
+    reports = read_reports(out_dir, "SPDX")
+    aggregate = get_aggregate(out_dir)
+
+    assert len(reports) == PROJECTS
+    package_ids = [x["SPDXID"] for x in aggregate["packages"]]
+    assert len(package_ids) == len(set(package_ids))
+    assert set(package_ids) == {x["SPDXID"] for report in reports.values() for x in report["packages"]}
+    relationships = [tuple(x.values()) for x in aggregate["relationships"]]
+    assert len(relationships) == len(set(relationships))
+
+
+def test_cdx_components_and_dependencies_are_deduplicated(run_export):
+    out_dir = run_export("--aggregate", "org", "--type", "cdx")
+    reports = {k: v for k, v in read_reports(out_dir).items() if not k.startswith("Aggregated")}
+    aggregate = get_aggregate(out_dir)
+
+    assert len(reports) == PROJECTS
+    refs = [x["bom-ref"] for x in aggregate["components"]]
+    assert len(refs) == len(set(refs))
+    assert set(refs) == {x["bom-ref"] for report in reports.values() for x in report["components"]}
+    dependencies = {x["ref"]: set(x["dependsOn"]) for x in aggregate["dependencies"]}
+    assert len(dependencies) == len(aggregate["dependencies"])
+    for report in reports.values():
+        for x in report["dependencies"]:
+            assert set(x["dependsOn"]) <= dependencies[x["ref"]]
+
+
+def test_product_aggregates(run_export, mock_server):
+    out_dir = run_export("--aggregate", "product")
+    aggregates = read_reports(out_dir, "Aggregated")
+    assert sorted(aggregates) == [f"Aggregated SPDX report for {x['name']}.json" for x in mock_server.org.products]
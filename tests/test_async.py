@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from conftest import PROJECTS, read_reports, record_requests
+from mend_sbom_export_cli import async_engine
+
+pytest.importorskip("aiohttp")
+
+
+@pytest.mark.parametrize("sbom_type, options", [
+    ("spdx", []),
+    ("spdx", ["--lictext", "true"]),
+    ("spdx", ["--lictext", "true", "--stream", "true"]),
+    ("cdx", []),
+    ("cdx", ["--lictext", "true", "--dedupLicenses", "true"]),
+])
+def test_async_reports_equal_the_threaded_ones(run_export, tmp_path, sbom_type, options):
+    threaded = read_reports(run_export("--type", sbom_type, *options, out_dir=tmp_path / "threads"))
+    async_ = read_reports(run_export("--engine", "async", "--type", sbom_type, *options, out_dir=tmp_path / "async"))
+    assert len(async_) == PROJECTS
+    assert async_ == threaded
+
+
+def test_async_tasks_are_bounded(run_export, monkeypatch):
+    create_spdx = async_engine.create_spdx
+    tasks = []
+
+    async def create(client, prj_):
+        tasks.append(len(asyncio.all_tasks()))
+        return await create_spdx(client, prj_)
+
+    monkeypatch.setattr(async_engine, "create_spdx", create)
+    run_export("--engine", "async", "--threads", "1")
+    assert len(tasks) == PROJECTS
+    # The main task, one project task and the two requests it sends at once, instead of a task for every project
+    assert max(tasks) <= 4
+
+
+def test_async_discovery_falls_back_to_the_project_list(run_export, mock_server):
+    mock_server._on_getProductProjectVitals = lambda request: mock_server._error("Not allowed")
+    exported = record_requests(mock_server, "getProjectSpdxReport")
+    lookups = record_requests(mock_server, "getProjectVitals")
+    run_export("--engine", "async", "--productToken", mock_server.org.products[0]["token"],
+               "--exclude", mock_server.org.projects[0]["token"])
+    expected = {x["token"] for x in mock_server.org.projects[2::2]}
+    assert set(exported) == expected
+    assert len(lookups) == len(expected) + 1
+
+
+def test_async_discovery_is_cached(run_export, mock_server):
+    run_export("--engine", "async", "--discoveryTtl", "1")
+    requests = record_requests(mock_server, "getOrganizationProjectVitals")
+    exported = record_requests(mock_server, "getProjectSpdxReport")
+    run_export("--engine", "async", "--discoveryTtl", "1")
+    assert not requests
+    assert len(exported) == PROJECTS
@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+
+from conftest import PROJECTS, fail_project, read_reports
+from mock_server import make_token
+from mend_sbom_export_cli import mend_api
+from mend_sbom_export_cli.metrics import RunMetrics
+
+
+def record_calls(server, request_types: list) -> list:
+    """(request type, time) of the requests of the mock, in the order they were received"""
+    calls = []
+    for request_type in request_types:
+        handler = getattr(server, f"_on_{request_type}")
+
+        def on_request(request: dict, request_type=request_type, handler=handler):
+            calls.append((request_type, request.get("uuid") or request.get("reportStatusUUID"), time.monotonic()))
+            return handler(request)
+
+        setattr(server, f"_on_{request_type}", on_request)
+    return calls
+
+
+def test_every_project_is_exported(run_export, mock_server):
+    reports = read_reports(run_export("--type", "cdx"))
+    assert len(reports) == PROJECTS
+    assert all(x["bomFormat"] == "CycloneDX" for x in reports.values())
+    assert mock_server.counters["generateProjectReportAsync"] == PROJECTS
+    assert mock_server.counters["downloadAsyncReport"] == PROJECTS
+
+
+def test_reports_are_submitted_before_the_first_download(run_export, mock_server):
+    mock_server.async_duration = 0.3
+    calls = record_calls(mock_server, ["generateProjectReportAsync", "downloadAsyncReport"])
+    run_export("--type", "cdx")
+    types = [x[0] for x in calls]
+    assert types == ["generateProjectReportAsync"] * PROJECTS + ["downloadAsyncReport"] * PROJECTS
+
+
+def test_status_polls_back_off(run_export, mock_server):
+    mock_server.async_duration = 0.5
+    calls = record_calls(mock_server, ["getAsyncProcessStatus"])
+    run_export("--type", "cdx")
+    polls = {}
+    for _, uuid, at in calls:
+        polls.setdefault(uuid, []).append(at)
+    assert len(polls) == PROJECTS
+    for times in polls.values():
+        # A fixed 0.05 s delay would poll each job about 10 times
+        assert 2 <= len(times) <= 7
+        intervals = [y - x for x, y in zip(times, times[1:])]
+        assert intervals[-1] > intervals[0]
+
+
+def test_project_that_was_not_submitted_is_skipped(run_export, mock_server):
+    fail_project(mock_server, "generateProjectReportAsync", make_token("project", 1))
+    reports = read_reports(run_export("--type", "cdx"))
+    assert len(reports) == PROJECTS - 1
+    assert mock_server.counters["downloadAsyncReport"] == PROJECTS - 1
+
+
+def test_failed_job_is_not_downloaded(run_export, mock_server):
+    failed = make_token("project", 3)
+    handler = mock_server._on_getAsyncProcessStatus
+
+    def on_status(request: dict):
+        job = mock_server.jobs.get(request.get("uuid"))
+        if job and job[1]["token"] == failed:
+            return {"asyncProcessStatus": {"uuid": request.get("uuid"), "status": "FAILED"}}
+        return handler(request)
+
+    mock_server._on_getAsyncProcessStatus = on_status
+    reports = read_reports(run_export("--type", "cdx"))
+    assert len(reports) == PROJECTS - 1
+    assert mock_server.counters["downloadAsyncReport"] == PROJECTS - 1
+
+
+class FakeJobs:
+    """Status of fake report jobs: each job is IN_PROGRESS for its number of polls, then its final status"""
+
+    def __init__(self, jobs: dict):
+        self.jobs = jobs  # uuid -> [polls left, final status]
+        self.polls = []
+
+    def get_status(self, uuid: str):
+        self.polls.append(uuid)
+        job = self.jobs[uuid]
+        if isinstance(job[1], Exception):
+            raise job[1]
+        job[0] -= 1
+        return (job[1], "") if job[0] < 0 else ("IN_PROGRESS", "")
+
+
+def get_config() -> mend_api.ApiConfig:
+    return mend_api.ApiConfig(url="http://localhost", user_key="", ws_client=None, metrics=RunMetrics())
+
+
+def test_poller_completes_every_job():
+    jobs = FakeJobs({"a": [0, "SUCCESS"], "b": [3, "SUCCESS"], "c": [1, "FAILED"], "d": [0, RuntimeError("down")]})
+    config = get_config()
+    with mend_api.CdxPoller(config, threads=2, get_status=jobs.get_status) as poller:
+        futures = {x: poller.add(x) for x in jobs.jobs}
+        results = {x: y.result(timeout=5) for x, y in futures.items()}
+    assert results == {"a": ("SUCCESS", ""), "b": ("SUCCESS", ""), "c": ("FAILED", ""), "d": ("FAILED", "down")}
+    assert jobs.polls.count("b") == 4
+    assert config.metrics.phases["generation"].summary()["count"] == 2
+    assert config.metrics.phases["generation_failed"].summary()["count"] == 2
+
+
+def test_poller_close_cancels_the_pending_jobs():
+    jobs = FakeJobs({"a": [1000, "SUCCESS"]})
+    poller = mend_api.CdxPoller(get_config(), get_status=jobs.get_status)
+    future = poller.add("a")
+    done = threading.Event()
+    future.add_done_callback(lambda _: done.set())
+    poller.close()
+    assert future.cancelled() and done.is_set()
+    with pytest.raises(RuntimeError):
+        poller.add("b")
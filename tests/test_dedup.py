@@ -0,0 +1,89 @@
+import base64
+
+import pytest
+
+from conftest import PROJECTS, read_reports
+from mend_sbom_export_cli import processing
+
+
+def get_cdx_texts(report: dict) -> dict:
+    """(component, license) -> license text of a CDX report, following the text references of --dedup-licenses"""
+    refs = {x["license"]["bom-ref"]: x["license"]["text"]["content"]
+            for component in report["components"] for x in component.get("evidence", {}).get("licenses", [])
+            if "bom-ref" in x["license"]}
+    res = {}
+    for component in report["components"]:
+        for x in component.get("evidence", {}).get("licenses", []):
+            license_ = x["license"]
+            if "text" in license_:
+                content = license_["text"]["content"]
+            else:
+                assert [p["name"] for p in license_["properties"]] == [processing.LIC_TEXT_REF_PROPERTY]
+                content = refs[license_["properties"][0]["value"]]
+            res[(component["bom-ref"], license_["name"])] = base64.b64decode(content).decode("utf-8")
+    return res
+
+
+def get_spdx_texts(report: dict, dedup: bool) -> dict:
+    """Package -> license text of an SPDX report"""
+    lic_infos = {x["licenseId"]: x["extractedText"] for x in report.get("hasExtractedLicensingInfos", [])}
+    if not dedup:
+        return {x["SPDXID"]: lic_infos[x["SPDXID"].replace("SPDXRef-PACKAGE-", "LicenseRef-")]
+                for x in report["packages"] if x["SPDXID"].replace("SPDXRef-PACKAGE-", "LicenseRef-") in lic_infos}
+    res = {}
+    for package in report["packages"]:
+        refs = [x.strip("()") for x in package["licenseConcluded"].split() if x.strip("()") in lic_infos]
+        if refs:
+            assert len(refs) == 1
+            res[package["SPDXID"]] = lic_infos[refs[0]]
+    return res
+
+
+@pytest.mark.parametrize("stream", ["false", "true"])
+def test_spdx_texts_are_stored_once(run_export, tmp_path, stream):
+    full = read_reports(run_export("--lictext", "true", out_dir=tmp_path / "full"), "SPDX")
+    dedup = read_reports(run_export("--lictext", "true", "--dedupLicenses", "true", "--stream", stream,
+                                    out_dir=tmp_path / "dedup"), "SPDX")
+    assert len(dedup) == PROJECTS
+    for name, report in dedup.items():
+        texts = [x["extractedText"] for x in report["hasExtractedLicensingInfos"]]
+        assert len(texts) == len(set(texts)) < len(full[name]["hasExtractedLicensingInfos"])
+        assert get_spdx_texts(report, True) == get_spdx_texts(full[name], False)
+        for package, full_package in zip(report["packages"], full[name]["packages"]):
+            assert package.get("licenseInfoFromFiles") == full_package.get("licenseInfoFromFiles")
+            assert package["licenseConcluded"].startswith(f"({full_package['licenseConcluded']}) AND LicenseRef-") \
+                or package["licenseConcluded"] == f"{full_package['licenseConcluded']} AND " \
+                                                  f"{package['licenseConcluded'].split()[-1]}"
+
+
+def test_cdx_texts_are_stored_once(run_export, tmp_path):
+    full = read_reports(run_export("--type", "cdx", "--lictext", "true", out_dir=tmp_path / "full"))
+    dedup = read_reports(run_export("--type", "cdx", "--lictext", "true", "--dedupLicenses", "true",
+                                    out_dir=tmp_path / "dedup"))
+    assert len(dedup) == PROJECTS
+    for name, report in dedup.items():
+        contents = [x["license"]["text"]["content"] for component in report["components"]
+                    for x in component.get("evidence", {}).get("licenses", []) if "text" in x["license"]]
+        assert len(contents) == len(set(contents))
+        assert get_cdx_texts(report) == get_cdx_texts(full[name])
+        assert report["specVersion"] == processing.LIC_TEXT_REF_SPEC_VERSION
+
+
+def test_package_without_a_concluded_license_refers_to_its_text():
+    sbom_prj = {"packages": [{"SPDXID": "SPDXRef-PACKAGE-a", "filesAnalyzed": False, "licenseConcluded": "NOASSERTION"},
+                             {"SPDXID": "SPDXRef-PACKAGE-b", "licenseConcluded": "MIT"}]}
+    processing.enrich_spdx_data(sbom_prj, {"SPDXRef-PACKAGE-a": "text", "SPDXRef-PACKAGE-b": "text"}, dedup=True)
+    lic_ref = f"LicenseRef-{processing.get_lic_text_hash('text')}"
+    assert [x["licenseConcluded"] for x in sbom_prj["packages"]] == [lic_ref, f"MIT AND {lic_ref}"]
+    assert "licenseInfoFromFiles" not in sbom_prj["packages"][0]
+    assert sbom_prj["hasExtractedLicensingInfos"] == [{"licenseId": lic_ref, "extractedText": "text", "name": lic_ref}]
+
+
+def test_base64_cache_is_keyed_by_the_text_hash(monkeypatch):
+    monkeypatch.setattr(processing, "LIC_TEXT_B64_CACHE_SIZE", 2)
+    processing.clear_lic_text_b64()
+    for text in ("first", "second", "third"):
+        assert processing.get_lic_text_b64(processing.get_lic_text_hash(text), text) == \
+            base64.b64encode(text.encode("utf-8")).decode("utf-8")
+    assert list(processing._lic_text_b64) == [processing.get_lic_text_hash(x) for x in ("second", "third")]
+    processing.clear_lic_text_b64()
@@ -0,0 +1,82 @@
+import json
+import os
+
+from conftest import PROJECTS, read_reports
+from mend_sbom_export_cli.delta import DeltaIndex, DeltaReport, get_versionless_key
+
+
+def bump_versions(server):
+    """Makes the mock return a new version of the first package and drop the last one of every SPDX report"""
+    handler = server._on_getProjectSpdxReport
+
+    def on_request(request: dict):
+        report = handler(request)
+        packages = report.get("packages")
+        if packages:
+            package = packages[0]
+            package["versionInfo"] += ".1"
+            for ref_ in package["externalRefs"]:
+                ref_["referenceLocator"] += ".1"
+            del packages[-1]
+        return report
+
+    server._on_getProjectSpdxReport = on_request
+
+
+def get_deltas(out_dir: str) -> dict:
+    return {k: v for k, v in read_reports(out_dir).items() if k.endswith(".delta.json")}
+
+
+def test_versionless_key():
+    assert get_versionless_key("pkg:maven/org.mock/lib@1.2") == "pkg:maven/org.mock/lib"
+    assert get_versionless_key("pkg:npm/@angular/core@1.0?arch=x#dist") == "pkg:npm/@angular/core?arch=x#dist"
+    assert get_versionless_key("pkg:npm/%40angular/core") == "pkg:npm/%40angular/core"
+    assert get_versionless_key("SPDXRef-PACKAGE-lib@1") == "SPDXRef-PACKAGE-lib@1"
+
+
+def test_new_version_is_a_change(run_export, mock_server):
+    out_dir = run_export("--delta", "true")
+    deltas = get_deltas(out_dir)
+    assert len(deltas) == PROJECTS
+    assert all(x["baseline"] and not x["removed"] and not x["changed"] for x in deltas.values())
+
+    bump_versions(mock_server)
+    deltas = get_deltas(run_export("--delta", "true"))
+    assert len(deltas) == PROJECTS
+    for delta in deltas.values():
+        assert not delta["baseline"] and not delta["added"]
+        assert len(delta["removed"]) == 1
+        assert len(delta["changed"]) == 1
+        changed = delta["changed"][0]
+        assert changed["current"]["version"] == f"{changed['previous']['version']}.1"
+        assert not changed["key"].endswith(changed["current"]["version"])
+
+
+def test_index_keyed_by_full_purl_is_read(run_export):
+    out_dir = run_export("--delta", "true")
+    index_dir = os.path.join(out_dir, DeltaIndex.INDEX_DIR)
+    for name in os.listdir(index_dir):
+        path = os.path.join(index_dir, name)
+        with open(path, encoding="utf-8") as f:
+            index = json.load(f)
+        index["components"] = {f"{k}@{v[2]}": v for k, v in index["components"].items()}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+
+    deltas = get_deltas(run_export("--delta", "true"))
+    assert len(deltas) == PROJECTS
+    assert all(not x["added"] and not x["removed"] and not x["changed"] for x in deltas.values())
+
+
+def test_versions_of_one_component_in_a_report_are_kept_apart(tmp_path):
+    report = DeltaReport("spdx")
+    for version in ("1", "2"):
+        report.add("packages", {"name": "lib", "versionInfo": version, "externalRefs": [
+            {"referenceType": "purl", "referenceLocator": f"pkg:maven/org.mock/lib@{version}"}]})
+    assert len(report.components) == 2
+    index = DeltaIndex(str(tmp_path))
+    index.write_delta("token", "project", "spdx", "report.json", report.components)
+    index.write_delta("token", "project", "spdx", "report.json", report.components)
+    with open(tmp_path / "report.delta.json", encoding="utf-8") as f:
+        delta = json.load(f)
+    assert not delta["added"] and not delta["removed"] and not delta["changed"]
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from conftest import PROJECTS, make_token, record_requests
+
+
+def get_product_projects(server, idx: int) -> set:
+    return {x["token"] for x in server.org.projects if x["productToken"] == server.org.products[idx]["token"]}
+
+
+def test_org_projects_come_from_org_vitals(run_export, mock_server):
+    exported = record_requests(mock_server, "getProjectSpdxReport")
+    lookups = record_requests(mock_server, "getProjectVitals")
+    run_export()
+    assert len(exported) == PROJECTS
+    assert not lookups
+
+
+def test_product_projects_come_from_product_vitals(run_export, mock_server):
+    exported = record_requests(mock_server, "getProjectSpdxReport")
+    lookups = record_requests(mock_server, "getProjectVitals")
+    listed = record_requests(mock_server, "getAllProjects")
+    run_export("--productToken", mock_server.org.products[0]["token"])
+    assert set(exported) == get_product_projects(mock_server, 0)
+    assert not lookups and not listed
+
+
+def test_product_falls_back_to_the_project_list(run_export, mock_server):
+    mock_server._on_getProductProjectVitals = lambda request: mock_server._error("Not allowed")
+    exported = record_requests(mock_server, "getProjectSpdxReport")
+    lookups = record_requests(mock_server, "getProjectVitals")
+    out_dir = run_export("--productToken", ",".join(x["token"] for x in mock_server.org.products))
+    assert set(exported) == {x["token"] for x in mock_server.org.projects}
+    assert sorted(lookups) == sorted(exported)
+    # The report names come from the vitals looked up one by one
+    assert {f"SPDX report for {x['name']}.json" for x in mock_server.org.projects} <= set(os.listdir(out_dir))
+
+
+def test_unknown_product_is_skipped(run_export, mock_server):
+    exported = record_requests(mock_server, "getProjectSpdxReport")
+    run_export("--productToken", f"{mock_server.org.products[1]['token']},{make_token('product', 99)}")
+    assert set(exported) == get_product_projects(mock_server, 1)
+
+
+@pytest.mark.parametrize("scope", ["org", "project"])
+def test_excluded_product(run_export, mock_server, scope):
+    exported = record_requests(mock_server, "getProjectSpdxReport")
+    args = ["--exclude", mock_server.org.products[1]["token"]]
+    if scope == "project":
+        tokens = [x["token"] for x in mock_server.org.projects[:4]] + [make_token("project", 99)]
+        args += ["--projectToken", ",".join(tokens)]
+    run_export(*args)
+    expected = get_product_projects(mock_server, 0)
+    if scope == "project":
+        expected &= {x["token"] for x in mock_server.org.projects[:4]}
+    assert set(exported) == expected
+
+
+def count_discovery(server) -> dict:
+    return {x: record_requests(server, x) for x in ("getOrganizationProjectVitals", "getProjectVitals", "getAllProjects")}
+
+
+def test_discovery_is_reused_within_the_ttl(run_export, mock_server):
+    tokens = ",".join(x["token"] for x in mock_server.org.projects[:2])
+    args = ["--discoveryTtl", "1", "--exclude", mock_server.org.products[1]["token"]]
+    run_export(*args)
+    run_export(*args, "--projectToken", tokens)
+
+    requests = count_discovery(mock_server)
+    exported = record_requests(mock_server, "getProjectSpdxReport")
+    run_export(*args)
+    run_export(*args, "--projectToken", tokens)
+    assert not any(requests.values())
+    assert len(exported) == len(get_product_projects(mock_server, 0)) + 1
+
+
+@pytest.mark.parametrize("option", [["--refreshDiscovery", "true"], ["--incremental", "true"],
+                                    ["--discoveryTtl", "0"]])
+def test_discovery_is_requested_again(run_export, mock_server, option):
+    run_export("--discoveryTtl", "1")
+    requests = count_discovery(mock_server)
+    run_export("--discoveryTtl", "1", *option)
+    assert len(requests["getOrganizationProjectVitals"]) == 1
+
+
+def test_expired_discovery_is_requested_again(run_export, mock_server):
+    run_export("--discoveryTtl", "1")
+    requests = count_discovery(mock_server)
+    run_export("--discoveryTtl", "0.0000001")
+    assert len(requests["getOrganizationProjectVitals"]) == 1
@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from conftest import ORG_TOKEN, PROJECTS, USER_KEY, fail_project
+from mock_server import make_token
+from mend_sbom_export_cli.exporter import SbomExporter
+
+
+@pytest.fixture
+def get_exporter(mock_server):
+    exporters = []
+
+    def get(**kwargs):
+        exporter = SbomExporter(url=mock_server.url, user_key=USER_KEY, org_token=ORG_TOKEN, **kwargs)
+        exporters.append(exporter)
+        return exporter
+
+    yield get
+    for exporter in exporters:
+        exporter.close()
+
+
+@pytest.mark.parametrize("sbom_type", ["spdx", "cdx"])
+def test_export_yields_every_project(get_exporter, sbom_type):
+    results = list(get_exporter(sbom_type=sbom_type, lic_text=True).export())
+    assert sorted(project["name"] for project, _ in results) == [f"Project {i}" for i in range(PROJECTS)]
+    assert all(("spdxVersion" if sbom_type == "spdx" else "bomFormat") in sbom for _, sbom in results)
+
+
+def test_raw_reports_are_bytes(get_exporter):
+    results = list(get_exporter(raw=True).export())
+    assert len(results) == PROJECTS
+    assert all(isinstance(sbom, bytes) and b'"spdxVersion"' in sbom for _, sbom in results)
+
+
+def test_failed_projects_are_skipped(get_exporter, mock_server):
+    fail_project(mock_server, "getProjectSpdxReport", make_token("project", 1))
+    results = list(get_exporter(raw=True).export())
+    assert sorted(project["name"] for project, _ in results) == [f"Project {i}" for i in range(PROJECTS) if i != 1]
+
+
+def test_early_close_stops_the_export(get_exporter, mock_server):
+    mock_server.latency = 0.02
+    exporter = get_exporter(threads=4, max_in_flight=2)
+    projects = exporter.get_projects()
+    mock_server.reset_counters()
+    export = exporter.export(projects)
+    next(export)
+    export.close()
+    requested = mock_server.counters["getProjectSpdxReport"]
+    time.sleep(0.2)
+    assert mock_server.counters["getProjectSpdxReport"] == requested
+    assert requested <= 3
+
+
+def test_service_user_logs_in_on_first_use(mock_server):
+    with SbomExporter(url=mock_server.url, user_key=USER_KEY, service_user="user@mock.local") as exporter:
+        assert mock_server.counters["login"] == 0
+        projects = exporter.get_projects()
+        assert len(list(exporter.export(projects))) == PROJECTS
+    assert mock_server.counters["login"] == 1
+
+
+def test_cdx_jobs_are_generated_without_taking_threads(get_exporter, mock_server):
+    mock_server.async_duration = 0.3
+    calls = []
+    for request_type in ("generateProjectReportAsync", "downloadAsyncReport"):
+        handler = getattr(mock_server, f"_on_{request_type}")
+        setattr(mock_server, f"_on_{request_type}",
+                lambda request, request_type=request_type, handler=handler: calls.append(request_type) or handler(request))
+    results = list(get_exporter(sbom_type="cdx", threads=1, max_in_flight=PROJECTS).export())
+    assert len(results) == PROJECTS
+    # With one thread, polling from the thread would download each report before the next one is submitted
+    assert calls == ["generateProjectReportAsync"] * PROJECTS + ["downloadAsyncReport"] * PROJECTS
@@ -0,0 +1,48 @@
+import os
+
+from mend_sbom_export_cli.lic_cache import LicenseCache
+
+MIT_KEY = "SPDXRef-PACKAGE-lib1"
+APACHE_KEY = "SPDXRef-PACKAGE-lib2"
+
+
+def test_lookup_hit(tmp_path):
+    cache = LicenseCache(str(tmp_path))
+    cache.update({MIT_KEY: "MIT text"}, [(MIT_KEY,), (APACHE_KEY,)])
+    assert cache.lookup([(MIT_KEY,), (APACHE_KEY,)]) == {MIT_KEY: "MIT text"}
+    assert cache.lookup([("SPDXRef-PACKAGE-unknown",)]) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lookup_by_key_variant(tmp_path):
+    cache = LicenseCache(str(tmp_path))
+    cache.update({"SPDXRef-PACKAGE-lib1::Apache 2.0": "Apache text"})
+    assert cache.lookup([("SPDXRef-PACKAGE-lib1::Apache-2.0", "SPDXRef-PACKAGE-lib1::Apache 2.0")]) == \
+        {"SPDXRef-PACKAGE-lib1::Apache 2.0": "Apache text"}
+
+
+def test_cache_is_kept_between_runs(tmp_path):
+    cache = LicenseCache(str(tmp_path))
+    cache.update({MIT_KEY: "MIT text"})
+    cache.save()
+    assert LicenseCache(str(tmp_path)).lookup([(MIT_KEY,)]) == {MIT_KEY: "MIT text"}
+
+
+def test_expired_entries_are_missing(tmp_path):
+    cache = LicenseCache(str(tmp_path), ttl=3600)
+    cache.update({MIT_KEY: "MIT text"})
+    cache.keys[MIT_KEY]["ts"] -= 7200
+    assert cache.lookup([(MIT_KEY,)]) is None
+    cache.save()
+    assert MIT_KEY not in LicenseCache(str(tmp_path)).keys
+
+
+def test_least_recently_used_texts_are_evicted(tmp_path):
+    cache = LicenseCache(str(tmp_path), max_size=150)
+    cache.update({MIT_KEY: "m" * 100})
+    mit_hash = cache.keys[MIT_KEY]["hash"]
+    cache.texts[mit_hash]["atime"] -= 10
+    cache.update({APACHE_KEY: "a" * 100})
+    assert cache.lookup([(MIT_KEY,)]) is None
+    assert cache.lookup([(APACHE_KEY,)]) == {APACHE_KEY: "a" * 100}
+    assert not os.path.exists(os.path.join(cache.texts_dir, f"{mit_hash}.txt"))
@@ -0,0 +1,62 @@
+import json
+import random
+
+import pytest
+
+from conftest import PROJECTS
+from mend_sbom_export_cli.metrics import BUCKETS, Histogram, merge_summaries
+
+
+def test_histogram_keeps_bucket_counts_only():
+    hist = Histogram()
+    rnd = random.Random(0)
+    values = [rnd.expovariate(10) for _ in range(10000)]
+    for value in values:
+        hist.observe(value)
+    summary = hist.summary()
+
+    assert len(hist.buckets) == len(BUCKETS) + 1
+    assert summary["count"] == len(values)
+    assert summary["sum"] == pytest.approx(sum(values), abs=1e-3)
+    assert summary["max"] == pytest.approx(max(values), abs=1e-6)
+    values.sort()
+    for q in (50, 95, 99):
+        exact = values[int(q / 100 * len(values))]
+        # The estimate lies in the bucket of the exact quantile, whose bounds differ by a factor of 2
+        assert exact / 2 <= summary[f"p{q}"] <= exact * 2
+
+
+def test_empty_histogram():
+    assert Histogram().summary()["p99"] == 0.0
+
+
+def test_summaries_are_merged():
+    first, second = Histogram(), Histogram()
+    for value in (0.1, 0.2, 0.3):
+        first.observe(value)
+    second.observe(10.0)
+    merged = merge_summaries([{"started": "a", "duration_seconds": 1, "counters": {"reports_created": 3},
+                               "phases": {"download": first.summary()}},
+                              {"started": "b", "duration_seconds": 2, "counters": {"reports_created": 1},
+                               "phases": {"download": second.summary()}}])
+    assert merged["counters"] == {"reports_created": 4}
+    assert merged["duration_seconds"] == 2
+    assert merged["phases"]["download"]["count"] == 4
+    assert merged["phases"]["download"]["max"] == 10.0
+    assert 0.125 <= merged["phases"]["download"]["p50"] <= 0.5
+
+
+def test_export_writes_the_metrics(run_export, tmp_path):
+    run_export("--metrics-out", str(tmp_path / "metrics.json"), "--prometheus-out", str(tmp_path / "metrics.prom"),
+               "--lictext", "true")
+    with open(tmp_path / "metrics.json", encoding="utf-8") as f:
+        metrics = json.load(f)
+    assert metrics["counters"]["reports_created"] == PROJECTS
+    assert {"discovery", "licenses", "download", "write"} <= set(metrics["phases"])
+    assert metrics["requests"]["getProjectSpdxReport"]["latency"]["count"] == PROJECTS
+    assert metrics["requests"]["getProjectSpdxReport"]["bytes"] > 0
+    assert metrics["pools"]["reports"]["service"]["count"] == PROJECTS
+    with open(tmp_path / "metrics.prom", encoding="utf-8") as f:
+        prometheus = f.read()
+    assert 'sbom_export_request_seconds_count{request_type="getProjectSpdxReport"} ' + str(PROJECTS) in prometheus
+    assert 'sbom_export_events_total{event="reports_created"} ' + str(PROJECTS) in prometheus
@@ -0,0 +1,62 @@
+import json
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from conftest import ORG_TOKEN, PROJECTS, USER_KEY, read_reports
+from mend_sbom_export_cli import sbom_export_cli as cli
+from mend_sbom_export_cli.output import read_report
+
+
+def read_compressed(out_dir: str, suffix: str, compression: str) -> dict:
+    return {name[:-len(suffix)]: json.loads(read_report(os.path.join(out_dir, name), compression))
+            for name in sorted(os.listdir(out_dir)) if name.endswith(f".json{suffix}")}
+
+
+@pytest.mark.parametrize("sbom_type", ["spdx", "cdx"])
+@pytest.mark.parametrize("compression, suffix", [("gzip", ".gz"), ("zstd", ".zst")])
+def test_compressed_reports_equal_the_plain_ones(run_export, tmp_path, sbom_type, compression, suffix):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    plain = read_reports(run_export("--type", sbom_type, out_dir=tmp_path / "plain"))
+    out_dir = run_export("--type", sbom_type, "--compress", compression, out_dir=tmp_path / "compressed")
+    assert not read_reports(out_dir)
+    assert read_compressed(out_dir, suffix, compression) == plain
+
+
+def test_compact_reports_have_no_whitespace(run_export, tmp_path):
+    plain = read_reports(run_export(out_dir=tmp_path / "plain"))
+    out_dir = run_export("--compact", "true", out_dir=tmp_path / "compact")
+    assert read_reports(out_dir) == plain
+    for name in plain:
+        with open(os.path.join(out_dir, name), encoding="utf-8") as report_file:
+            assert "\n" not in report_file.read()
+
+
+@pytest.mark.parametrize("bundle", ["tar", "zip"])
+def test_reports_are_bundled(run_export, tmp_path, bundle):
+    plain = read_reports(run_export(out_dir=tmp_path / "plain"))
+    out_dir = run_export("--bundle", bundle, "--compress", "gzip", out_dir=tmp_path / "bundle")
+    assert not [x for x in os.listdir(out_dir) if x.endswith(".json.gz")]
+    path = os.path.join(out_dir, f"{cli.BUNDLE_NAME}.{bundle}")
+    if bundle == "zip":
+        with zipfile.ZipFile(path) as archive:
+            names = archive.namelist()
+            assert all(x.compress_type == zipfile.ZIP_STORED for x in archive.infolist())
+            archive.extractall(tmp_path / "extracted")
+    else:
+        with tarfile.open(path) as archive:
+            names = archive.getnames()
+            archive.extractall(tmp_path / "extracted")
+    assert len(names) == PROJECTS
+    assert read_compressed(str(tmp_path / "extracted"), ".gz", "gzip") == plain
+
+
+@pytest.mark.parametrize("option", [["--compress", "bzip2"], ["--bundle", "rar"]])
+def test_unsupported_output_is_an_error(mock_server, tmp_path, option):
+    with pytest.raises(SystemExit) as err:
+        cli.main(["--user-key", USER_KEY, "--api-key", ORG_TOKEN, "--url", mock_server.url, "--dir", str(tmp_path),
+                  *option])
+    assert err.value.code
@@ -0,0 +1,45 @@
+import pytest
+
+from conftest import PROJECTS, read_reports
+
+
+@pytest.mark.parametrize("sbom_type, options", [
+    ("spdx", ["--lictext", "true"]),
+    ("spdx", ["--lictext", "true", "--dedupLicenses", "true", "--stream", "true"]),
+    ("cdx", []),
+    ("cdx", ["--lictext", "true", "--licCache", "cache"]),
+])
+def test_reports_of_the_worker_processes_equal_the_threaded_ones(run_export, tmp_path, sbom_type, options):
+    options = [str(tmp_path / x) if x == "cache" else x for x in options]
+    threaded = read_reports(run_export("--type", sbom_type, *options, out_dir=tmp_path / "threads"))
+    processes = read_reports(run_export("--type", sbom_type, "--processes", "2", *options,
+                                        out_dir=tmp_path / "processes"))
+    assert len(processes) == PROJECTS
+    assert processes == threaded
+
+
+def test_async_engine_with_worker_processes(run_export, tmp_path):
+    pytest.importorskip("aiohttp")
+    threaded = read_reports(run_export("--lictext", "true", out_dir=tmp_path / "threads"))
+    processes = read_reports(run_export("--engine", "async", "--processes", "auto", "--lictext", "true",
+                                        out_dir=tmp_path / "processes"))
+    assert processes == threaded
+
+
+def test_aggregate_and_delta_with_worker_processes(run_export, tmp_path):
+    threaded = read_reports(run_export("--aggregate", "org", "--delta", "true", out_dir=tmp_path / "threads"))
+    processes = read_reports(run_export("--aggregate", "org", "--delta", "true", "--processes", "2",
+                                        out_dir=tmp_path / "processes"))
+    assert len([x for x in processes if x.endswith(".delta.json")]) == PROJECTS
+    assert processes.keys() == threaded.keys()
+    for name, doc in threaded.items():
+        # The aggregated SBOM and the delta reports carry the time they were generated, and the elements of the
+        # aggregated SBOM follow the order in which the reports were completed
+        for key_ in ("generated", "creationInfo", "documentNamespace"):
+            doc.pop(key_, None)
+            processes[name].pop(key_, None)
+        for key_ in ("packages", "relationships"):
+            if name.startswith("Aggregated"):
+                doc[key_] = sorted(doc[key_], key=str)
+                processes[name][key_] = sorted(processes[name][key_], key=str)
+        assert processes[name] == doc
@@ -0,0 +1,72 @@
+import base64
+import copy
+import json
+
+from mock_server import MockOrg
+from mend_sbom_export_cli import mend_api
+from mend_sbom_export_cli.processing import enrich_cdx_data, enrich_spdx_data
+
+
+def get_lic_texts(org: MockOrg, project: dict, sbom_type: str) -> dict:
+    config = mend_api.ApiConfig(url="", user_key="", ws_client=None, metrics=None, sbom_type=sbom_type)
+    return mend_api.parse_lic_texts(config, json.dumps(org.attribution(project)))
+
+
+def baseline_spdx_join(sbom_prj: dict, lic_texts: dict):
+    """The join of the license texts before the per-project index"""
+    set_spdx_values = set(item['SPDXID'] for item in sbom_prj["packages"])
+    for lic_lib in [key_ for key_ in lic_texts.keys() if key_ in set_spdx_values]:
+        sbom_prj.setdefault("hasExtractedLicensingInfos", []).append({
+            "licenseId": lic_lib.replace('SPDXRef-PACKAGE-', 'LicenseRef-'),
+            "extractedText": lic_texts.get(lic_lib),
+            "name": lic_lib.replace('SPDXRef-PACKAGE-', 'LicenseRef-'),
+        })
+
+
+def baseline_cdx_join(cdx_data: dict, lic_texts: dict):
+    """The join of the license texts before the per-project index"""
+    for el_ in cdx_data["components"]:
+        lic_txt = []
+        for license_ in el_["licenses"]:
+            license_name = license_["license"].get("id") or license_["license"].get("name", "")
+            lic_text = lic_texts.get(f"SPDXRef-PACKAGE-{el_['name']}::{license_name}")
+            lic_text = lic_text if lic_text else lic_texts.get(
+                f"SPDXRef-PACKAGE-{el_['name']}::{license_name.replace('-', ' ').replace('_', ' ')}")
+            if lic_text is not None:
+                lic_txt.append({"license": {"name": license_name, "text": {
+                    "contentType": "text/plain", "encoding": "base64",
+                    "content": base64.b64encode(lic_text.encode('utf-8')).decode('utf-8')}}})
+        if lic_txt:
+            el_["evidence"] = {"licenses": lic_txt}
+
+
+def test_spdx_join_equals_the_baseline():
+    org = MockOrg(projects=3, components=50, libraries=80)
+    for project in org.projects:
+        lic_texts = dict(reversed(get_lic_texts(org, project, "spdx").items()))
+        lic_texts.pop(next(iter(lic_texts)))
+        lic_texts["SPDXRef-PACKAGE-not-in-the-project"] = "text"
+        expected, actual = org.spdx(project), org.spdx(project)
+        baseline_spdx_join(expected, lic_texts)
+        enrich_spdx_data(actual, lic_texts)
+        assert actual == expected
+
+
+def test_cdx_join_equals_the_baseline():
+    org = MockOrg(projects=3, components=50, libraries=80)
+    for project in org.projects:
+        lic_texts = get_lic_texts(org, project, "cdx")
+        cdx_data = org.cyclonedx(project)
+        first, second, third = cdx_data["components"][:3]
+        # Only the license names of the components are normalized, not those of the attribution report
+        first["licenses"] = [{"license": {"name": "Apache-2.0"}}]
+        lic_texts[f"SPDXRef-PACKAGE-{first['name']}::Apache 2.0"] = "normalized match"
+        second["licenses"] = [{"license": {"name": "Apache 2.0"}}]
+        lic_texts[f"SPDXRef-PACKAGE-{second['name']}::Apache-2.0"] = "no match"
+        third["licenses"] = [{"license": {"id": "MIT"}}]
+        lic_texts[f"SPDXRef-PACKAGE-{third['name']}::MIT"] = ""
+        expected, actual = copy.deepcopy(cdx_data), copy.deepcopy(cdx_data)
+        baseline_cdx_join(expected, lic_texts)
+        enrich_cdx_data(actual, lic_texts)
+        assert actual == expected
+        assert "evidence" in actual["components"][0] and "evidence" not in actual["components"][1]
@@ -0,0 +1,62 @@
+import json
+import os
+
+from conftest import PROJECTS, record_requests
+from mock_server import make_token
+from mend_sbom_export_cli.metrics import RunMetrics
+from mend_sbom_export_cli.scheduling import CostHistory, LaneQueue, TailTracker
+
+
+def get_projects(count: int) -> list:
+    return [{make_token("project", i): f"Product:Project {i}"} for i in range(count)]
+
+
+def test_longest_projects_first(tmp_path):
+    projects = get_projects(4)
+    history = CostHistory(str(tmp_path))
+    for i, seconds in enumerate([1.0, 5.0, 3.0]):
+        history.record(make_token("project", i), seconds)
+    history.save()
+
+    ordered = CostHistory(str(tmp_path)).order(projects)
+    # Project 3 has no history and is estimated at the median duration, 3 seconds, after Project 2
+    assert [next(iter(x.values())) for x in ordered] == \
+        ["Product:Project 1", "Product:Project 2", "Product:Project 3", "Product:Project 0"]
+
+
+def test_discovery_order_without_history(tmp_path):
+    projects = get_projects(4)
+    assert CostHistory(str(tmp_path)).order(projects) == projects
+
+
+def test_small_lane_takes_the_smallest_end():
+    lanes = LaneQueue(["large", "medium", "small"])
+    assert lanes.take(small=True) == "small"
+    assert lanes.take() == "large"
+    assert lanes.take(small=True) == "medium"
+    assert lanes.take() is None
+
+
+def test_tail_of_the_run():
+    metrics = RunMetrics()
+    tail = TailTracker(total=3, workers=2)
+    for _ in range(3):
+        tail.done()
+    tail.observe(metrics)
+    assert metrics.phases["tail"].summary()["count"] == 1
+    assert metrics.phases["tail_idle"].summary()["count"] == 1
+
+
+def test_export_records_the_durations_and_starts_the_longest(run_export, mock_server, tmp_path):
+    out_dir = run_export("--metrics-out", str(tmp_path / "metrics.json"))
+    with open(os.path.join(out_dir, CostHistory.HISTORY_FILE), encoding="utf-8") as f:
+        assert len(json.load(f)["projects"]) == PROJECTS
+    with open(tmp_path / "metrics.json", encoding="utf-8") as f:
+        assert "tail" in json.load(f)["phases"]
+
+    history = CostHistory(out_dir)
+    history.seconds = {make_token("project", i): float(i) for i in range(PROJECTS)}
+    history.save()
+    requested = record_requests(mock_server, "getProjectSpdxReport")
+    run_export("--threads", "1", "--smallLane", "0")
+    assert requested == [make_token("project", i) for i in reversed(range(PROJECTS))]
@@ -0,0 +1,123 @@
+import json
+import os
+import queue
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from conftest import ORG_TOKEN, PROJECTS, USER_KEY, read_reports, record_requests
+from mend_sbom_export_cli import sbom_export_cli as cli
+from mend_sbom_export_cli.service import ExportService, create_handler, get_job_argv
+
+
+@pytest.fixture
+def get_service(mock_server, tmp_path):
+    services = []
+
+    def get(start: bool = True, **kwargs):
+        service = ExportService(["--user-key", USER_KEY, "--api-key", ORG_TOKEN, "--url", mock_server.url],
+                                base_dir=str(tmp_path), **kwargs)
+        if start:
+            service.start()
+        services.append((service, start))
+        return service
+
+    yield get
+    for service, started in services:
+        cli.logger.removeHandler(service.log_handler)
+        if started:
+            service.close()
+
+
+@pytest.fixture
+def serve(get_service):
+    servers = []
+
+    def start(**kwargs) -> str:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), create_handler(get_service(**kwargs)))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def wait(job):
+    return list(job.iter_events())
+
+
+def request(url: str, body: dict = None):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=30) as response:
+            return response.status, response.read().decode("utf-8")
+    except urllib.error.HTTPError as err:
+        return err.code, err.read().decode("utf-8")
+
+
+def test_job_arguments(tmp_path):
+    base_dir = str(tmp_path)
+    argv = get_job_argv(["--dir", "out", "--type=cdx"], base_dir)
+    assert argv == ["--dir", os.path.join(base_dir, "out"), "--type", "cdx"]
+    for argv in (["--user-key", "x"], ["--url=http://elsewhere"], ["--ty", "cdx"], ["--dir", "../out"],
+                 ["--metricsOut", "/tmp/metrics.json"], ["--dir"], ["--dir", "--type"]):
+        with pytest.raises(ValueError):
+            get_job_argv(argv, base_dir)
+
+
+def test_jobs_reuse_the_session(get_service, mock_server, tmp_path):
+    service = get_service()
+    first = service.submit(["--dir", "out", "--discoveryTtl", "1"])
+    wait(first)
+    ws_client = service.session.ws_client
+    discovery = record_requests(mock_server, "getOrganizationProjectVitals")
+    second = service.submit(["--dir", "out", "--discoveryTtl", "1", "--type", "cdx"])
+    events = wait(second)
+
+    assert first.status == second.status == "succeeded"
+    assert len(first.reports) == len(second.reports) == PROJECTS
+    assert len(read_reports(str(tmp_path / "out"))) == 2 * PROJECTS
+    assert service.session.ws_client is ws_client
+    assert not discovery
+    assert [x["status"] for x in events if "status" in x] == ["queued", "running", "succeeded"]
+    assert any("message" in x for x in events)
+
+
+def test_failed_job(get_service):
+    service = get_service()
+    job = service.submit(["--type", "xml"])
+    wait(job)
+    assert job.status == "failed" and job.exit_code
+    assert service.get_health()["running"] == 0
+
+
+def test_http_api(serve, tmp_path):
+    url = serve()
+    assert json.loads(request(f"{url}/health")[1])["status"] == "ok"
+    assert request(f"{url}/jobs", {"args": ["--api-key", ORG_TOKEN]})[0] == 400
+    assert request(f"{url}/jobs/unknown")[0] == 404
+
+    code, body = request(f"{url}/jobs", {"args": ["--dir", "http"]})
+    assert code == 202
+    job_id = json.loads(body)["id"]
+    events = [json.loads(x) for x in request(f"{url}/jobs/{job_id}/events")[1].splitlines()]
+    assert events[-1]["status"] == "succeeded" and len(events[-1]["reports"]) == PROJECTS
+    assert json.loads(request(f"{url}/jobs/{job_id}")[1])["status"] == "succeeded"
+    assert len(read_reports(str(tmp_path / "http"))) == PROJECTS
+
+
+def test_full_queue_is_rejected(serve, get_service):
+    url = serve(start=False, queue_size=1)
+    assert request(f"{url}/jobs", {"args": []})[0] == 202
+    assert request(f"{url}/jobs", {"args": []})[0] == 429
+
+    service = get_service(start=False, queue_size=1)
+    service.submit([])
+    with pytest.raises(queue.Full):
+        service.submit([])
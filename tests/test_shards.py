@@ -0,0 +1,52 @@
+import json
+import os
+
+from conftest import PROJECTS, read_reports
+from mock_server import make_token
+from mend_sbom_export_cli.shards import filter_shard, merge, shard_of
+
+
+def test_shards_partition_the_projects():
+    projects = [{make_token("project", i): f"Product:Project {i}"} for i in range(100)]
+    shards = [filter_shard(projects, i, 3) for i in range(3)]
+    assert all(shards)
+    assert sum(len(x) for x in shards) == len(projects)
+    assert sorted(next(iter(x)) for shard in shards for x in shard) == sorted(next(iter(x)) for x in projects)
+    assert all(shard_of(next(iter(x)), 3) == i for i, shard in enumerate(shards) for x in shard)
+    assert filter_shard(projects, 0, 1) == projects
+
+
+def test_shards_are_merged(run_export, tmp_path):
+    out_dir = str(tmp_path / "out")
+    for i in range(2):
+        run_export("--shardIndex", str(i), "--shardCount", "2", "--metrics-out", str(tmp_path / f"metrics-{i}.json"),
+                   out_dir=out_dir)
+    assert len(read_reports(out_dir, "SPDX")) == PROJECTS
+    assert os.path.exists(os.path.join(out_dir, ".sbom_export_journal.shard-1-of-2.jsonl"))
+
+    summary = merge([out_dir], [str(tmp_path / f"metrics-{i}.json") for i in range(2)])
+    assert summary["shard_count"] == 2
+    assert summary["missing_shards"] == []
+    assert summary["reports"] == PROJECTS
+    assert sorted(x for shard in summary["shards"].values() for x in shard["files"]) == \
+        sorted(read_reports(out_dir, "SPDX"))
+    assert json.loads(json.dumps(summary["metrics"]))
+
+
+def test_missing_shards_are_reported(run_export, tmp_path):
+    out_dir = run_export("--shardIndex", "1", "--shardCount", "3")
+    assert merge([out_dir], [])["missing_shards"] == [0, 2]
+
+
+def test_stray_files_and_records_are_skipped(run_export, tmp_path):
+    out_dir = run_export("--shardIndex", "0", "--shardCount", "2")
+    journal_path = os.path.join(out_dir, ".sbom_export_journal.shard-0-of-2.jsonl")
+    with open(journal_path, "a", encoding="utf-8") as f:
+        f.write('[]\n{"event": "done"}\n')
+    with open(os.path.join(out_dir, ".sbom_export_journal.shard-x-of-2.jsonl"), "w", encoding="utf-8") as f:
+        f.write('{"event": "start", "options": "spdx"}\n')
+
+    summary = merge([out_dir], [])
+    assert list(summary["shards"]) == ["0"]
+    assert summary["reports"] == len(read_reports(out_dir, "SPDX"))
+    assert summary["missing_shards"] == [1]
@@ -0,0 +1,109 @@
+import json
+import os
+
+from conftest import PROJECTS, fail_project, read_reports
+from mock_server import make_token
+from mend_sbom_export_cli.shards import read_journal
+from mend_sbom_export_cli.state import RunJournal
+
+
+def test_journal_resume(tmp_path):
+    journal = RunJournal(str(tmp_path), "spdx")
+    journal.record_done("a", "SPDX report for a.json")
+    journal.record_submitted("b", "uuid-b")
+    journal.record_done("c", "SPDX report for c.json")
+    journal.record_failed("c")
+    journal.close()
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"event": "done", "tok')  # torn by an interruption
+
+    resumed = RunJournal(str(tmp_path), "spdx", resume=True)
+    assert resumed.done == {"a": "SPDX report for a.json"}
+    assert resumed.get_uuid("b") == "uuid-b"
+    assert resumed.filter_done([{"a": ""}, {"b": ""}, {"c": ""}]) == [{"b": ""}, {"c": ""}]
+    resumed.record_done("b", "SPDX report for b.json")
+    resumed.close()
+    with open(resumed.path, encoding="utf-8") as f:
+        assert json.loads(f.readlines()[-1])["token"] == "b"
+
+
+def test_journal_of_a_completed_run_is_not_resumed(tmp_path):
+    journal = RunJournal(str(tmp_path), "spdx")
+    journal.record_done("a", "SPDX report for a.json")
+    journal.record_end()
+    journal.close()
+
+    resumed = RunJournal(str(tmp_path), "spdx", resume=True)
+    assert resumed.done == {}
+    assert resumed.filter_done([{"a": ""}]) == [{"a": ""}]
+    resumed.close()
+    with open(resumed.path, encoding="utf-8") as f:
+        assert [json.loads(x)["event"] for x in f] == ["start"]
+
+
+def test_records_that_are_not_journal_records_are_skipped(tmp_path):
+    journal = RunJournal(str(tmp_path), "spdx")
+    journal.record_done("a", "SPDX report for a.json")
+    journal.close()
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('[1, 2]\n"done"\n{"token": "b"}\n{"event": ["done"]}\n{"event": "done", "token": "c"}\n')
+
+    resumed = RunJournal(str(tmp_path), "spdx", resume=True)
+    assert resumed.done == {"a": "SPDX report for a.json"}
+    resumed.close()
+
+
+def test_journal_of_other_options_is_ignored(tmp_path):
+    journal = RunJournal(str(tmp_path), "spdx")
+    journal.record_done("a", "SPDX report for a.json")
+    journal.close()
+    resumed = RunJournal(str(tmp_path), "cdx", resume=True)
+    assert resumed.done == {}
+    resumed.close()
+
+
+def drop_end_record(journal_path: str):
+    """Turns the journal of a completed run into that of a run interrupted before its end"""
+    with open(journal_path, encoding="utf-8") as f:
+        lines = f.readlines()
+    assert json.loads(lines[-1]) == {"event": "end"}
+    with open(journal_path, "w", encoding="utf-8") as f:
+        f.writelines(lines[:-1])
+
+
+def test_resume_exports_the_failed_projects(run_export, mock_server):
+    failed = make_token("project", 2)
+    handler = fail_project(mock_server, "getProjectSpdxReport", failed)
+    out_dir = run_export()
+    journal_path = os.path.join(out_dir, RunJournal.JOURNAL_FILE)
+    assert failed not in read_journal(journal_path)["done"]
+    assert len(read_journal(journal_path)["done"]) == PROJECTS - 1
+    drop_end_record(journal_path)
+
+    mock_server._on_getProjectSpdxReport = handler
+    mock_server.reset_counters()
+    run_export("--resume", "true")
+    assert mock_server.counters["getProjectSpdxReport"] == 1
+    assert len(read_journal(journal_path)["done"]) == PROJECTS
+    assert all("spdxVersion" in x for x in read_reports(out_dir, "SPDX").values())
+
+
+def test_resume_after_a_completed_run_exports_every_project(run_export, mock_server):
+    run_export("--resume", "true")
+    mock_server.reset_counters()
+    run_export("--resume", "true")
+    assert mock_server.counters["getProjectSpdxReport"] == PROJECTS
+
+
+def test_incremental_skips_unchanged_projects(run_export, mock_server):
+    out_dir = run_export("--incremental", "true")
+    mock_server.reset_counters()
+    run_export("--incremental", "true")
+    assert mock_server.counters["getProjectSpdxReport"] == 0
+
+    mock_server.org.projects[0]["lastUpdatedDate"] = "2024-07-01 00:00:00"
+    os.remove(os.path.join(out_dir, "SPDX report for Project 1.json"))
+    mock_server.reset_counters()
+    run_export("--incremental", "true")
+    assert mock_server.counters["getProjectSpdxReport"] == 2
+    assert len(read_reports(out_dir, "SPDX")) == PROJECTS
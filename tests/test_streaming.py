@@ -0,0 +1,24 @@
+import pytest
+
+from conftest import PROJECTS, read_reports
+
+pytest.importorskip("ijson")
+
+
+@pytest.mark.parametrize("options", [
+    [],
+    ["--lictext", "true"],
+    ["--lictext", "true", "--dedupLicenses", "true"],
+])
+def test_streamed_spdx_equals_in_memory(run_export, tmp_path, options):
+    in_memory = read_reports(run_export(*options, out_dir=tmp_path / "memory"), "SPDX")
+    streamed = read_reports(run_export("--stream", "true", *options, out_dir=tmp_path / "stream"), "SPDX")
+    assert len(streamed) == PROJECTS
+    assert streamed == in_memory
+
+
+def test_streamed_spdx_in_worker_processes(run_export, tmp_path):
+    in_memory = read_reports(run_export("--lictext", "true", out_dir=tmp_path / "memory"), "SPDX")
+    streamed = read_reports(run_export("--lictext", "true", "--stream", "true", "--processes", "2",
+                                       out_dir=tmp_path / "stream"), "SPDX")
+    assert streamed == in_memory
@@ -0,0 +1,88 @@
+import pytest
+import requests
+
+from mend_sbom_export_cli.ws_client import RequestGovernor, parse_retry_after
+
+
+def get_response(status: int, retry_after: str = "") -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content, response._content_consumed = b"", True
+    if retry_after:
+        response.headers["Retry-After"] = retry_after
+    return response
+
+
+def get_sender(*results):
+    """send() returning the responses (or raising the exceptions) of `results` one by one"""
+    calls = []
+
+    def send():
+        result = results[len(calls)]
+        calls.append(result)
+        if isinstance(result, Exception):
+            raise result
+        return get_response(result)
+
+    return send, calls
+
+
+def test_retries_until_success():
+    governor = RequestGovernor(max_retries=3, backoff_base=0.001)
+    send, calls = get_sender(503, 500, 200)
+    assert governor.execute("getProjectVitals", send).status_code == 200
+    assert len(calls) == 3
+    assert governor.stats["getProjectVitals"] == {"requests": 3, "ok": 1, "retries": 2, "failed": 0}
+
+
+def test_connection_errors_are_retried():
+    governor = RequestGovernor(max_retries=2, backoff_base=0.001)
+    send, calls = get_sender(requests.ConnectionError("reset"), 200)
+    assert governor.execute("getProjectVitals", send).status_code == 200
+    assert len(calls) == 2
+
+
+def test_gives_up_after_max_retries():
+    governor = RequestGovernor(max_retries=2, backoff_base=0.001)
+    send, calls = get_sender(503, 503, 503)
+    assert governor.execute("getProjectVitals", send).status_code == 503
+    assert len(calls) == 3
+    assert governor.stats["getProjectVitals"]["failed"] == 1
+
+
+def test_client_errors_are_not_retried():
+    governor = RequestGovernor(max_retries=3, backoff_base=0.001)
+    send, calls = get_sender(404)
+    assert governor.execute("getProjectVitals", send).status_code == 404
+    assert len(calls) == 1
+    assert governor.stats["getProjectVitals"]["failed"] == 1
+
+
+def test_retry_after_is_the_delay():
+    governor = RequestGovernor(max_retries=3, backoff_base=100)
+    assert governor.on_failure("getProjectVitals", 0, status=429, retry_after="2") == 2
+    assert parse_retry_after("Thu, 01 Jan 1970 00:00:00 GMT") == 0
+    assert parse_retry_after("soon") is None
+
+
+def test_throttling_lowers_the_concurrency():
+    governor = RequestGovernor(max_concurrency=8, max_retries=3)
+    governor.on_failure("getProjectVitals", 0, status=429, retry_after="0")
+    assert governor.limit == 4
+    for _ in range(4):
+        governor.on_success("getProjectVitals")
+    assert governor.limit == 5
+
+
+def test_breaker_pauses_all_requests():
+    governor = RequestGovernor(max_retries=0, breaker_threshold=3, breaker_cooldown=30)
+    assert governor.reserve() == 0
+    for _ in range(3):
+        governor.on_failure("getProjectVitals", 0, status=503)
+    assert governor.reserve() == pytest.approx(30, abs=1)
+
+
+def test_rate_limit_spaces_the_requests():
+    governor = RequestGovernor(rate=2)
+    waits = [governor.reserve() for _ in range(4)]
+    assert waits == pytest.approx([0, 0, 0.5, 1.0], abs=0.05)